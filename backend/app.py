@@ -1,11 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 from models import db, User, Conversation
-from services.ai_service import get_llm_response
+from services.ai_service import get_llm_response, stream_llm_response, FallbackReply, StreamInterrupted
+from services.llm_limiter import llm_limiter, LimiterSaturated
+from services.circuit_breaker import llm_breaker
+from services.idempotency import (
+    idempotency_store, request_fingerprint, IdempotencyConflict, MAX_KEY_LENGTH, FALLBACK_HEADER,
+    IDEMPOTENCY_RETRY_AFTER
+)
+from services.chat_jobs import (
+    chat_jobs, job_to_dict, JobQueueFull, JobConflict, CHAT_JOB_MAX_WAIT, CHAT_JOB_RETRY_AFTER, DONE, LOST
+)
+from services.embedding_service import get_text_embedding
+from services.write_behind import (
+    write_behind, PendingConversation, token_age, WRITE_BEHIND_ENABLED, WRITE_BEHIND_TOKEN_TIMEOUT
+)
+from services.vector_index import refresh_user_index
+from services.retrieval_cache import retrieval_cache
+from services.response_cache import semantic_cache
+from services.stage_timer import timed_stage
+from services.db_profile import DATABASE_URL, engine_options, database_stats
+from services import summarizer
 import os
+import json
+import numpy as np
+from sqlalchemy import tuple_
 
 # 生产环境API密钥配置示例（开发阶段可暂时不用）
 # VOLCENGINE_API_KEY = os.getenv('VOLCENGINE_API_KEY')
@@ -16,9 +38,11 @@ app = Flask(__name__)
 # 配置CORS，允许来自前端http://localhost:3000的请求
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
-# 数据库配置
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
+# 数据库配置（DATABASE_URL，默认SQLite）
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# 连接池和SQLite连接参数（WAL等），由DB_PROFILE选择
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 # JWT配置
 app.config['JWT_SECRET_KEY'] = 'your-secret-string-here'  # 在生产环境中应使用环境变量
@@ -28,11 +52,43 @@ db.init_app(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
 
-# SQLite数据库配置（不需要pgvector扩展）
+# 异步提交的对话任务在后台线程中执行，状态写入数据库
+chat_jobs.init_app(app)
+
+# 对话记录由后台线程批量写入（WRITE_BEHIND_ENABLED=1时开启）
+if WRITE_BEHIND_ENABLED:
+    write_behind.init_app(app)
+
+# 后台定期把较早的对话压缩为摘要（SUMMARY_ENABLED=1时开启）
+if summarizer.SUMMARY_ENABLED:
+    summarizer.SummaryWorker(app).start()
+
+@app.after_request
+def add_server_timing(response):
+    """把本次请求各阶段的耗时写入Server-Timing响应头，上下文token数写入X-Context-Tokens响应头"""
+    stage_timer = g.get('stage_timer')
+    if stage_timer is not None:
+        response.headers['Server-Timing'] = stage_timer.server_timing_header()
+        app.logger.info(f"{request.method} {request.path} 阶段耗时: {stage_timer.summary()}")
+    context_tokens = g.get('context_tokens')
+    if context_tokens is not None:
+        response.headers['X-Context-Tokens'] = str(context_tokens['total'])
+        app.logger.info(f"{request.method} {request.path} 上下文token: {context_tokens}")
+    return response
 
 @app.route('/api/health')
 def health_check():
-    return jsonify({"status": "ok"})
+    return jsonify({
+        "status": "ok",
+        "retrieval_cache": retrieval_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "llm_limiter": llm_limiter.stats(),
+        "llm_breaker": llm_breaker.stats(),
+        "idempotency": idempotency_store.stats(),
+        "chat_jobs": chat_jobs.stats(),
+        "write_behind": write_behind.stats(),
+        "database": database_stats(db.engine)
+    })
 
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -88,90 +144,407 @@ def login():
     except Exception as e:
         return jsonify({'error': '登录失败'}), 500
 
+# 对话历史分页：默认每页条数和最大条数
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 @app.route('/api/conversations', methods=['GET'])
 @jwt_required()
 def get_conversations():
+    """
+    按游标分页获取对话历史，结果按时间升序排列
+    
+    查询参数：
+    - before: 对话ID，返回早于该条的记录（向更早翻页）
+    - after: 对话ID，返回晚于该条的记录（获取新消息）
+    - limit: 每页条数，默认50，最大200
+    都不传时返回最近的一页。next_cursor为继续翻页时使用的游标（沿同一方向），没有更多记录时为null
+    """
     try:
         # 获取当前用户ID（字符串类型，需要转换为整数）
         current_user_id = int(get_jwt_identity())
         
-        # 查询该用户的所有对话记录，按时间升序排列
-        conversations = Conversation.query.filter_by(user_id=current_user_id).order_by(Conversation.timestamp.asc()).all()
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            before = request.args.get('before')
+            before = int(before) if before is not None else None
+            after = request.args.get('after')
+            after = int(after) if after is not None else None
+        except ValueError:
+            return jsonify({'error': '分页参数无效'}), 400
+        if before is not None and after is not None:
+            return jsonify({'error': 'before和after不能同时使用'}), 400
+        
+        # 后台批量写入时先等该用户已提交的对话落库，保证能读到自己刚发送的消息
+        if write_behind.running:
+            write_behind.wait_for_user(current_user_id)
+        
+        query = Conversation.query.filter_by(user_id=current_user_id)
+        
+        # 游标对应记录的(timestamp, id)作为键集分页的起点；用行值比较，
+        # SQLite才能在(user_id, timestamp, id)复合索引上做范围查找（OR展开的写法只能按user_id扫描）
+        cursor_id = before if before is not None else after
+        if cursor_id is not None:
+            cursor = Conversation.query.with_entities(Conversation.timestamp).filter_by(
+                id=cursor_id, user_id=current_user_id
+            ).first()
+            if cursor is None:
+                return jsonify({'error': '无效的游标'}), 400
+            key = tuple_(Conversation.timestamp, Conversation.id)
+            if after is not None:
+                query = query.filter(key > tuple_(cursor.timestamp, cursor_id))
+            else:
+                query = query.filter(key < tuple_(cursor.timestamp, cursor_id))
         
-        # 转换为JSON格式
-        conversations_data = []
-        for conv in conversations:
-            conversations_data.append({
-                'id': conv.id,
-                'role': conv.role,
-                'content': conv.content,
-                'timestamp': conv.timestamp.isoformat()
-            })
+        # 多取一条用于判断是否还有更多记录
+        if after is not None:
+            conversations = query.order_by(
+                Conversation.timestamp.asc(), Conversation.id.asc()
+            ).limit(limit + 1).all()
+            has_more = len(conversations) > limit
+            conversations = conversations[:limit]
+        else:
+            conversations = query.order_by(
+                Conversation.timestamp.desc(), Conversation.id.desc()
+            ).limit(limit + 1).all()
+            has_more = len(conversations) > limit
+            conversations = conversations[:limit][::-1]
+        
+        next_cursor = None
+        if has_more:
+            next_cursor = conversations[-1].id if after is not None else conversations[0].id
         
-        return jsonify({'conversations': conversations_data}), 200
+        return jsonify({
+            'conversations': [conversation_to_dict(conv) for conv in conversations],
+            'next_cursor': next_cursor
+        }), 200
         
     except Exception as e:
         print(f"An error occurred in {request.endpoint}: {e}")
         app.logger.error(f"Error in get_conversations: {str(e)}")
         return jsonify({'error': '获取对话历史失败'}), 500
 
-@app.route('/api/conversations', methods=['POST'])
-@jwt_required()
-def handle_conversation():
+def get_user_message(data):
+    """从请求数据中取出用户消息，支持message和content两种字段名，为空时返回None"""
+    message_content = (data or {}).get('message') or (data or {}).get('content')
+    if not message_content or not str(message_content).strip():
+        return None
+    return str(message_content).strip()
+
+def use_response_cache():
+    """请求头带有Cache-Control: no-cache时跳过语义回复缓存，强制重新生成回复"""
+    return 'no-cache' not in request.headers.get('Cache-Control', '').lower()
+
+def save_conversation_turn(user_id, user_message, user_embedding, ai_response):
+    """
+    保存一轮对话（用户消息及其AI回复）并同步到向量索引
+    启用后台批量写入时只放入写入队列，立即返回尚未落库的记录（id为None）
+    
+    Returns:
+        Conversation: AI回复记录
+    """
+    if write_behind.running:
+        return write_behind.enqueue(user_id, user_message, user_embedding, ai_response)
+    
+    # 保存用户消息到数据库（包含向量）
+    user_conversation = Conversation(
+        user_id=user_id,
+        content=user_message,
+        role='user',
+        embedding=user_embedding
+    )
+    db.session.add(user_conversation)
+    
+    # 保存AI回复到数据库
+    ai_conversation = Conversation(
+        user_id=user_id,
+        content=ai_response,
+        role='ai',
+        reply_to=user_conversation
+    )
+    db.session.add(ai_conversation)
+    
+    # 提交数据库事务
+    with timed_stage('db_commit'):
+        db.session.commit()
+    
+    # 把新消息增量追加到本进程的向量索引（该用户缓存的检索结果已在提交时失效）
+    refresh_user_index(user_id)
+    return ai_conversation
+
+def conversation_to_dict(conversation):
+    """把对话记录转换为接口返回的JSON结构；尚未落库的记录附带待落库凭据pending_token"""
+    data = {
+        'id': conversation.id,
+        'role': conversation.role,
+        'content': conversation.content,
+        'timestamp': conversation.timestamp.isoformat()
+    }
+    if isinstance(conversation, PendingConversation):
+        data['pending_token'] = conversation.token
+    return data
+
+def pending_location(token):
+    """查询待落库对话的地址"""
+    return f'/api/conversations/pending/{token}'
+
+def run_conversation_turn(user_id, user_message, use_cache=True):
+    """
+    执行一轮对话：向量化、检索记忆、调用大模型并保存
+    
+    Returns:
+        Tuple[Dict, int, Dict]: (响应体, 状态码, 响应头)
+    """
     try:
-        # 获取当前用户ID
-        current_user_id = get_jwt_identity()
-        
-        # 获取请求数据
-        data = request.get_json()
-        
-        # 强化输入验证 - 支持message和content两种字段名
-        message_content = data.get('message') or data.get('content')
-        if not data or not message_content or not str(message_content).strip():
-            return jsonify({'error': '消息内容不能为空'}), 400
-        
-        user_message = str(message_content).strip()
-        
-        # 生成用户消息的向量
-        from services.embedding_service import get_text_embedding
-        import numpy as np
+        # 生成用户消息的向量（整个请求只计算一次）
         user_embedding = np.array(get_text_embedding(user_message))
         
-        # 调用AI服务获取回复（传入用户ID以启用长期记忆）
-        ai_response = get_llm_response(user_message, current_user_id)
-        
-        # 保存用户消息到数据库（包含向量）
-        user_conversation = Conversation(
-            user_id=current_user_id,
-            content=user_message,
-            role='user',
-            embedding=user_embedding
-        )
-        db.session.add(user_conversation)
-        
-        # 保存AI回复到数据库
-        ai_conversation = Conversation(
-            user_id=current_user_id,
-            content=ai_response,
-            role='ai'
-        )
-        db.session.add(ai_conversation)
+        # 调用AI服务获取回复（传入用户ID以启用长期记忆，复用已计算的向量）
+        ai_response = get_llm_response(user_message, user_id, user_embedding, use_cache)
         
-        # 提交数据库事务
-        db.session.commit()
+        ai_conversation = save_conversation_turn(user_id, user_message, user_embedding, ai_response)
         
-        # 返回AI回复
-        return jsonify({
-            'id': ai_conversation.id,
-            'role': 'ai',
-            'content': ai_response,
-            'timestamp': ai_conversation.timestamp.isoformat()
-        }), 201
+        # 返回AI回复；大模型不可用时的提示语用响应头标出，幂等键不会把它当作成功结果重放
+        headers = {FALLBACK_HEADER: 'true'} if isinstance(ai_response, FallbackReply) else {}
+        if isinstance(ai_conversation, PendingConversation):
+            # 后台批量写入时对话尚未落库：返回202，客户端通过Location确认它已保存
+            return conversation_to_dict(ai_conversation), 202, {
+                **headers, 'Location': pending_location(ai_conversation.token)
+            }
+        return conversation_to_dict(ai_conversation), 201, headers
         
+    except LimiterSaturated as e:
+        db.session.rollback()
+        return busy_result(e.retry_after)
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"对话处理错误: {str(e)}")
-        return jsonify({'error': '服务器内部错误'}), 500
+        return {'error': '服务器内部错误'}, 500, {}
+
+@app.route('/api/conversations', methods=['POST'])
+@jwt_required()
+def handle_conversation():
+    """
+    提交一条消息并同步返回AI回复
+    
+    请求头Idempotency-Key可选：同一用户以相同的键重复提交时（可能落在不同的worker上），
+    进行中的重复请求等待首个请求的结果，已成功的请求直接重放结果（响应头Idempotent-Replayed: true），
+    不会重复调用大模型或写入重复的对话。大模型不可用时返回的提示语带有响应头X-Fallback-Reply: true，
+    这类结果不会被重放，之后用同一个键重试会重新生成回复
+    
+    请求头带有Prefer: respond-async时改为异步提交：立即返回202和任务ID，
+    由后台线程执行对话，客户端通过GET /api/jobs/<job_id>轮询结果
+    
+    开启后台批量写入（WRITE_BEHIND_ENABLED）时，AI回复返回后对话才落库：响应为202，
+    响应体带有待落库凭据pending_token（id为null），客户端通过Location（GET /api/conversations/pending/<token>）确认保存结果
+    """
+    # 获取当前用户ID
+    current_user_id = get_jwt_identity()
+    
+    # 强化输入验证 - 支持message和content两种字段名
+    user_message = get_user_message(request.get_json(silent=True))
+    if not user_message:
+        return jsonify({'error': '消息内容不能为空'}), 400
+    
+    use_cache = use_response_cache()
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key and len(idempotency_key) > MAX_KEY_LENGTH:
+        return jsonify({'error': 'Idempotency-Key过长'}), 400
+    
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return submit_conversation_job(current_user_id, user_message, use_cache, idempotency_key)
+    
+    if not idempotency_key:
+        body, status, headers = run_conversation_turn(current_user_id, user_message, use_cache)
+        return jsonify(body), status, headers
+    
+    try:
+        entry, is_new = idempotency_store.begin(
+            current_user_id, idempotency_key, request_fingerprint(user_message)
+        )
+    except IdempotencyConflict:
+        return jsonify({'error': 'Idempotency-Key已用于内容不同的请求'}), 422
+    
+    if not is_new:
+        result = entry.wait()
+        if result is None:
+            return jsonify({'error': '相同的请求仍在处理中，请稍后重试'}), 409, {
+                'Retry-After': str(IDEMPOTENCY_RETRY_AFTER)
+            }
+        body, status, headers = result
+        return jsonify(body), status, {**headers, 'Idempotent-Replayed': 'true'}
+    
+    result = ({'error': '服务器内部错误'}, 500, {})
+    try:
+        result = run_conversation_turn(current_user_id, user_message, use_cache)
+    finally:
+        idempotency_store.finish(entry, result)
+    body, status, headers = result
+    return jsonify(body), status, headers
+
+def submit_conversation_job(user_id, user_message, use_cache, idempotency_key=None):
+    """把一轮对话交给后台线程执行，立即返回202和任务ID"""
+    try:
+        job, _ = chat_jobs.submit(
+            user_id, lambda: run_conversation_turn(user_id, user_message, use_cache),
+            idempotency_key, request_fingerprint(user_message)
+        )
+    except JobConflict:
+        return jsonify({'error': 'Idempotency-Key已用于内容不同的请求'}), 409
+    except JobQueueFull:
+        return busy_response(llm_limiter.retry_after())
+    return jsonify(job_to_dict(job)), 202, {
+        'Location': f'/api/jobs/{job.id}',
+        'Preference-Applied': 'respond-async',
+        'Retry-After': str(CHAT_JOB_RETRY_AFTER)
+    }
+
+@app.route('/api/conversations/pending/<token>', methods=['GET'])
+@jwt_required()
+def get_pending_conversation(token):
+    """
+    查询后台批量写入的对话是否已落库（任意worker都能查询）
+    
+    - 200：已落库，返回AI回复记录
+    - 202：仍在写入队列中（或刚签发，可能在其他worker的队列中），带有Retry-After
+    - 404：凭据无效，或签发超过WRITE_BEHIND_TOKEN_TIMEOUT仍未落库（写入失败的对话会在服务重启时重放）
+    """
+    current_user_id = int(get_jwt_identity())
+    conversation = Conversation.query.filter_by(client_token=token, user_id=current_user_id).first()
+    if conversation is not None:
+        return jsonify(conversation_to_dict(conversation)), 200
+    
+    age = token_age(token)
+    if age is None:
+        return jsonify({'error': '凭据无效'}), 404
+    if write_behind.is_queued(token) or age < WRITE_BEHIND_TOKEN_TIMEOUT:
+        return jsonify({'pending_token': token, 'status': 'pending'}), 202, {
+            'Retry-After': '1', 'Location': pending_location(token)
+        }
+    return jsonify({'error': '对话没有保存成功'}), 404
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_conversation_job(job_id):
+    """
+    查询异步对话任务
+    
+    查询参数：
+    - wait: 任务未完成时最多等待的秒数（长轮询），默认0立即返回，最大CHAT_JOB_MAX_WAIT
+      （sync worker下为0，即不支持长轮询）
+    完成后result_status和result分别为同步接口本应返回的状态码和响应体；
+    未完成时带有Retry-After响应头；执行它的worker退出导致任务丢失时status为lost，需重新提交
+    """
+    current_user_id = get_jwt_identity()
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), CHAT_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'wait参数无效'}), 400
+    
+    job = chat_jobs.get(current_user_id, job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if wait > 0 and job.status != DONE:
+        chat_jobs.wait(job.id, wait)
+        job = chat_jobs.get(current_user_id, job_id)
+        if job is None:
+            return jsonify({'error': '任务不存在或已过期'}), 404
+    
+    data = job_to_dict(job)
+    headers = {} if data['status'] in (DONE, LOST) else {'Retry-After': str(CHAT_JOB_RETRY_AFTER)}
+    return jsonify(data), 200, headers
+
+def busy_result(retry_after):
+    """大模型调用已饱和时的503结果，提示客户端在Retry-After秒后重试"""
+    return (
+        {'error': 'AI服务繁忙，请稍后再试', 'retry_after': retry_after},
+        503,
+        {'Retry-After': str(retry_after)}
+    )
+
+def busy_response(retry_after):
+    """大模型调用已饱和时返回503"""
+    body, status, headers = busy_result(retry_after)
+    return jsonify(body), status, headers
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_metrics():
+    """
+    流式请求结束时的阶段耗时和上下文token数
+    流式响应的响应头在检索和大模型调用之前就已发出，Server-Timing只包含向量化阶段、也没有X-Context-Tokens，
+    完整的统计放在done事件中返回并写入日志
+    """
+    stage_timer = g.get('stage_timer')
+    context_tokens = g.get('context_tokens')
+    metrics = {
+        'server_timing': stage_timer.summary() if stage_timer is not None else {},
+        'context_tokens': context_tokens['total'] if context_tokens is not None else None
+    }
+    app.logger.info(f"{request.method} {request.path} 流结束 阶段耗时: {metrics['server_timing']} "
+                    f"上下文token: {context_tokens}")
+    return metrics
+
+@app.route('/api/conversations/stream', methods=['POST'])
+@jwt_required()
+def stream_conversation():
+    """
+    流式对话接口：以SSE逐段返回AI回复
+    事件依次为若干个token（增量内容）和一个done（已保存的AI回复记录，metrics字段为阶段耗时和上下文token数）；
+    失败时为error。回复中途上游出错时发送error，不完整的回复不会保存
+    
+    与POST /api/conversations的区别：响应头在流开始时发出，Server-Timing只有embedding阶段，
+    没有X-Context-Tokens，这两项统计在done事件的metrics中返回
+    """
+    current_user_id = get_jwt_identity()
+    
+    user_message = get_user_message(request.get_json(silent=True))
+    if not user_message:
+        return jsonify({'error': '消息内容不能为空'}), 400
+    
+    # 流开始后无法再返回503，排队已满时提前拒绝
+    if not llm_limiter.has_capacity():
+        return busy_response(llm_limiter.retry_after())
+    
+    # 生成用户消息的向量（整个请求只计算一次）
+    user_embedding = np.array(get_text_embedding(user_message))
+    use_cache = use_response_cache()
+    
+    def generate():
+        try:
+            chunks = []
+            for delta in stream_llm_response(user_message, current_user_id, user_embedding, use_cache):
+                chunks.append(delta)
+                yield sse_event('token', {'content': delta})
+            
+            # 流结束后一次性保存完整回复
+            ai_conversation = save_conversation_turn(
+                current_user_id, user_message, user_embedding, ''.join(chunks).strip()
+            )
+            yield sse_event('done', {**conversation_to_dict(ai_conversation), 'metrics': stream_metrics()})
+            
+        except LimiterSaturated as e:
+            db.session.rollback()
+            yield sse_event('error', {'error': 'AI服务繁忙，请稍后再试', 'retry_after': e.retry_after})
+        except StreamInterrupted as e:
+            db.session.rollback()
+            app.logger.error(f"流式回复中断，不保存本轮对话: {str(e)}")
+            yield sse_event('error', {'error': 'AI回复中断，请重试'})
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"流式对话处理错误: {str(e)}")
+            yield sse_event('error', {'error': '服务器内部错误'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 关闭nginx等反向代理的缓冲，保证逐段送达
+        }
+    )
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
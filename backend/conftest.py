@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+pytest全局配置：测试默认使用临时目录中的SQLite数据库
+必须在任何测试模块导入app或services之前设置，否则app.py会连接instance/app.db。
+不用内存数据库（sqlite://）：内存库的所有会话共用同一个连接，后台线程（异步对话任务等）
+与请求线程的事务会在这个连接上互相提交或回滚
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+_TEST_DB_DIR = tempfile.mkdtemp(prefix='evolveme-test-')
+atexit.register(shutil.rmtree, _TEST_DB_DIR, ignore_errors=True)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(_TEST_DB_DIR, 'test.db'))
@@ -0,0 +1,11 @@
+#!/bin/sh
+# 容器入口：启动gunicorn之前先把数据库升级到最新的迁移版本
+# 新容器中会建出全部表，已有数据库只执行尚未应用的迁移；
+# 多个容器共用一个数据库时可以设置SKIP_DB_UPGRADE=1，只让其中一个（或单独的发布任务）执行迁移
+set -e
+
+if [ "${SKIP_DB_UPGRADE:-0}" != "1" ]; then
+    flask db upgrade
+fi
+
+exec "$@"
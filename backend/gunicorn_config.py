@@ -1,11 +1,49 @@
 # gunicorn_config.py
+import importlib.util
+import os
+import sys
 
 # 监听地址和端口
 bind = "0.0.0.0:5000"
 
 # 工作进程数 (可根据CPU核心数调整)
-workers = 4
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+
+# 工作进程类型，通过环境变量GUNICORN_WORKER_CLASS选择：
+# - sync（默认）：同步worker，每个进程同一时间只处理一个请求，
+#   一个等待大模型的请求会占住整个进程
+# - gevent：异步worker（gevent是可选依赖，不随应用安装，需要时在镜像或虚拟环境中执行pip install gevent），只有出站的网络IO（requests调用方舟API）会被协程化，
+#   请求在等待大模型回复时让出执行权，单个进程可同时挂起数百个等待上游的对话。
+#   标准库sqlite3的查询和提交、NumPy向量检索和文本向量化都是同步的，执行期间会阻塞整个进程；
+#   它们单次只有毫秒级，慢的是大模型调用，所以/api/health和历史记录查询不会被等待上游的请求阻塞，
+#   但长时间的数据库锁等待或大批量检索仍会卡住同一进程内的所有请求
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+
+if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+    # 未安装gevent时gunicorn会在启动worker时才报错退出，这里明确提示并回退为sync worker
+    print("[gunicorn_config] GUNICORN_WORKER_CLASS=gevent需要先安装gevent（pip install gevent），"
+          "当前未安装，已回退为sync worker", file=sys.stderr)
+    worker_class = 'sync'
+
+# gevent模式下每个工作进程同时处理的最大连接数
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # 并发的大模型请求变多，相应放大每个进程到方舟API的连接池，
+    # 以及每个进程的大模型并发名额和排队上限（sync模式下的8/32会把并发对话限制在几十个）；
+    # 已显式设置的环境变量不会被覆盖
+    os.environ.setdefault('ARK_POOL_SIZE', '100')
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', '100')
+    os.environ.setdefault('LLM_MAX_QUEUE', '400')
+    # 协程等待不占进程，允许GET /api/jobs/<job_id>长轮询（sync模式下默认不等待）
+    os.environ.setdefault('CHAT_JOB_MAX_WAIT', '25')
 
 # 工作进程超时时间 (秒)
 # 这是最关键的配置，我们设置为120秒，远大于前端和API调用的超时时间
-timeout = 120
\ No newline at end of file
+timeout = 120
+
+
+def worker_exit(server, worker):
+    """worker退出前把后台写入队列中的对话写完"""
+    from services.write_behind import write_behind
+    write_behind.shutdown()
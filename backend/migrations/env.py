@@ -51,6 +51,19 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_name(name, type_, parent_names):
+    # 全文索引（FTS5虚拟表及其影子表）由迁移脚本手工维护，不参与自动生成
+    if type_ == 'table' and name.startswith('conversation_fts'):
+        return False
+    # PostgreSQL上的pgvector列和近似最近邻索引同样由迁移脚本（9c3e5a7b1d24）手工维护，
+    # 不在模型中声明，否则自动生成会把它们当作多余的对象删除
+    if type_ == 'column' and name == 'embedding_vector' and parent_names.get('table_name') == 'conversation':
+        return False
+    if type_ == 'index' and name == 'ix_conversation_embedding_vector':
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +78,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_name=include_name
     )
 
     with context.begin_transaction():
@@ -100,6 +114,7 @@ def run_migrations_online():
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
+            include_name=include_name,
             **conf_args
         )
 
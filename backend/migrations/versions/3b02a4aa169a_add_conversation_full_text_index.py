@@ -0,0 +1,90 @@
+"""Add conversation full text index
+
+Revision ID: 3b02a4aa169a
+Revises: 20eb4ce6e6c1
+Create Date: 2026-10-17 16:22:46.522356
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b02a4aa169a'
+down_revision = '20eb4ce6e6c1'
+branch_labels = None
+depends_on = None
+
+# 每批写入全文索引的记录数
+CHUNK_SIZE = 1000
+
+# 以下为本迁移编写时services/text_search.py中的表结构和分词规则的副本。
+# 迁移不能依赖应用代码：之后修改分词规则不应改变这个历史迁移的结果（需要时另写迁移重建索引）
+FTS_TABLE = 'conversation_fts'
+CREATE_FTS_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(owner, terms, tokenize='unicode61 remove_diacritics 2')"
+)
+DROP_FTS_TABLE = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_PATTERN = re.compile(f'[{_CJK_CHARS}]+|[^\\W_{_CJK_CHARS}]+')
+_CJK_PATTERN = re.compile(f'[{_CJK_CHARS}]')
+
+
+def tokenize(content):
+    """英文等按单词切分并转小写；中文按相邻两个字切分，单独一个字时保留单字"""
+    terms = []
+    for run in _TOKEN_PATTERN.findall(content.lower()):
+        if _CJK_PATTERN.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def owner_term(user_id):
+    return f'u{int(user_id)}'
+
+conversation = sa.table(
+    'conversation',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('content', sa.Text),
+)
+
+
+def upgrade():
+    # 全文索引只在SQLite上使用FTS5实现
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(CREATE_FTS_TABLE)
+
+    # 按主键分批为已有的用户消息建立索引
+    connection = op.get_bind()
+    insert = sa.text(f"INSERT INTO {FTS_TABLE} (rowid, owner, terms) VALUES (:id, :owner, :terms)")
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(conversation.c.id, conversation.c.user_id, conversation.c.content)
+            .where(conversation.c.id > last_id)
+            .where(conversation.c.role == 'user')
+            .order_by(conversation.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(insert, [
+            {'id': row[0], 'owner': owner_term(row[1]), 'terms': ' '.join(tokenize(row[2]))}
+            for row in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(DROP_FTS_TABLE)
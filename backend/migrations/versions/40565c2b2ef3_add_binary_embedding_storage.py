@@ -0,0 +1,77 @@
+"""Add binary float32 embedding storage
+
+Revision ID: 40565c2b2ef3
+Revises: 88106b234714
+Create Date: 2026-10-17 09:12:41.502213
+
+"""
+import json
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '40565c2b2ef3'
+down_revision = '88106b234714'
+branch_labels = None
+depends_on = None
+
+# 每批转换的记录数
+CHUNK_SIZE = 1000
+
+conversation = sa.table(
+    'conversation',
+    sa.column('id', sa.Integer),
+    sa.column('embedding_json', sa.Text),
+    sa.column('embedding_blob', sa.LargeBinary),
+)
+
+
+def _convert_in_chunks(source, target, convert):
+    """按主键分批把source列转换写入target列"""
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(conversation.c.id, source)
+            .where(conversation.c.id > last_id)
+            .where(source.isnot(None))
+            .where(target.is_(None))
+            .order_by(conversation.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            conversation.update()
+            .where(conversation.c.id == sa.bindparam('row_id'))
+            .values({target.name: sa.bindparam('value')}),
+            [{'row_id': row[0], 'value': convert(row[1])} for row in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('embedding_blob', sa.LargeBinary(), nullable=True))
+
+    # 把JSON格式的向量转换为小端float32二进制
+    _convert_in_chunks(
+        conversation.c.embedding_json,
+        conversation.c.embedding_blob,
+        lambda value: np.asarray(json.loads(value), dtype='<f4').tobytes()
+    )
+
+
+def downgrade():
+    # 只有二进制格式的记录先回写JSON，避免丢失向量
+    _convert_in_chunks(
+        conversation.c.embedding_blob,
+        conversation.c.embedding_json,
+        lambda value: json.dumps(np.frombuffer(value, dtype='<f4').tolist())
+    )
+
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_column('embedding_blob')
@@ -0,0 +1,52 @@
+"""Link AI replies to user messages
+
+Revision ID: 524cdd64e1ff
+Revises: 40565c2b2ef3
+Create Date: 2026-10-17 10:03:27.918340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '524cdd64e1ff'
+down_revision = '40565c2b2ef3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reply_to_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_conversation_reply_to_id'), ['reply_to_id'], unique=False)
+        batch_op.create_foreign_key('fk_conversation_reply_to_id', 'conversation', ['reply_to_id'], ['id'])
+
+    # 回填已有的对话：handle_conversation在同一事务中依次写入用户消息和AI回复，
+    # 因此同一用户下紧挨在AI回复之前的那条记录如果是用户消息，就是它对应的提问
+    op.execute("""
+        UPDATE conversation
+        SET reply_to_id = (
+            SELECT previous.id FROM conversation AS previous
+            WHERE previous.user_id = conversation.user_id
+              AND previous.id < conversation.id
+            ORDER BY previous.id DESC
+            LIMIT 1
+        )
+        WHERE role = 'ai'
+          AND reply_to_id IS NULL
+          AND (
+            SELECT previous.role FROM conversation AS previous
+            WHERE previous.user_id = conversation.user_id
+              AND previous.id < conversation.id
+            ORDER BY previous.id DESC
+            LIMIT 1
+          ) = 'user'
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_conversation_reply_to_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_conversation_reply_to_id'))
+        batch_op.drop_column('reply_to_id')
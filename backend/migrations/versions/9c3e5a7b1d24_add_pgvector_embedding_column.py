@@ -0,0 +1,110 @@
+"""Add pgvector embedding column
+
+Revision ID: 9c3e5a7b1d24
+Revises: 6f2c8e41d7ab
+Create Date: 2026-10-17 20:41:09.318527
+
+"""
+import json
+import os
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5a7b1d24'
+down_revision = '6f2c8e41d7ab'
+branch_labels = None
+depends_on = None
+
+# 每批转换的记录数
+CHUNK_SIZE = 1000
+
+# 以下为本迁移编写时services/pgvector_store.py和models.py中的列定义、索引DDL和向量读取规则的副本。
+# 迁移不能依赖应用代码：之后修改向量维度或读取规则不应改变这个历史迁移的结果（需要时另写迁移）
+VECTOR_COLUMN = 'embedding_vector'
+VECTOR_DIM = 384
+VECTOR_INDEX_NAME = f'ix_conversation_{VECTOR_COLUMN}'
+
+CREATE_VECTOR_EXTENSION = "CREATE EXTENSION IF NOT EXISTS vector"
+ADD_VECTOR_COLUMN = f"ALTER TABLE conversation ADD COLUMN IF NOT EXISTS {VECTOR_COLUMN} vector({VECTOR_DIM})"
+DROP_VECTOR_COLUMN = f"ALTER TABLE conversation DROP COLUMN IF EXISTS {VECTOR_COLUMN}"
+DROP_VECTOR_INDEX = f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}"
+
+# 索引类型是部署时的选择，与查询参数使用同一个环境变量
+if os.getenv('PGVECTOR_INDEX', 'hnsw').lower() == 'ivfflat':
+    CREATE_VECTOR_INDEX = (
+        f"CREATE INDEX IF NOT EXISTS {VECTOR_INDEX_NAME} ON conversation "
+        f"USING ivfflat ({VECTOR_COLUMN} vector_cosine_ops) "
+        f"WITH (lists = {int(os.getenv('PGVECTOR_IVF_LISTS', '100')):d})"
+    )
+else:
+    CREATE_VECTOR_INDEX = (
+        f"CREATE INDEX IF NOT EXISTS {VECTOR_INDEX_NAME} ON conversation "
+        f"USING hnsw ({VECTOR_COLUMN} vector_cosine_ops)"
+    )
+
+
+def load_embedding(embedding_blob, embedding_json):
+    """优先读取float32二进制向量，尚未转换的记录回退到JSON格式"""
+    if embedding_blob:
+        return np.frombuffer(embedding_blob, dtype='<f4')
+    if embedding_json:
+        return np.array(json.loads(embedding_json), dtype='<f4')
+    return None
+
+
+def to_vector_literal(embedding):
+    """把向量转换为pgvector的文本格式 '[x1,x2,...]'"""
+    values = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return '[' + ','.join(repr(float(value)) for value in values) + ']'
+
+
+conversation = sa.table(
+    'conversation',
+    sa.column('id', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('embedding_json', sa.Text),
+    sa.column('embedding_blob', sa.LargeBinary),
+)
+
+
+def upgrade():
+    # pgvector列只在PostgreSQL上使用，SQLite继续使用embedding_blob
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(CREATE_VECTOR_EXTENSION)
+    op.execute(ADD_VECTOR_COLUMN)
+
+    # 按主键分批把已有用户消息的向量写入pgvector列
+    connection = op.get_bind()
+    update = sa.text(f"UPDATE conversation SET {VECTOR_COLUMN} = CAST(:vector AS vector) WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(conversation.c.id, conversation.c.embedding_blob, conversation.c.embedding_json)
+            .where(conversation.c.id > last_id)
+            .where(conversation.c.role == 'user')
+            .where(sa.or_(conversation.c.embedding_blob.isnot(None), conversation.c.embedding_json.isnot(None)))
+            .order_by(conversation.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            {'id': row[0], 'vector': to_vector_literal(load_embedding(row[1], row[2]))}
+            for row in rows
+        ])
+        last_id = rows[-1][0]
+
+    # 数据写完后再建近似最近邻索引，比逐行维护索引快得多
+    op.execute(CREATE_VECTOR_INDEX)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(DROP_VECTOR_INDEX)
+    op.execute(DROP_VECTOR_COLUMN)
@@ -2,10 +2,53 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
+import os
 import numpy as np
 
 db = SQLAlchemy()
 
+# 读取向量时使用的存储格式：'binary'（float32二进制，默认）或 'json'（旧格式）
+# 迁移期间可以先设为'json'，待迁移脚本把历史数据转换完成后再切换为'binary'
+EMBEDDING_STORAGE_FORMAT = os.getenv('EMBEDDING_STORAGE_FORMAT', 'binary')
+
+# 二进制向量格式：小端float32
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def encode_embedding(value) -> bytes:
+    """把向量编码为小端float32二进制"""
+    return np.asarray(value, dtype=EMBEDDING_DTYPE).reshape(-1).tobytes()
+
+
+def decode_embedding(blob) -> np.ndarray:
+    """把二进制向量解码为numpy数组（零拷贝，只读）"""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def load_embedding(embedding_blob, embedding_json):
+    """
+    按EMBEDDING_STORAGE_FORMAT选择读取的列，另一列作为回退
+
+    Args:
+        embedding_blob (bytes): float32二进制向量
+        embedding_json (str): JSON格式向量
+
+    Returns:
+        np.ndarray: 向量，两列都为空时返回None
+    """
+    if EMBEDDING_STORAGE_FORMAT == 'json':
+        if embedding_json:
+            return np.array(json.loads(embedding_json))
+        if embedding_blob:
+            return decode_embedding(embedding_blob)
+        return None
+    # 尚未迁移的记录回退到JSON格式
+    if embedding_blob:
+        return decode_embedding(embedding_blob)
+    if embedding_json:
+        return np.array(json.loads(embedding_json), dtype=EMBEDDING_DTYPE)
+    return None
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -24,35 +67,128 @@ class User(db.Model):
 
 
 class Conversation(db.Model):
+    __table_args__ = (
+        # 对话历史按用户和时间做键集分页
+        db.Index('ix_conversation_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        # 待落库凭据解析到唯一的一条AI回复，重放失败的写入时也不会重复插入
+        db.UniqueConstraint('client_token', name='uq_conversation_client_token'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     role = db.Column(db.String(10), nullable=False)  # 'user' 或 'ai'
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    embedding_json = db.Column(db.Text, nullable=True)  # 向量嵌入字段（JSON格式）
+    # 向量列放在延迟加载组中：历史记录等普通查询不会读取它们，
+    # 检索路径显式选择这些列，访问embedding属性时再一次性加载整组
+    embedding_json = db.deferred(db.Column(db.Text, nullable=True), group='embedding')  # 向量嵌入字段（JSON格式，旧格式）
+    embedding_blob = db.deferred(db.Column(db.LargeBinary, nullable=True), group='embedding')  # 向量嵌入字段（float32二进制）
+    reply_to_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=True, index=True)  # AI回复对应的用户消息
+    client_token = db.Column(db.String(64), nullable=True)  # 后台批量写入时返回给客户端的待落库凭据（只在AI回复上）
     
     @property
     def embedding(self):
         """获取向量数据"""
-        if self.embedding_json:
-            return np.array(json.loads(self.embedding_json))
-        return None
+        return load_embedding(self.embedding_blob, self.embedding_json)
     
     @embedding.setter
     def embedding(self, value):
         """设置向量数据"""
         if value is not None:
-            if isinstance(value, np.ndarray):
-                self.embedding_json = json.dumps(value.tolist())
-            elif isinstance(value, list):
-                self.embedding_json = json.dumps(value)
+            if not isinstance(value, (np.ndarray, list)):
+                value = list(value)
+            self.embedding_blob = encode_embedding(value)
+            # 迁移期间同时写入JSON格式，保证仍按JSON读取的进程能拿到数据
+            if EMBEDDING_STORAGE_FORMAT == 'json':
+                self.embedding_json = json.dumps(np.asarray(value).tolist())
             else:
-                self.embedding_json = json.dumps(list(value))
+                self.embedding_json = None
         else:
             self.embedding_json = None
+            self.embedding_blob = None
     
     # 建立与User模型的关系
     user = db.relationship('User', backref=db.backref('conversations', lazy=True))
     
+    # AI回复与其对应用户消息之间的关联
+    reply_to = db.relationship('Conversation', remote_side=[id])
+    
+    def __repr__(self):
+        return f'<Conversation {self.id}: {self.role} - {self.content[:50]}...>'
+
+class ConversationSummary(db.Model):
+    """
+    一段较早对话的摘要（由后台摘要任务生成）
+    覆盖该用户ID在[start_id, end_id]之间的全部对话，检索时优先于原始对话使用
+    """
+    __table_args__ = (
+        # 同一段对话只生成一条摘要，多个worker同时运行摘要任务时由约束去重
+        db.UniqueConstraint('user_id', 'start_id', name='uq_conversation_summary_user_id_start_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    content = db.Column(db.Text, nullable=False)
+    start_id = db.Column(db.Integer, nullable=False)  # 覆盖的第一条对话ID
+    end_id = db.Column(db.Integer, nullable=False)  # 覆盖的最后一条对话ID
+    message_count = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    embedding_blob = db.deferred(db.Column(db.LargeBinary, nullable=True))  # 摘要的向量（float32二进制）
+    
+    @property
+    def embedding(self):
+        """获取向量数据"""
+        return decode_embedding(self.embedding_blob) if self.embedding_blob else None
+    
+    @embedding.setter
+    def embedding(self, value):
+        """设置向量数据"""
+        self.embedding_blob = encode_embedding(value) if value is not None else None
+    
+    def __repr__(self):
+        return f'<ConversationSummary {self.id}: user {self.user_id} [{self.start_id}, {self.end_id}]>'
+
+class IdempotencyKey(db.Model):
+    """
+    带Idempotency-Key的对话请求（所有worker共享）
+    status_code为空表示首个请求仍在处理中；完成后保存其结果，在expires_at之前重放
+    """
+    __table_args__ = (
+        # 同一用户的同一幂等键只有一个请求能登记成功，其余请求等待或重放它的结果
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_id_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # 请求内容的摘要
+    status_code = db.Column(db.Integer, nullable=True)
+    response_json = db.Column(db.Text, nullable=True)  # 响应体和响应头
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # 登记（或接管）的时间
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.id}: user {self.user_id} {self.key}>'
+
+class ChatJob(db.Model):
+    """
+    异步提交的对话任务（Prefer: respond-async），所有worker共享
+    任务在接收提交的worker中执行，状态和结果写入数据库，轮询可以落在任意worker上
+    """
+    __table_args__ = (
+        # 同一用户以相同的幂等键重复提交时返回已有的任务
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_chat_job_user_id_idempotency_key'),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4().hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(10), nullable=False)  # 'pending'、'running' 或 'done'
+    result_status = db.Column(db.Integer, nullable=True)  # 同步接口本应返回的状态码
+    result_json = db.Column(db.Text, nullable=True)  # 同步接口本应返回的响应体
+    idempotency_key = db.Column(db.String(255), nullable=True)
+    fingerprint = db.Column(db.String(64), nullable=True)  # 提交内容的摘要
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)
+    
     def __repr__(self):
-        return f'<Conversation {self.id}: {self.role} - {self.content[:50]}...>'
\ No newline at end of file
+        return f'<ChatJob {self.id}: user {self.user_id} {self.status}>'
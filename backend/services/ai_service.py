@@ -1,7 +1,18 @@
 import requests
 import json
-from typing import List, Dict, Any
-from .embedding_service import get_text_embedding, calculate_similarity
+from sqlalchemy.orm import aliased
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from .embedding_service import get_text_embedding
+from .vector_index import search_user_index
+from . import text_search
+from .retrieval_cache import retrieval_cache
+from . import response_cache
+from . import context_builder
+from . import summarizer
+from .stage_timer import timed_stage
+from .ark_client import ark_client
+from .llm_limiter import llm_limiter, LimiterSaturated
+from .circuit_breaker import llm_breaker, CircuitOpen, FAILURE_STATUS_CODES
 
 # 火山引擎方舟平台（豆包模型）的API Key
 # 注意：在生产环境中，此密钥应该从环境变量中读取
@@ -13,7 +24,22 @@ VOLC_ARK_API_KEY = "4f16bd13-8986-4177-9a70-354315a3eb30"  # 使用真实的API
 # 豆包大模型API端点
 API_ENDPOINT = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
 
-def search_relevant_conversations(user_content: str, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+# 豆包模型的endpoint ID
+MODEL_ID = "doubao-seed-1-6-thinking-250615"
+
+
+class FallbackReply(str):
+    """大模型不可用时代替回复返回的提示语，调用方据此避免把它当作正常回复缓存或重放"""
+
+
+class StreamInterrupted(Exception):
+    """流式回复已经产出部分内容后上游出错，已产出的回复不完整"""
+
+# 启用长期记忆时的系统提示
+MEMORY_SYSTEM_PROMPT = "你是EvolveMe的AI教练，专注于帮助用户实现个人成长和目标达成。请以友好、专业、鼓励的语气回复用户。你具有长期记忆能力，能够记住用户之前的对话内容，并在回复中体现出对用户情况的了解和关注。**重要：你的所有回复都必须使用Markdown格式进行排版，以便于阅读。例如，使用`**标题**`、`- 列表`和`1. 数字列表`等。**"
+
+def search_relevant_conversations(user_content: str, user_id: int, limit: int = 5,
+                                  user_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
     """
     搜索与用户输入相关的历史对话
     
@@ -21,156 +47,214 @@ def search_relevant_conversations(user_content: str, user_id: int, limit: int =
         user_content (str): 用户输入内容
         user_id (int): 用户ID
         limit (int): 返回的相关对话数量限制
+        user_embedding (List[float]): 预先计算好的用户输入向量，为空时在此计算
         
     Returns:
         List[Dict]: 相关的历史对话列表
     """
-    from models import Conversation
+    # 生成用户输入的向量（调用方已计算时直接复用）
+    if user_embedding is None:
+        user_embedding = get_text_embedding(user_content)
+    
+    with timed_stage('retrieval'):
+        # 同一用户几乎相同的追问直接复用上一次的检索结果
+        cached, version = retrieval_cache.get(user_id, user_embedding, limit)
+        if cached is not None:
+            return cached
+        relevant_conversations = _find_relevant_conversations(user_content, user_embedding, user_id, limit)
+        retrieval_cache.put(user_id, user_embedding, limit, relevant_conversations, version)
+        return relevant_conversations
+
+def _find_relevant_conversations(user_content: str, user_embedding, user_id: int,
+                                 limit: int) -> List[Dict[str, Any]]:
+    """根据用户输入及其向量检索相关的历史对话及其AI回复"""
+    from models import db, Conversation
     
-    # 生成用户输入的向量
-    user_embedding = get_text_embedding(user_content)
+    # 在用户的历史消息中查找最相关的记录（只包含用户消息，不包括AI回复）：
+    # 混合模式先用全文索引按BM25预筛选，再按向量相似度重排
+    if text_search.RETRIEVAL_MODE == 'hybrid':
+        top_matches = text_search.hybrid_search(user_id, user_content, user_embedding, limit)
+    else:
+        top_matches = search_user_index(user_id, user_embedding, limit)
+    if not top_matches:
+        return []
     
-    # 获取用户的所有历史对话（只获取用户消息，不包括AI回复）
-    user_conversations = Conversation.query.filter_by(
-        user_id=user_id, 
-        role='user'
+    # 一次联表查询取回全部命中的用户消息及其AI回复
+    ai_reply = aliased(Conversation)
+    rows = db.session.query(
+        Conversation.id,
+        Conversation.content,
+        Conversation.timestamp,
+        ai_reply.content.label('ai_response')
+    ).outerjoin(
+        ai_reply, ai_reply.reply_to_id == Conversation.id
     ).filter(
-        Conversation.embedding_json.isnot(None)
+        Conversation.id.in_([conversation_id for conversation_id, _ in top_matches])
     ).all()
+    matched_conversations = {}
+    for row in rows:
+        matched_conversations.setdefault(row.id, row)
     
-    # 计算相似度并排序
-    conversation_similarities = []
-    for conv in user_conversations:
-        if conv.embedding is not None:
-            similarity = calculate_similarity(user_embedding, conv.embedding)
-            conversation_similarities.append({
-                'conversation': conv,
-                'similarity': similarity
-            })
-    
-    # 按相似度降序排序
-    conversation_similarities.sort(key=lambda x: x['similarity'], reverse=True)
-    
-    # 返回最相关的对话
+    # 按相似度顺序返回最相关的对话
     relevant_conversations = []
-    for item in conversation_similarities[:limit]:
-        conv = item['conversation']
-        
-        # 获取对应的AI回复
-        ai_response = Conversation.query.filter_by(
-            user_id=user_id,
-            role='ai'
-        ).filter(
-            Conversation.timestamp > conv.timestamp
-        ).order_by(Conversation.timestamp.asc()).first()
-        
+    for conversation_id, similarity in top_matches:
+        conv = matched_conversations.get(conversation_id)
+        if conv is None:
+            continue
         relevant_conversations.append({
+            'id': conversation_id,
             'user_message': conv.content,
-            'ai_response': ai_response.content if ai_response else None,
+            'ai_response': conv.ai_response,
             'timestamp': conv.timestamp.isoformat(),
-            'similarity': item['similarity']
+            'similarity': similarity
         })
     
     return relevant_conversations
 
-def build_context_with_memory(user_content: str, user_id: int) -> List[Dict[str, str]]:
+def build_context_with_memory(user_content: str, user_id: int,
+                              user_embedding: Optional[List[float]] = None) -> List[Dict[str, str]]:
     """
     构建包含长期记忆的对话上下文
     
     Args:
         user_content (str): 用户输入内容
         user_id (int): 用户ID
+        user_embedding (List[float]): 预先计算好的用户输入向量
         
     Returns:
         List[Dict]: 构建好的消息列表
     """
-    messages = [
-        {
-            "role": "system",
-            "content": "你是EvolveMe的AI教练，专注于帮助用户实现个人成长和目标达成。请以友好、专业、鼓励的语气回复用户。你具有长期记忆能力，能够记住用户之前的对话内容，并在回复中体现出对用户情况的了解和关注。**重要：你的所有回复都必须使用Markdown格式进行排版，以便于阅读。例如，使用`**标题**`、`- 列表`和`1. 数字列表`等。**"
-        }
-    ]
+    if user_embedding is None:
+        user_embedding = get_text_embedding(user_content)
     
     # 搜索相关的历史对话
-    relevant_conversations = search_relevant_conversations(user_content, user_id, limit=3)
+    relevant_conversations = search_relevant_conversations(
+        user_content, user_id, limit=context_builder.CONTEXT_MAX_MEMORIES, user_embedding=user_embedding
+    )
     
-    # 如果有相关的历史对话，添加到上下文中
-    if relevant_conversations:
-        context_content = "\n\n基于我们之前的对话，我记得：\n"
-        for i, conv in enumerate(relevant_conversations, 1):
-            if conv['similarity'] > 0.3:  # 只包含相似度较高的对话
-                context_content += f"{i}. 你曾经说过：\"{conv['user_message']}\"\n"
-                if conv['ai_response']:
-                    context_content += f"   我当时回复：\"{conv['ai_response'][:100]}...\"\n"
-        
-        context_content += "\n请结合这些历史信息来回复用户的新问题。"
+    # 较早的对话已被压缩为摘要时优先使用摘要，并去掉摘要已覆盖的原始对话
+    with timed_stage('summaries'):
+        summaries = summarizer.search_summaries(user_id, user_embedding)
+    if summaries:
+        covered_until = max(summary['end_id'] for summary in summaries)
+        relevant_conversations = summaries + [
+            conv for conv in relevant_conversations if conv['id'] > covered_until
+        ]
+    
+    # 在token预算内打包系统提示、记忆和用户消息，放不下时先舍弃排名靠后的记忆
+    messages, _ = context_builder.assemble_context(MEMORY_SYSTEM_PROMPT, relevant_conversations, user_content)
+    return messages
+
+def build_messages(user_content: str, user_id: int = None,
+                   user_embedding: Optional[List[float]] = None) -> List[Dict[str, str]]:
+    """
+    构建发送给大模型的消息列表
+    
+    Args:
+        user_content (str): 用户输入的消息内容
+        user_id (int): 用户ID，提供时启用长期记忆
+        user_embedding (List[float]): 预先计算好的用户消息向量
         
-        messages.append({
+    Returns:
+        List[Dict]: 构建好的消息列表
+    """
+    # 构建包含长期记忆的消息上下文
+    if user_id:
+        from models import db
+        messages = build_context_with_memory(user_content, user_id, user_embedding)
+        # 检索完成后立即结束读事务并归还连接，避免在等待大模型的几十秒内一直持有SQLite的读锁，
+        # 在异步worker下这会让并发的写入和历史查询排队
+        db.session.commit()
+        return messages
+    
+    # 如果没有用户ID，使用基础上下文
+    return [
+        {
             "role": "system",
-            "content": context_content
-        })
+            "content": "你是EvolveMe的AI教练，专注于帮助用户实现个人成长和目标达成。请以友好、专业、鼓励的语气回复用户。**重要：你的所有回复都必须使用Markdown格式进行排版，以便于阅读。例如，使用`**标题**`、`- 列表`和`1. 数字列表`等。**"
+        },
+        {
+            "role": "user",
+            "content": user_content
+        }
+    ]
+
+def build_payload(messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+    """
+    构造豆包API的请求体
     
-    # 添加当前用户消息
-    messages.append({
-        "role": "user",
-        "content": user_content
-    })
+    Args:
+        messages (List[Dict]): 消息列表
+        stream (bool): 是否以流式方式返回
+        
+    Returns:
+        Dict: 请求体
+    """
+    payload = {
+        "model": MODEL_ID,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1000
+    }
+    if stream:
+        payload["stream"] = True
     
-    return messages
+    # [DEBUG] 打印完整的请求载荷
+    print("--- [DEBUG] PAYLOAD SENT TO VOLCENGINE ---")
+    print(json.dumps(payload, indent=2, ensure_ascii=False))
+    return payload
 
-def get_llm_response(user_content: str, user_id: int = None) -> str:
+def semantic_cache_key(user_content: str, user_id: int, user_embedding,
+                       use_cache: bool = True) -> Optional[Tuple]:
+    """
+    语义回复缓存的查找参数 (用户ID, 用户消息向量, 上下文摘要)
+    上下文摘要只包含系统提示和模型，不包含检索到的记忆（见response_cache.context_key），
+    因此在检索之前就能查找，命中时连同检索一起省去。
+    缓存未开启、调用方要求跳过缓存或没有用户ID时返回None
+    """
+    if not use_cache or not user_id or not response_cache.SEMANTIC_CACHE_ENABLED:
+        return None
+    if user_embedding is None:
+        user_embedding = get_text_embedding(user_content)
+    return user_id, user_embedding, response_cache.context_key(MEMORY_SYSTEM_PROMPT, MODEL_ID)
+
+def get_llm_response(user_content: str, user_id: int = None,
+                     user_embedding: Optional[List[float]] = None, use_cache: bool = True) -> str:
     """
     调用火山引擎豆包大模型API获取AI回复
     
     Args:
         user_content (str): 用户输入的消息内容
         user_id (int): 用户ID，用于长期记忆功能
+        user_embedding (List[float]): 预先计算好的用户消息向量，避免重复向量化
+        use_cache (bool): 是否使用语义回复缓存（需开启SEMANTIC_CACHE_ENABLED）
         
     Returns:
-        str: AI生成的回复内容
+        str: AI生成的回复内容；大模型不可用时为FallbackReply（提示语）
+        
+    Raises:
+        LimiterSaturated: 大模型调用排队已满或等待超时
     """
     try:
-        # 构造请求头
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {VOLC_ARK_API_KEY}"
-        }
+        # 同一用户几乎相同的提问直接返回缓存的回复
+        cache_key = semantic_cache_key(user_content, user_id, user_embedding, use_cache)
+        if cache_key is not None:
+            user_embedding = cache_key[1]
+            with timed_stage('semantic_cache'):
+                cached_reply = response_cache.semantic_cache.get(*cache_key)
+            if cached_reply is not None:
+                return cached_reply
         
-        # 构建包含长期记忆的消息上下文
-        if user_id:
-            messages = build_context_with_memory(user_content, user_id)
-        else:
-            # 如果没有用户ID，使用基础上下文
-            messages = [
-                {
-                    "role": "system",
-                    "content": "你是EvolveMe的AI教练，专注于帮助用户实现个人成长和目标达成。请以友好、专业、鼓励的语气回复用户。**重要：你的所有回复都必须使用Markdown格式进行排版，以便于阅读。例如，使用`**标题**`、`- 列表`和`1. 数字列表`等。**"
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ]
+        messages = build_messages(user_content, user_id, user_embedding)
         
         # 构造请求体
-        payload = {
-            "model": "doubao-seed-1-6-thinking-250615",  # 豆包模型的endpoint ID
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
+        payload = build_payload(messages)
         
-        # [DEBUG] 打印完整的请求载荷
-        print("--- [DEBUG] PAYLOAD SENT TO VOLCENGINE ---")
-        print(json.dumps(payload, indent=2, ensure_ascii=False))
-        
-        # 发送POST请求到豆包API
-        response = requests.post(
-            API_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=55  # 新增：设置55秒的后端请求超时
-        )
+        # 通过连接池复用的客户端发送POST请求到豆包API（超时与重试由客户端统一配置），
+        # 并发数由限制器控制，饱和时抛出LimiterSaturated交给调用方返回503；
+        # 上游连续故障时熔断器直接失败，不再等待完整的超时时间
+        with llm_limiter.slot(), timed_stage('llm'):
+            response = llm_breaker.call(ark_client.post_chat_completion, API_ENDPOINT, VOLC_ARK_API_KEY, payload)
         
         # 检查响应状态
         if response.status_code == 200:
@@ -178,24 +262,146 @@ def get_llm_response(user_content: str, user_id: int = None) -> str:
             
             # 提取AI回复内容
             if "choices" in response_data and len(response_data["choices"]) > 0:
-                ai_reply = response_data["choices"][0]["message"]["content"]
-                return ai_reply.strip()
+                ai_reply = response_data["choices"][0]["message"]["content"].strip()
+                if cache_key is not None:
+                    response_cache.semantic_cache.put(*cache_key, ai_reply)
+                return ai_reply
             else:
-                return "抱歉，我现在无法生成回复，请稍后再试。"
+                return FallbackReply("抱歉，我现在无法生成回复，请稍后再试。")
         else:
             print(f"API请求失败，状态码: {response.status_code}")
             print(f"错误信息: {response.text}")
-            return "抱歉，AI服务暂时不可用，请稍后再试。"
+            return FallbackReply("抱歉，AI服务暂时不可用，请稍后再试。")
             
+    except LimiterSaturated:
+        raise
+    except CircuitOpen:
+        print("大模型服务熔断中，直接返回")
+        return FallbackReply("抱歉，AI服务暂时不可用，请稍后再试。")
     except requests.exceptions.Timeout:
         print("API请求超时")
-        return "抱歉，响应超时，请稍后再试。"
+        return FallbackReply("抱歉，响应超时，请稍后再试。")
+    except requests.exceptions.RequestException as e:
+        print(f"网络请求错误: {str(e)}")
+        return FallbackReply("抱歉，网络连接出现问题，请检查网络后重试。")
+    except json.JSONDecodeError as e:
+        print(f"JSON解析错误: {str(e)}")
+        return FallbackReply("抱歉，响应格式错误，请稍后再试。")
+    except Exception as e:
+        print(f"未知错误: {str(e)}")
+        return FallbackReply("抱歉，发生了未知错误，请稍后再试。")
+
+def stream_llm_response(user_content: str, user_id: int = None,
+                        user_embedding: Optional[List[float]] = None, use_cache: bool = True) -> Iterator[str]:
+    """
+    以流式方式调用豆包API，逐段产出AI回复
+    尚未产出内容时出错，与get_llm_response一样产出对应的提示语；已经产出部分内容后出错则抛出StreamInterrupted
+    
+    Args:
+        user_content (str): 用户输入的消息内容
+        user_id (int): 用户ID，用于长期记忆功能
+        user_embedding (List[float]): 预先计算好的用户消息向量
+        use_cache (bool): 是否使用语义回复缓存（需开启SEMANTIC_CACHE_ENABLED）
+        
+    Yields:
+        str: AI回复的增量内容
+        
+    Raises:
+        LimiterSaturated: 大模型调用排队已满或等待超时
+        StreamInterrupted: 已产出部分内容后上游断开、超时或返回无法解析的数据
+    """
+    produced = False
+    try:
+        # 命中语义缓存时把缓存的回复作为一整段产出
+        cache_key = semantic_cache_key(user_content, user_id, user_embedding, use_cache)
+        if cache_key is not None:
+            user_embedding = cache_key[1]
+            with timed_stage('semantic_cache'):
+                cached_reply = response_cache.semantic_cache.get(*cache_key)
+            if cached_reply is not None:
+                yield cached_reply
+                return
+        
+        messages = build_messages(user_content, user_id, user_embedding)
+        
+        payload = build_payload(messages, stream=True)
+        chunks = []
+        
+        with llm_limiter.slot(), timed_stage('llm'):
+            # 流式响应的状态码在正文之前就已返回，正文中途断开或超时同样是上游故障，
+            # 所以熔断器的结果要等正文读完（或读取失败）才记录，不能用llm_breaker.call
+            probe = llm_breaker.before_call()
+            recorded = False
+            try:
+                with ark_client.post_chat_completion(API_ENDPOINT, VOLC_ARK_API_KEY, payload, stream=True) as response:
+                    if response.status_code != 200:
+                        if response.status_code in FAILURE_STATUS_CODES:
+                            llm_breaker.record_failure(probe)
+                        else:
+                            llm_breaker.record_success(probe)
+                        recorded = True
+                        print(f"API请求失败，状态码: {response.status_code}")
+                        print(f"错误信息: {response.text}")
+                        yield "抱歉，AI服务暂时不可用，请稍后再试。"
+                        return
+                    
+                    # 上游按SSE格式（UTF-8编码）返回：每行 "data: {...}"，以 "data: [DONE]" 结束
+                    for raw_line in response.iter_lines():
+                        line = raw_line.decode('utf-8')
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
+                        chunk = json.loads(data)
+                        choices = chunk.get("choices") or []
+                        delta = choices[0].get("delta", {}).get("content") if choices else None
+                        if delta:
+                            produced = True
+                            chunks.append(delta)
+                            yield delta
+                    # 收到[DONE]或正文正常结束
+                    llm_breaker.record_success(probe)
+                    recorded = True
+            except Exception:
+                # 连接失败、正文中途断开或超时、返回的数据无法解析
+                if not recorded:
+                    llm_breaker.record_failure(probe)
+                    recorded = True
+                raise
+            finally:
+                # 客户端断开（GeneratorExit）等与上游无关的中止只归还探测名额
+                if not recorded:
+                    llm_breaker.release(probe)
+        
+        if not produced:
+            yield "抱歉，我现在无法生成回复，请稍后再试。"
+        elif cache_key is not None:
+            # 只缓存完整结束的回复
+            response_cache.semantic_cache.put(*cache_key, ''.join(chunks).strip())
+            
+    except LimiterSaturated:
+        raise
+    except CircuitOpen:
+        print("大模型服务熔断中，直接返回")
+        yield "抱歉，AI服务暂时不可用，请稍后再试。"
+    except requests.exceptions.Timeout as e:
+        print("API请求超时")
+        if produced:
+            raise StreamInterrupted(str(e)) from e
+        yield "抱歉，响应超时，请稍后再试。"
     except requests.exceptions.RequestException as e:
         print(f"网络请求错误: {str(e)}")
-        return "抱歉，网络连接出现问题，请检查网络后重试。"
+        if produced:
+            raise StreamInterrupted(str(e)) from e
+        yield "抱歉，网络连接出现问题，请检查网络后重试。"
     except json.JSONDecodeError as e:
         print(f"JSON解析错误: {str(e)}")
-        return "抱歉，响应格式错误，请稍后再试。"
+        if produced:
+            raise StreamInterrupted(str(e)) from e
+        yield "抱歉，响应格式错误，请稍后再试。"
     except Exception as e:
         print(f"未知错误: {str(e)}")
-        return "抱歉，发生了未知错误，请稍后再试。"
\ No newline at end of file
+        if produced:
+            raise StreamInterrupted(str(e)) from e
+        yield "抱歉，发生了未知错误，请稍后再试。"
@@ -0,0 +1,184 @@
+import os
+import threading
+from typing import List, Tuple
+
+import numpy as np
+
+from .vector_index import UserVectorIndex, top_k
+
+# 向量数少于该值时直接精确扫描，不构建倒排列表
+IVF_MIN_SIZE = int(os.getenv('IVF_MIN_SIZE', '20000'))
+
+# 每次查询探测的聚类数：召回率与延迟之间的调节旋钮，越大越准也越慢
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '8'))
+
+# 聚类（倒排列表）数量，0表示按sqrt(n)自动选择
+IVF_NLIST = int(os.getenv('IVF_NLIST', '0'))
+
+# k-means训练的迭代次数，以及每个聚类平均使用的训练样本数
+IVF_TRAIN_ITERATIONS = int(os.getenv('IVF_TRAIN_ITERATIONS', '10'))
+IVF_TRAIN_SAMPLES_PER_LIST = 40
+
+# 分配聚类时每批计算的行数，限制临时矩阵的内存占用
+_ASSIGN_CHUNK = 8192
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """把每个（已归一化的）向量分配到余弦相似度最高的聚类中心"""
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], _ASSIGN_CHUNK):
+        chunk = vectors[start:start + _ASSIGN_CHUNK]
+        labels[start:start + chunk.shape[0]] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int,
+                    rng: np.random.Generator) -> np.ndarray:
+    """
+    球面k-means：在单位球面上聚类，聚类中心同样归一化
+
+    Args:
+        vectors (np.ndarray): 训练样本（已归一化）
+        nlist (int): 聚类数
+        iterations (int): 迭代次数
+        rng (np.random.Generator): 随机数生成器
+
+    Returns:
+        np.ndarray: 形状为 (nlist, dim) 的聚类中心
+    """
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_to_centroids(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=nlist)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+        centroids[non_empty] = np.add.reduceat(vectors[order], starts, axis=0)
+
+        # 空聚类重新随机选取样本作为中心
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            centroids[empty] = vectors[rng.choice(vectors.shape[0], empty.size, replace=False)]
+
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+    return centroids
+
+
+class IVFVectorIndex(UserVectorIndex):
+    """
+    倒排文件（IVF）近似最近邻索引
+    向量仍存放在父类的连续矩阵中；另外用球面k-means把向量划分为nlist个聚类，
+    查询时只精确计算最接近的nprobe个聚类中的向量。
+    规模小于min_size时退化为精确扫描；规模翻倍时重新训练聚类中心。
+    训练在后台线程中进行，不持有索引锁：首次训练完成前查询使用精确扫描，
+    重新训练期间继续使用旧的聚类（新向量增量分配到旧聚类），训练完成后一次性替换
+    """
+
+    def __init__(self, vector_dim: int = 384, nprobe: int = IVF_NPROBE,
+                 min_size: int = IVF_MIN_SIZE, nlist: int = IVF_NLIST, seed: int = 0):
+        super().__init__(vector_dim)
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.nlist = nlist
+        self._rng = np.random.default_rng(seed)
+        self._centroids = None
+        self._lists = []  # 每个聚类包含的行号（升序）
+        self._trained_size = 0
+        self._training = None  # 进行中的后台训练线程
+
+    @property
+    def trained(self) -> bool:
+        """是否已经构建了倒排列表"""
+        return self._centroids is not None
+
+    def wait_for_training(self, timeout: float = None) -> bool:
+        """等待进行中的后台训练完成，返回是否已没有进行中的训练"""
+        thread = self._training
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def _on_append(self, start: int, stop: int):
+        # 持有索引锁时调用：只做增量分配，训练交给后台线程
+        if self._centroids is not None:
+            self._assign_rows(self._centroids, self._lists, start, stop)
+        if self._size < self.min_size or self._training is not None:
+            return
+        if self._centroids is None or self._size >= 2 * self._trained_size:
+            self._training = threading.Thread(target=self._train, name='ivf-train', daemon=True)
+            self._training.start()
+
+    def _assign_rows(self, centroids: np.ndarray, lists: list, start: int, stop: int):
+        """把[start, stop)行的向量分配到最近的聚类（原地更新lists）"""
+        if stop <= start:
+            return
+        positions = np.arange(start, stop)
+        labels = assign_to_centroids(self._matrix[start:stop], centroids)
+        for label in np.unique(labels):
+            lists[label] = np.concatenate([lists[label], positions[labels == label]])
+
+    def _train(self):
+        """用当前全部向量训练聚类中心并重建倒排列表（在后台线程中执行）"""
+        try:
+            # 矩阵只追加不修改，扩容时旧数组仍然有效，前size行可以在锁外读取
+            with self._lock:
+                matrix = self._matrix
+                size = self._size
+            nlist = min(self.nlist or max(1, int(np.sqrt(size))), size)
+            sample_size = min(size, nlist * IVF_TRAIN_SAMPLES_PER_LIST)
+            sample = matrix[np.sort(self._rng.choice(size, sample_size, replace=False))]
+            centroids = train_centroids(sample, nlist, IVF_TRAIN_ITERATIONS, self._rng)
+
+            labels = assign_to_centroids(matrix[:size], centroids)
+            order = np.argsort(labels, kind='stable')
+            bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+            lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+
+            with self._lock:
+                # 补上训练期间追加的向量，然后一次性替换
+                self._assign_rows(centroids, lists, size, self._size)
+                self._lists = lists
+                self._centroids = centroids
+                self._trained_size = size
+        except Exception as e:
+            print(f"IVF索引训练失败: {str(e)}")
+        finally:
+            with self._lock:
+                self._training = None
+
+    def search(self, query_embedding, limit: int = 5, nprobe: int = None) -> List[Tuple[int, float]]:
+        """
+        近似查询与给定向量最相似的记录
+
+        Args:
+            query_embedding: 查询向量
+            limit (int): 返回数量
+            nprobe (int): 本次查询探测的聚类数，默认使用索引的设置
+
+        Returns:
+            List[Tuple[int, float]]: (对话ID, 相似度) 列表，按相似度降序
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        with self._lock:
+            centroids = self._centroids
+            lists = list(self._lists)
+            matrix = self._matrix[:self._size]
+            ids = self._ids[:self._size]
+        if centroids is None or norm == 0 or limit <= 0:
+            return super().search(query_embedding, limit)
+
+        query = query / norm
+        nprobe = min(nprobe or self.nprobe, len(lists))
+        centroid_scores = centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        positions = np.sort(np.concatenate([lists[i] for i in probe]))
+        if positions.size < limit:
+            # 候选不足时退回精确扫描
+            return super().search(query_embedding, limit)
+
+        scores = matrix[positions] @ query
+        np.maximum(scores, 0.0, out=scores)  # 与calculate_similarity一致，确保非负
+        return top_k(scores, ids[positions], limit)
@@ -0,0 +1,134 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 连接池大小：每个worker进程与方舟API保持的最大keep-alive连接数
+ARK_POOL_SIZE = int(os.getenv('ARK_POOL_SIZE', '10'))
+
+# 连接超时和读取超时（秒）；流式请求中读取超时是两次收到数据之间的最长间隔
+ARK_CONNECT_TIMEOUT = float(os.getenv('ARK_CONNECT_TIMEOUT', '5'))
+ARK_READ_TIMEOUT = float(os.getenv('ARK_READ_TIMEOUT', '55'))
+
+# 遇到429/5xx或连接失败时的最大重试次数，以及退避时间的基数和上限（秒）
+ARK_MAX_RETRIES = int(os.getenv('ARK_MAX_RETRIES', '2'))
+ARK_BACKOFF_BASE = float(os.getenv('ARK_BACKOFF_BASE', '0.5'))
+ARK_BACKOFF_MAX = float(os.getenv('ARK_BACKOFF_MAX', '8'))
+
+# 需要重试的状态码
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class ArkClient:
+    """
+    方舟chat-completions接口的HTTP客户端
+    每个进程复用一个带连接池的Session，避免每轮对话都重新进行TCP+TLS握手；
+    对429/5xx和连接失败做有限次数的带抖动指数退避重试
+    """
+
+    def __init__(self, pool_size: int = ARK_POOL_SIZE,
+                 connect_timeout: float = ARK_CONNECT_TIMEOUT,
+                 read_timeout: float = ARK_READ_TIMEOUT,
+                 max_retries: int = ARK_MAX_RETRIES,
+                 backoff_base: float = ARK_BACKOFF_BASE,
+                 backoff_max: float = ARK_BACKOFF_MAX):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        当前进程的Session
+        gunicorn在fork之后各worker会各自重新创建，避免共享父进程的socket
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.pool_size,
+                        max_retries=0  # 重试由本客户端统一处理
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        计算第attempt次重试前的等待时间
+        优先遵循服务端的Retry-After，否则使用全抖动的指数退避
+        """
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, cap)
+
+    def post_chat_completion(self, endpoint: str, api_key: str, payload: Dict[str, Any],
+                             stream: bool = False) -> requests.Response:
+        """
+        发送chat-completions请求
+
+        Args:
+            endpoint (str): 接口地址
+            api_key (str): 方舟API Key
+            payload (Dict): 请求体
+            stream (bool): 是否流式读取响应
+
+        Returns:
+            requests.Response: 最后一次请求的响应（重试用尽时可能仍是429/5xx）
+
+        Raises:
+            requests.exceptions.RequestException: 网络错误或超时
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    endpoint,
+                    headers=headers,
+                    json=payload,
+                    stream=stream,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except requests.exceptions.ConnectionError:
+                # 连接失败（含连接超时、keep-alive连接被对端关闭）时重试；
+                # 读取超时不重试，因为此时已经等待了完整的读取超时时间
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+
+            retry_after = response.headers.get('Retry-After')
+            response.close()
+            time.sleep(self.backoff_delay(attempt, retry_after))
+            attempt += 1
+
+
+# 全局实例（每个worker进程一个连接池）
+ark_client = ArkClient()
@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+# 执行对话任务的后台线程数（每个worker进程）
+CHAT_JOB_WORKERS = int(os.getenv('CHAT_JOB_WORKERS', '8'))
+
+# 每个worker进程排队和执行中的任务数上限，超出时拒绝新的提交
+CHAT_JOB_MAX_PENDING = int(os.getenv('CHAT_JOB_MAX_PENDING', '256'))
+
+# 已完成任务的结果保留多久（秒）
+CHAT_JOB_TTL = float(os.getenv('CHAT_JOB_TTL', '600'))
+
+# 长轮询单次最长等待时间（秒）。sync worker长轮询期间整个进程都被占住，所以默认为0（立即返回，
+# 客户端按Retry-After轮询）；gunicorn_config在gevent模式下设为25，需小于反向代理和gunicorn的超时
+CHAT_JOB_MAX_WAIT = float(os.getenv('CHAT_JOB_MAX_WAIT', '0'))
+
+# 任务未完成时建议客户端下次轮询的间隔（秒），写入Retry-After响应头
+CHAT_JOB_RETRY_AFTER = int(os.getenv('CHAT_JOB_RETRY_AFTER', '1'))
+
+# 提交后超过这段时间（秒）仍未完成的任务视为已丢失：执行它的worker已重启或退出
+CHAT_JOB_TIMEOUT = float(os.getenv('CHAT_JOB_TIMEOUT', '300'))
+
+# 长轮询由其他worker执行的任务时读取数据库的间隔（秒）
+CHAT_JOB_POLL_INTERVAL = float(os.getenv('CHAT_JOB_POLL_INTERVAL', '0.5'))
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+LOST = 'lost'
+
+# 任务结果：(响应体, 状态码, 响应头)
+Result = Tuple[Dict[str, Any], int, Dict[str, str]]
+
+
+class JobQueueFull(Exception):
+    """排队的任务已达上限"""
+
+
+class JobConflict(Exception):
+    """同一幂等键被用于内容不同的提交"""
+
+
+def is_lost(job) -> bool:
+    """任务是否超过CHAT_JOB_TIMEOUT仍未完成（执行它的worker已退出，结果不会再写入）"""
+    return job.status != DONE and job.created_at <= datetime.utcnow() - timedelta(seconds=CHAT_JOB_TIMEOUT)
+
+
+def job_to_dict(job) -> Dict[str, Any]:
+    """任务状态的JSON结构：完成后包含结果的状态码和响应体，丢失的任务提示客户端重新提交"""
+    if is_lost(job):
+        return {'job_id': job.id, 'status': LOST, 'error': '任务执行中断，请重新提交'}
+    data = {'job_id': job.id, 'status': job.status}
+    if job.result_status is not None:
+        data['result_status'] = job.result_status
+        data['result'] = json.loads(job.result_json)
+    return data
+
+
+class ChatJobManager:
+    """
+    对话任务队列：任务状态和结果保存在数据库（chat_job表）中，由接收提交的worker的线程池在后台执行
+    提交后立即返回任务ID，客户端可以向任意worker轮询任务状态，web worker不必在等待大模型的几十秒内
+    一直占着连接。worker在任务完成前退出时，任务超过CHAT_JOB_TIMEOUT后报告为lost
+    """
+
+    def __init__(self, workers: int = CHAT_JOB_WORKERS, max_pending: int = CHAT_JOB_MAX_PENDING,
+                 ttl: float = CHAT_JOB_TTL):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.app = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-job')
+        # 本进程执行中的任务完成时通知长轮询
+        self._events = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """绑定Flask应用，后台线程在其应用上下文中执行任务"""
+        self.app = app
+
+    def _purge(self, user_id: int):
+        """清除该用户超过保留时间的任务"""
+        from models import db, ChatJob
+
+        now = datetime.utcnow()
+        ChatJob.query.filter(ChatJob.user_id == user_id, or_(
+            ChatJob.finished_at <= now - timedelta(seconds=self.ttl),
+            and_(ChatJob.finished_at.is_(None),
+                 ChatJob.created_at <= now - timedelta(seconds=CHAT_JOB_TIMEOUT + self.ttl))
+        )).delete(synchronize_session='fetch')
+        db.session.commit()
+
+    def submit(self, user_id, func: Callable[[], Result], idempotency_key: str = None,
+               fingerprint: str = None) -> Tuple[Any, bool]:
+        """
+        提交一个任务（需在应用上下文中调用，会提交当前会话）
+
+        Args:
+            user_id: 用户ID
+            func (Callable): 在后台线程中执行、返回 (响应体, 状态码, 响应头) 的函数
+            idempotency_key (str): 幂等键，同一用户以相同的键重复提交时返回已有的任务
+            fingerprint (str): 提交内容的摘要，与幂等键绑定
+
+        Returns:
+            Tuple[ChatJob, bool]: 任务，以及是否为新提交的任务
+
+        Raises:
+            JobConflict: 幂等键已被内容不同的提交使用
+            JobQueueFull: 排队的任务已达上限
+        """
+        from models import db, ChatJob
+
+        user_id = int(user_id)
+        self._purge(user_id)
+        while True:
+            if idempotency_key:
+                existing = ChatJob.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+                if existing is not None:
+                    if existing.fingerprint != fingerprint:
+                        db.session.commit()
+                        raise JobConflict(idempotency_key)
+                    if not is_lost(existing):
+                        db.session.commit()
+                        return existing, False
+                    # 原任务已丢失，用同一个幂等键重新提交
+                    db.session.delete(existing)
+                    db.session.commit()
+
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    raise JobQueueFull()
+                self._pending += 1
+            job = ChatJob(id=uuid.uuid4().hex, user_id=user_id, status=PENDING,
+                          idempotency_key=idempotency_key, fingerprint=fingerprint,
+                          created_at=datetime.utcnow())
+            db.session.add(job)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 相同幂等键的提交刚被另一个请求登记
+                db.session.rollback()
+                self._release(None)
+                continue
+            except Exception:
+                db.session.rollback()
+                self._release(None)
+                raise
+            with self._lock:
+                self._events[job.id] = threading.Event()
+            self._executor.submit(self._run, job.id, func)
+            return job, True
+
+    def _release(self, job_id: Optional[str]):
+        with self._lock:
+            self._pending -= 1
+            event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _run(self, job_id: str, func: Callable[[], Result]):
+        try:
+            with self.app.app_context():
+                from models import db, ChatJob
+
+                ChatJob.query.filter_by(id=job_id).update({'status': RUNNING}, synchronize_session=False)
+                db.session.commit()
+                try:
+                    result = func()
+                except Exception as e:
+                    print(f"对话任务执行失败: {str(e)}")
+                    db.session.rollback()
+                    result = ({'error': '服务器内部错误'}, 500, {})
+                body, status, _ = result
+                ChatJob.query.filter_by(id=job_id).update({
+                    'status': DONE,
+                    'result_status': status,
+                    'result_json': json.dumps(body, ensure_ascii=False),
+                    'finished_at': datetime.utcnow()
+                }, synchronize_session=False)
+                db.session.commit()
+        except Exception as e:
+            # 结果没能写入数据库，任务超时后报告为lost
+            print(f"对话任务状态写入失败: {str(e)}")
+        finally:
+            self._release(job_id)
+
+    def get(self, user_id, job_id: str):
+        """获取属于该用户的任务（读取数据库中的最新状态），不存在或已过期时返回None"""
+        from models import db, ChatJob
+
+        job = ChatJob.query.filter_by(id=job_id, user_id=int(user_id)).populate_existing().first()
+        # 结束读事务，之后的轮询能看到其他worker提交的结果
+        db.session.commit()
+        if job is None or (job.finished_at is not None
+                           and job.finished_at <= datetime.utcnow() - timedelta(seconds=self.ttl)):
+            return None
+        return job
+
+    def wait(self, job_id: str, timeout: float):
+        """
+        等待任务完成或丢失，最多timeout秒
+        任务在本进程执行时等待完成通知，否则按CHAT_JOB_POLL_INTERVAL轮询数据库
+        """
+        from models import db, ChatJob
+
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            row = db.session.query(ChatJob.status, ChatJob.created_at).filter_by(id=job_id).first()
+            db.session.commit()
+            if row is None or is_lost(row) or row.status == DONE:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(CHAT_JOB_POLL_INTERVAL, remaining))
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程排队和执行中的任务数"""
+        with self._lock:
+            return {'pending': self._pending, 'max_pending': self.max_pending}
+
+
+# 全局实例（每个worker进程一个线程池，任务状态都在数据库中）
+chat_jobs = ChatJobManager()
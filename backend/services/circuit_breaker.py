@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import requests
+
+# 连续失败（超时、连接失败、429/5xx）多少次后断开
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+
+# 断开后的冷却时间（秒），期间所有请求直接失败
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+
+# 冷却结束后（半开状态）允许同时进行的探测请求数
+LLM_BREAKER_PROBES = int(os.getenv('LLM_BREAKER_PROBES', '1'))
+
+# 视为上游故障的状态码
+FAILURE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """熔断器处于断开状态，请求未发往上游"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("大模型服务熔断中")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    大模型服务的熔断器
+    连续失败达到阈值后断开，冷却期内的请求立即失败（不再等待完整的读取超时）；
+    冷却结束后进入半开状态，放行少量探测请求：探测成功则恢复，失败则重新断开
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 cooldown: float = LLM_BREAKER_COOLDOWN, probes: int = LLM_BREAKER_PROBES):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态；冷却结束的断开状态视为半开"""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    def _remaining_cooldown(self) -> float:
+        return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def before_call(self) -> bool:
+        """
+        请求发出前调用
+
+        Returns:
+            bool: 本次请求是否为半开状态下的探测请求
+
+        Raises:
+            CircuitOpen: 熔断器断开，或半开状态下探测名额已满
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            raise CircuitOpen(self._remaining_cooldown())
+
+    def record_success(self, probe: bool = False):
+        """上游正常响应"""
+        with self._lock:
+            if probe:
+                self._probes_in_flight -= 1
+            self.consecutive_failures = 0
+            self._state = CLOSED
+
+    def record_failure(self, probe: bool = False):
+        """上游超时、连接失败或返回429/5xx"""
+        with self._lock:
+            if probe:
+                self._probes_in_flight -= 1
+            self.consecutive_failures += 1
+            if probe or (self._state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self.times_opened += 1
+
+    def release(self, probe: bool = False):
+        """请求因与上游无关的原因中止，只归还探测名额"""
+        if probe:
+            with self._lock:
+                self._probes_in_flight -= 1
+
+    def call(self, func: Callable[..., requests.Response], *args, **kwargs) -> requests.Response:
+        """
+        通过熔断器调用上游接口，按结果更新状态
+
+        Raises:
+            CircuitOpen: 熔断器断开
+            requests.exceptions.RequestException: 上游请求失败
+        """
+        probe = self.before_call()
+        try:
+            response = func(*args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record_failure(probe)
+            raise
+        except BaseException:
+            self.release(probe)
+            raise
+        if response.status_code in FAILURE_STATUS_CODES:
+            self.record_failure(probe)
+        else:
+            self.record_success(probe)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """熔断器状态，供/api/health展示"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                'state': state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_after': round(self._remaining_cooldown(), 3) if state == OPEN else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+
+# 全局实例（每个worker进程一个）
+llm_breaker = CircuitBreaker()
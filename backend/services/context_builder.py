@@ -0,0 +1,134 @@
+import math
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 发送给大模型的上下文（系统提示、记忆和用户消息）的token预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '2000'))
+
+# 每次最多检索多少条记忆参与打包
+CONTEXT_MAX_MEMORIES = int(os.getenv('CONTEXT_MAX_MEMORIES', '3'))
+
+# 每条消息的角色和格式开销（按OpenAI兼容接口的惯例估算）
+TOKENS_PER_MESSAGE = 4
+
+# 记忆中AI回复保留的最大字符数
+MEMORY_REPLY_CHARS = 100
+
+# 只有相似度高于该值的记忆才会进入上下文
+MEMORY_MIN_SIMILARITY = 0.3
+
+MEMORY_HEADER = "\n\n基于我们之前的对话，我记得：\n"
+MEMORY_FOOTER = "\n请结合这些历史信息来回复用户的新问题。"
+
+# 中日韩文字大致一个字一个token，其余文字按每4个字符一个token估算
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_CJK_PATTERN = re.compile(f'[{_CJK_CHARS}]')
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(content: str) -> int:
+    """
+    在本地粗略估算文本的token数（区分中日韩文字）
+
+    Args:
+        content (str): 文本内容
+
+    Returns:
+        int: 估算的token数
+    """
+    if not content:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(content))
+    others = len(content) - cjk
+    return cjk + math.ceil(others / _CHARS_PER_TOKEN)
+
+
+_tokenizer: Callable[[str], int] = estimate_tokens
+
+
+def set_tokenizer(tokenizer: Optional[Callable[[str], int]]):
+    """
+    替换token计数函数，例如接入与模型一致的分词器；传None恢复默认估算
+
+    Args:
+        tokenizer (Callable[[str], int]): 接收文本、返回token数的函数
+    """
+    global _tokenizer
+    _tokenizer = tokenizer or estimate_tokens
+
+
+def count_tokens(content: str) -> int:
+    """用当前的token计数函数统计文本的token数"""
+    return _tokenizer(content)
+
+
+def format_memory(index: int, memory: Dict[str, Any]) -> str:
+    """把一条检索到的记忆（对话摘要或原始对话）格式化为上下文中的一行（AI回复截断到MEMORY_REPLY_CHARS）"""
+    if 'summary' in memory:
+        return f"{index}. 我们之前聊过：{memory['summary']}\n"
+    line = f"{index}. 你曾经说过：\"{memory['user_message']}\"\n"
+    if memory.get('ai_response'):
+        line += f"   我当时回复：\"{memory['ai_response'][:MEMORY_REPLY_CHARS]}...\"\n"
+    return line
+
+
+def assemble_context(system_prompt: str, memories: List[Dict[str, Any]], user_content: str,
+                     budget: int = None) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    在token预算内组装系统提示、记忆和用户消息
+    系统提示和用户消息总是保留；记忆按检索排名依次加入，放不下时从排名最低的开始舍弃
+
+    Args:
+        system_prompt (str): 系统提示
+        memories (List[Dict]): 检索到的记忆（对话摘要或原始对话），按优先级降序
+        user_content (str): 用户消息
+        budget (int): token预算，默认为CONTEXT_TOKEN_BUDGET
+
+    Returns:
+        Tuple[List[Dict], Dict]: 消息列表，以及各部分的token统计
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    system_tokens = count_tokens(system_prompt) + TOKENS_PER_MESSAGE
+    user_tokens = count_tokens(user_content) + TOKENS_PER_MESSAGE
+    remaining = budget - system_tokens - user_tokens
+
+    candidates = [memory for memory in memories if memory['similarity'] > MEMORY_MIN_SIMILARITY]
+    lines = []
+    memory_tokens = count_tokens(MEMORY_HEADER + MEMORY_FOOTER) + TOKENS_PER_MESSAGE
+    for memory in candidates:
+        line = format_memory(len(lines) + 1, memory)
+        line_tokens = count_tokens(line)
+        if memory_tokens + line_tokens > remaining:
+            break
+        lines.append(line)
+        memory_tokens += line_tokens
+
+    messages = [{"role": "system", "content": system_prompt}]
+    memory_tokens = 0
+    if lines:
+        # 分段估算的结果不小于整体估算，按整体重新统计，不会超出预算
+        memory_content = MEMORY_HEADER + ''.join(lines) + MEMORY_FOOTER
+        memory_tokens = count_tokens(memory_content) + TOKENS_PER_MESSAGE
+        messages.append({"role": "system", "content": memory_content})
+    messages.append({"role": "user", "content": user_content})
+
+    report = {
+        'budget': budget,
+        'system': system_tokens,
+        'memory': memory_tokens,
+        'user': user_tokens,
+        'total': system_tokens + memory_tokens + user_tokens,
+        'memories_used': len(lines),
+        'memories_dropped': len(candidates) - len(lines)
+    }
+    record_context_report(report)
+    return messages, report
+
+
+def record_context_report(report: Dict[str, int]):
+    """把本次请求的token统计记录到请求上下文，由app在响应时写入日志和响应头"""
+    from flask import g, has_request_context
+
+    if has_request_context():
+        g.context_tokens = report
@@ -1,6 +1,21 @@
 import hashlib
 import numpy as np
 from typing import List
+from .stage_timer import timed_stage
+
+# 字符频率特征使用的常见字符
+COMMON_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789 .,!?'
+
+# 码位到常见字符列号的查找表，-1表示不是常见字符（最后一项兜底所有非ASCII码位）
+_COMMON_CHAR_LOOKUP = np.full(129, -1, dtype=np.int64)
+for _column, _char in enumerate(COMMON_CHARS):
+    _COMMON_CHAR_LOOKUP[ord(_char)] = _column
+
+# str.split()视为空白的码位查找表（空白码位最大为U+3000，最后一项兜底更大的码位）
+_WHITESPACE_LOOKUP = np.array([chr(c).isspace() for c in range(0x3001)] + [False])
+
+# 字节特征最多取前50个字节
+_BYTE_FEATURES = 50
 
 class SimpleEmbeddingService:
     """
@@ -46,8 +61,7 @@ class SimpleEmbeddingService:
             char_counts[char] = char_counts.get(char, 0) + 1
         
         # 添加常见字符的频率
-        common_chars = 'abcdefghijklmnopqrstuvwxyz0123456789 .,!?'
-        for char in common_chars:
+        for char in COMMON_CHARS:
             freq = char_counts.get(char, 0) / max(len(text), 1)
             features.append(min(freq, 1.0))
         
@@ -79,6 +93,84 @@ class SimpleEmbeddingService:
         
         return features.tolist()
     
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        批量将文本编码为向量，结果与逐条调用encode一致
+        除哈希计算外，所有特征都在整个批次上用numpy计算
+
+        Args:
+            texts (List[str]): 输入文本列表
+
+        Returns:
+            np.ndarray: 形状为 (n, vector_dim) 的float32矩阵
+        """
+        n = len(texts)
+        if n == 0:
+            return np.zeros((0, self.vector_dim), dtype=np.float32)
+
+        texts = [text.lower().strip() for text in texts]
+        encoded = [text.encode('utf-8') for text in texts]
+
+        # 1/2. MD5和SHA1哈希特征（每条文本唯一的Python级开销）
+        md5_bytes = np.frombuffer(b''.join([hashlib.md5(b).digest() for b in encoded]), dtype=np.uint8)
+        sha1_bytes = np.frombuffer(b''.join([hashlib.sha1(b).digest() for b in encoded]), dtype=np.uint8)
+        hash_features = np.hstack([md5_bytes.reshape(n, 16), sha1_bytes.reshape(n, 20)]) / 255.0
+
+        # 按字符（码位）展开整个批次，通过二分查找把字符位置映射回所属文本
+        char_lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n)
+        char_ends = np.cumsum(char_lengths)
+        codepoints = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+        # 3. 文本长度特征
+        length_feature = np.minimum(char_lengths / 1000.0, 1.0)
+
+        # 4. 字符频率特征
+        columns = _COMMON_CHAR_LOOKUP[np.minimum(codepoints, 128)]
+        positions = np.flatnonzero(columns >= 0)
+        char_counts = np.bincount(
+            np.searchsorted(char_ends, positions, side='right') * len(COMMON_CHARS) + columns[positions],
+            minlength=n * len(COMMON_CHARS)
+        ).reshape(n, len(COMMON_CHARS))
+        char_freq = np.minimum(char_counts / np.maximum(char_lengths, 1)[:, None], 1.0)
+
+        # 5. 单词数量特征：统计“前一个字符是空白或位于文本开头”的非空白字符
+        is_space = _WHITESPACE_LOOKUP[np.minimum(codepoints, len(_WHITESPACE_LOOKUP) - 1)]
+        prev_space = np.ones_like(is_space)
+        prev_space[1:] = is_space[:-1]
+        prev_space[(char_ends - char_lengths)[char_lengths > 0]] = True
+        word_starts = np.flatnonzero(prev_space & ~is_space)
+        word_count = np.bincount(np.searchsorted(char_ends, word_starts, side='right'), minlength=n)
+        word_feature = np.minimum(word_count / 100.0, 1.0)
+
+        # 6. 前50个字节的特征
+        byte_lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=n)
+        all_bytes = np.frombuffer(b''.join(encoded) + bytes(_BYTE_FEATURES), dtype=np.uint8)
+        byte_offsets = np.cumsum(byte_lengths) - byte_lengths
+        byte_count = np.minimum(byte_lengths, _BYTE_FEATURES)
+        byte_positions = np.arange(_BYTE_FEATURES)
+        byte_features = all_bytes[byte_offsets[:, None] + byte_positions] / 255.0
+
+        # 组装特征：固定部分之后依次是字节特征和补齐特征
+        fixed = np.hstack([
+            hash_features,
+            length_feature[:, None],
+            char_freq,
+            word_feature[:, None],
+        ])
+        features = np.empty((n, max(self.vector_dim, fixed.shape[1] + _BYTE_FEATURES)))
+        features[:, :fixed.shape[1]] = fixed
+        # 补齐值与encode一致：(features[0] + 0.1) % 1.0
+        features[:, fixed.shape[1]:] = ((fixed[:, 0] + 0.1) % 1.0)[:, None]
+        byte_block = features[:, fixed.shape[1]:fixed.shape[1] + _BYTE_FEATURES]
+        byte_mask = byte_positions < byte_count[:, None]
+        byte_block[byte_mask] = byte_features[byte_mask]
+        features = features[:, :self.vector_dim]
+
+        # 归一化向量
+        norms = np.sqrt(np.einsum('ij,ij->i', features, features))[:, None]
+        np.divide(features, norms, out=features, where=norms > 0)
+        return features.astype(np.float32)
+    
     def similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """
         计算两个向量的余弦相似度
@@ -116,7 +208,20 @@ def get_text_embedding(text: str) -> List[float]:
     Returns:
         List[float]: 文本向量
     """
-    return embedding_service.encode(text)
+    with timed_stage('embedding'):
+        return embedding_service.encode(text)
+
+def get_text_embeddings(texts: List[str]) -> np.ndarray:
+    """
+    批量获取文本的向量表示，适用于回填、导入和重建索引
+
+    Args:
+        texts (List[str]): 输入文本列表
+
+    Returns:
+        np.ndarray: 形状为 (n, 384) 的float32矩阵
+    """
+    return embedding_service.encode_batch(texts)
 
 def calculate_similarity(embedding1: List[float], embedding2: List[float]) -> float:
     """
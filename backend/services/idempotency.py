@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+# 已完成请求的结果保留多久（秒），期间同一幂等键的重试直接重放结果
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))
+
+# 重复请求等待进行中的同一请求完成的最长时间（秒）。sync worker等待期间整个进程被占住，
+# 必须远小于gunicorn的worker超时（gunicorn_config.timeout = 120），否则worker会在返回409之前被杀掉
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '60'))
+
+# 等待超时返回409时建议客户端多久后重试（秒），写入Retry-After响应头
+IDEMPOTENCY_RETRY_AFTER = int(os.getenv('IDEMPOTENCY_RETRY_AFTER', '5'))
+
+# 等待期间轮询数据库的间隔（秒）：首个请求可能在另一个worker中执行
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv('IDEMPOTENCY_POLL_INTERVAL', '0.2'))
+
+# 进行中的请求超过这段时间（秒）仍未完成时，视为执行它的worker已退出，下一次重试接管该键
+IDEMPOTENCY_LEASE = float(os.getenv('IDEMPOTENCY_LEASE', '300'))
+
+# 幂等键的最大长度
+MAX_KEY_LENGTH = 255
+
+# 标记降级回复（大模型不可用时返回的提示语）的响应头，带有该头的结果不保存供重放
+FALLBACK_HEADER = 'X-Fallback-Reply'
+
+# 请求结果：(响应体, 状态码, 响应头)
+Result = Tuple[Dict[str, Any], int, Dict[str, str]]
+
+
+class IdempotencyConflict(Exception):
+    """同一幂等键被用于内容不同的请求"""
+
+
+def request_fingerprint(*parts) -> str:
+    """请求内容的摘要，用于识别同一幂等键下内容不同的请求"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def is_replayable(result: Result) -> bool:
+    """只有成功且不是降级回复的结果保留供重放，其余结果释放幂等键，客户端可以用同一个键重试"""
+    return 200 <= result[1] < 300 and FALLBACK_HEADER not in result[2]
+
+
+def _load_result(record) -> Result:
+    stored = json.loads(record.response_json)
+    return stored['body'], record.status_code, stored['headers']
+
+
+class IdempotencyEntry:
+    """一个已登记的幂等键：首个请求在此记录结果，重复请求在此等待或读取结果"""
+
+    def __init__(self, user_id: int, key: str, fingerprint: str, result: Optional[Result] = None):
+        self.user_id = user_id
+        self.key = key
+        self.fingerprint = fingerprint
+        self.result = result
+
+    def wait(self, timeout: float = None) -> Optional[Result]:
+        """轮询数据库等待首个请求完成，最多timeout秒（默认IDEMPOTENCY_WAIT），超时返回None"""
+        from models import db, IdempotencyKey
+
+        if timeout is None:
+            timeout = IDEMPOTENCY_WAIT
+        deadline = time.monotonic() + timeout
+        while self.result is None:
+            record = IdempotencyKey.query.filter_by(user_id=self.user_id, key=self.key).first()
+            if record is not None and record.fingerprint == self.fingerprint and record.status_code is not None:
+                self.result = _load_result(record)
+            # 结束读事务，下一次轮询能看到其他worker提交的结果
+            db.session.commit()
+            if self.result is not None:
+                break
+            remaining = deadline - time.monotonic()
+            if record is None or record.fingerprint != self.fingerprint or remaining <= 0:
+                return None
+            time.sleep(min(IDEMPOTENCY_POLL_INTERVAL, remaining))
+        return self.result
+
+
+class IdempotencyStore:
+    """
+    保存在数据库中的幂等键（idempotency_key表），多个worker共享
+    同一用户的同一幂等键由唯一约束保证只有一个请求能登记并实际执行：
+    进行中的重复请求轮询等待首个请求的结果，成功完成的结果在TTL内直接重放；
+    失败或降级的结果只返回给正在等待的请求，之后的重试会重新执行
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE):
+        self.ttl = ttl
+        self.lease = lease
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.attached = 0
+        self.replayed = 0
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def begin(self, user_id, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        """
+        登记一个带幂等键的请求（需在应用上下文中调用，会提交当前会话）
+
+        Returns:
+            Tuple[IdempotencyEntry, bool]: 对应的条目，以及本请求是否需要实际执行
+
+        Raises:
+            IdempotencyConflict: 幂等键已被内容不同的请求使用
+        """
+        from models import db, IdempotencyKey
+
+        user_id = int(user_id)
+        while True:
+            now = datetime.utcnow()
+            # 顺带清除该用户已过期或已释放的键
+            IdempotencyKey.query.filter(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.expires_at <= now
+            ).delete(synchronize_session='fetch')
+            db.session.commit()
+            db.session.add(IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, created_at=now))
+            try:
+                db.session.commit()
+                self._count('executed')
+                return IdempotencyEntry(user_id, key, fingerprint), True
+            except IntegrityError:
+                # 该键已被登记（可能在另一个worker中）
+                db.session.rollback()
+
+            record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+            if record is None:
+                # 登记它的请求刚好过期被清除，重新登记
+                db.session.commit()
+                continue
+            if record.fingerprint != fingerprint:
+                db.session.commit()
+                raise IdempotencyConflict(key)
+            if record.status_code is not None:
+                result = _load_result(record)
+                db.session.commit()
+                if record.expires_at is not None and record.expires_at <= now:
+                    continue
+                self._count('replayed')
+                return IdempotencyEntry(user_id, key, fingerprint, result), False
+            if record.created_at <= now - timedelta(seconds=self.lease):
+                # 执行它的worker已退出：条件更新保证只有一个重试接管
+                taken = IdempotencyKey.query.filter_by(
+                    id=record.id, created_at=record.created_at, status_code=None
+                ).update({'created_at': now}, synchronize_session=False)
+                db.session.commit()
+                if taken:
+                    self._count('executed')
+                    return IdempotencyEntry(user_id, key, fingerprint), True
+                continue
+            db.session.commit()
+            self._count('attached')
+            return IdempotencyEntry(user_id, key, fingerprint), False
+
+    def finish(self, entry: IdempotencyEntry, result: Result):
+        """
+        记录请求结果，等待中的重复请求随后读到它
+        可重放的结果（见is_replayable）保留TTL秒，其余结果立即过期，下一次重试会重新执行
+        """
+        from models import db, IdempotencyKey
+
+        body, status_code, headers = result
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl) if is_replayable(result) else now
+        entry.result = result
+        IdempotencyKey.query.filter_by(
+            user_id=entry.user_id, key=entry.key, fingerprint=entry.fingerprint, status_code=None
+        ).update({
+            'status_code': status_code,
+            'response_json': json.dumps({'body': body, 'headers': headers}, ensure_ascii=False),
+            'expires_at': expires_at
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def clear(self):
+        """清空统计"""
+        with self._lock:
+            self.executed = self.attached = self.replayed = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程执行、挂起等待和重放的次数"""
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'attached': self.attached,
+                'replayed': self.replayed
+            }
+
+
+# 全局实例（每个worker进程一个，状态都在数据库中）
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,197 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# 每个worker进程同时发往方舟API的最大请求数
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+
+# 等待空闲名额的最大排队数，队列已满时立即拒绝
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '32'))
+
+# 排队等待的最长时间（秒），超时后拒绝
+LLM_MAX_WAIT = float(os.getenv('LLM_MAX_WAIT', '10'))
+
+# 所有worker合计的最大并发数（通过文件锁在同一台机器的进程间协调），为0时不限制
+LLM_GLOBAL_CONCURRENCY = int(os.getenv('LLM_GLOBAL_CONCURRENCY', '0'))
+
+# 跨进程名额使用的锁文件目录
+LLM_SLOT_DIR = os.getenv(
+    'LLM_SLOT_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'llm_slots')
+)
+
+# 轮询跨进程名额的间隔（秒）
+_SLOT_POLL_INTERVAL = 0.05
+
+
+class LimiterSaturated(Exception):
+    """大模型调用已饱和（排队已满或等待超时），调用方应返回503并带上Retry-After"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FileSlots:
+    """
+    基于文件锁的跨进程名额
+    每个名额对应一个锁文件，进程持有某个文件的排他锁即占用一个名额，进程退出时锁自动释放
+    """
+
+    def __init__(self, size: int, directory: str = LLM_SLOT_DIR):
+        import fcntl  # 仅在类Unix系统上可用
+
+        self._fcntl = fcntl
+        self.size = size
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, deadline: float) -> Optional[int]:
+        """在deadline（time.monotonic时间）之前占用一个名额，返回文件描述符，超时返回None"""
+        while True:
+            for slot in range(self.size):
+                fd = os.open(os.path.join(self.directory, f'{slot}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                    return fd
+                except OSError:
+                    os.close(fd)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(_SLOT_POLL_INTERVAL)
+
+    def release(self, fd: int):
+        self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class ConcurrencyLimiter:
+    """
+    大模型调用的并发限制器
+    超出并发上限的请求在有界队列中等待，队列已满或等待超过max_wait时抛出LimiterSaturated，
+    避免流量高峰时所有worker同时打到方舟API触发限流
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 max_wait: float = LLM_MAX_WAIT, global_concurrency: int = LLM_GLOBAL_CONCURRENCY,
+                 slot_dir: str = LLM_SLOT_DIR):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._global_slots = FileSlots(global_concurrency, slot_dir) if global_concurrency > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+        self.total_hold = 0.0
+
+    def retry_after(self) -> int:
+        """建议客户端多久后重试（秒）：按已完成调用的平均占用时间估算"""
+        with self._condition:
+            average = self.total_hold / self.completed if self.completed else self.max_wait
+        return max(1, math.ceil(average))
+
+    def has_capacity(self) -> bool:
+        """当前是否还能接收新的请求（有空闲名额或排队未满）"""
+        with self._condition:
+            return self.active < self.max_concurrency or self.waiting < self.max_queue
+
+    def _reject(self, message: str):
+        raise LimiterSaturated(message, self.retry_after())
+
+    def _acquire(self) -> float:
+        """占用进程内名额，返回开始等待的时间"""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        with self._condition:
+            if self.active >= self.max_concurrency:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    message = "大模型调用排队已满"
+                else:
+                    self.waiting += 1
+                    self.peak_waiting = max(self.peak_waiting, self.waiting)
+                    try:
+                        while self.active >= self.max_concurrency:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self._condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                    message = "等待大模型调用名额超时"
+                    if self.active >= self.max_concurrency:
+                        self.timed_out += 1
+            if self.active < self.max_concurrency:
+                self.active += 1
+                return start
+        self._reject(message)
+
+    def _release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """
+        占用一个调用名额，with块结束时释放
+
+        Raises:
+            LimiterSaturated: 排队已满或等待超时
+        """
+        start = self._acquire()
+        fd = None
+        try:
+            if self._global_slots is not None:
+                fd = self._global_slots.acquire(start + self.max_wait)
+                if fd is None:
+                    with self._condition:
+                        self.timed_out += 1
+                    self._reject("等待跨进程大模型调用名额超时")
+        except BaseException:
+            self._release()
+            raise
+
+        acquired = time.monotonic()
+        waited = acquired - start
+        with self._condition:
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait_seen = max(self.max_wait_seen, waited)
+        try:
+            yield
+        finally:
+            if fd is not None:
+                self._global_slots.release(fd)
+            with self._condition:
+                self.total_hold += time.monotonic() - acquired
+                self.completed += 1
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        """并发数、队列深度和等待时间统计"""
+        with self._condition:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'peak_queue_depth': self.peak_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_ms': round(self.total_wait / self.admitted * 1000, 3) if self.admitted else 0.0,
+                'max_wait_ms': round(self.max_wait_seen * 1000, 3)
+            }
+
+
+# 全局实例（每个worker进程一个）
+llm_limiter = ConcurrencyLimiter()
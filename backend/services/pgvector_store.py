@@ -0,0 +1,197 @@
+import os
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from sqlalchemy import DDL, bindparam, event, inspect, text
+
+from .vector_index import UserVectorIndex
+
+# PostgreSQL上的向量列和近似最近邻索引（需要pgvector扩展和psycopg2驱动，
+# 通过DATABASE_URL=postgresql://...启用，SQLite部署不受影响）
+VECTOR_COLUMN = 'embedding_vector'
+VECTOR_DIM = 384
+
+# 近似最近邻索引类型：'hnsw'（默认，召回率高、无需训练）或 'ivfflat'（建索引更快、占用更小）
+PGVECTOR_INDEX = os.getenv('PGVECTOR_INDEX', 'hnsw').lower()
+
+# IVFFlat的聚类数，建议取 行数/1000 左右
+PGVECTOR_IVF_LISTS = int(os.getenv('PGVECTOR_IVF_LISTS', '100'))
+
+# 查询时HNSW的候选列表大小，越大召回率越高、越慢
+PGVECTOR_EF_SEARCH = int(os.getenv('PGVECTOR_EF_SEARCH', '100'))
+
+# 查询时IVFFlat探查的聚类数
+PGVECTOR_PROBES = int(os.getenv('PGVECTOR_PROBES', '10'))
+
+# 近似索引的迭代扫描（pgvector 0.8及以上）：'relaxed_order'（默认）或 'off'
+# 索引扫描出的候选按user_id过滤后不足limit条时继续扫描，而不是只在ef_search/probes个全表候选里过滤
+PGVECTOR_ITERATIVE_SCAN = os.getenv('PGVECTOR_ITERATIVE_SCAN', 'relaxed_order').lower()
+
+VECTOR_INDEX_NAME = f'ix_conversation_{VECTOR_COLUMN}'
+
+CREATE_VECTOR_EXTENSION = "CREATE EXTENSION IF NOT EXISTS vector"
+ADD_VECTOR_COLUMN = f"ALTER TABLE conversation ADD COLUMN IF NOT EXISTS {VECTOR_COLUMN} vector({VECTOR_DIM})"
+DROP_VECTOR_COLUMN = f"ALTER TABLE conversation DROP COLUMN IF EXISTS {VECTOR_COLUMN}"
+DROP_VECTOR_INDEX = f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}"
+
+if PGVECTOR_INDEX == 'ivfflat':
+    CREATE_VECTOR_INDEX = (
+        f"CREATE INDEX IF NOT EXISTS {VECTOR_INDEX_NAME} ON conversation "
+        f"USING ivfflat ({VECTOR_COLUMN} vector_cosine_ops) WITH (lists = {PGVECTOR_IVF_LISTS:d})"
+    )
+else:
+    CREATE_VECTOR_INDEX = (
+        f"CREATE INDEX IF NOT EXISTS {VECTOR_INDEX_NAME} ON conversation "
+        f"USING hnsw ({VECTOR_COLUMN} vector_cosine_ops)"
+    )
+
+# <=> 为余弦距离，1 - 距离即余弦相似度；与内存索引一致，负的相似度截断为0，分数相同按ID升序
+_TOP_K_QUERY = (
+    f"SELECT id, GREATEST(1 - ({VECTOR_COLUMN} <=> CAST(:query AS vector)), 0) AS score "
+    "FROM conversation "
+    f"WHERE user_id = :user_id AND role = 'user' AND {VECTOR_COLUMN} IS NOT NULL"
+)
+_ORDER_BY = f" ORDER BY {VECTOR_COLUMN} <=> CAST(:query AS vector), id LIMIT :limit"
+
+# 精确扫描：排序表达式加0后与近似索引的操作符不再匹配，规划器只能按user_id取出该用户的全部向量后排序
+_EXACT_ORDER_BY = f" ORDER BY ({VECTOR_COLUMN} <=> CAST(:query AS vector)) + 0, id LIMIT :limit"
+
+# 零向量的余弦距离没有定义（NaN），与内存索引一样视为全部相似度为0
+_ZERO_QUERY = (
+    "SELECT id, 0.0 AS score FROM conversation "
+    f"WHERE user_id = :user_id AND role = 'user' AND {VECTOR_COLUMN} IS NOT NULL"
+)
+
+
+def to_vector_literal(embedding) -> str:
+    """把向量转换为pgvector的文本格式 '[x1,x2,...]'"""
+    values = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return '[' + ','.join(repr(float(value)) for value in values) + ']'
+
+
+# 数据库安装的pgvector是否支持迭代扫描，首次查询时检测（每个进程一次）
+_iterative_scan_supported = None
+
+
+def _supports_iterative_scan(session) -> bool:
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        version = session.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        try:
+            _iterative_scan_supported = tuple(int(part) for part in version.split('.')[:2]) >= (0, 8)
+        except (AttributeError, ValueError):
+            _iterative_scan_supported = False
+    return _iterative_scan_supported
+
+
+class PGVectorIndex(UserVectorIndex):
+    """
+    在PostgreSQL内计算相似度的用户向量索引
+    向量保存在conversation.embedding_vector（pgvector列）上，top-k由数据库按余弦距离排序后返回，
+    进程内不保存任何向量，多个节点共享同一份索引。
+    近似索引覆盖全表，user_id条件在索引扫描之后过滤：pgvector 0.8及以上开启迭代扫描，过滤后不足limit条时
+    继续扫描；返回仍不足limit条时（该用户的消息只占全表很小一部分）改为对该用户的消息精确排序
+    """
+
+    stored_in_database = True
+
+    def __init__(self, user_id: int, vector_dim: int = VECTOR_DIM):
+        super().__init__(vector_dim)
+        self.user_id = int(user_id)
+
+    def add_many(self, conversation_ids: Iterable[int], embeddings) -> int:
+        # 向量在写入对话时已同步到pgvector列
+        return 0
+
+    def _top_k(self, query_embedding, limit: int, where: str = '', params: dict = None) -> List[Tuple[int, float]]:
+        from models import db
+
+        if limit <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        if np.linalg.norm(query) == 0:
+            return self._execute(_ZERO_QUERY + where + " ORDER BY id LIMIT :limit", query, limit, params)
+
+        # 只对本事务生效的近似索引查询参数
+        if PGVECTOR_INDEX == 'ivfflat':
+            index_type = 'ivfflat'
+            db.session.execute(text(f"SET LOCAL ivfflat.probes = {PGVECTOR_PROBES:d}"))
+        else:
+            index_type = 'hnsw'
+            db.session.execute(text(f"SET LOCAL hnsw.ef_search = {PGVECTOR_EF_SEARCH:d}"))
+        iterative = PGVECTOR_ITERATIVE_SCAN != 'off' and _supports_iterative_scan(db.session)
+        if iterative:
+            db.session.execute(text(f"SET LOCAL {index_type}.iterative_scan = relaxed_order"))
+        results = self._execute(_TOP_K_QUERY + where + _ORDER_BY, query, limit, params)
+        if len(results) < limit:
+            return self._execute(_TOP_K_QUERY + where + _EXACT_ORDER_BY, query, limit, params)
+        if iterative:
+            # relaxed_order下结果可能略微乱序
+            results.sort(key=lambda item: (-item[1], item[0]))
+        return results
+
+    def _execute(self, sql: str, query: np.ndarray, limit: int, params: dict = None) -> List[Tuple[int, float]]:
+        from models import db
+
+        statement = text(sql)
+        if params and 'candidate_ids' in params:
+            statement = statement.bindparams(bindparam('candidate_ids', expanding=True))
+        rows = db.session.execute(statement, {
+            'query': to_vector_literal(query), 'limit': limit, 'user_id': self.user_id, **(params or {})
+        }).fetchall()
+        return [(int(row_id), float(score)) for row_id, score in rows]
+
+    def search(self, query_embedding, limit: int = 5) -> List[Tuple[int, float]]:
+        return self._top_k(query_embedding, limit)
+
+    def rerank(self, query_embedding, candidate_ids: Iterable[int], limit: int = 5) -> List[Tuple[int, float]]:
+        candidates = [int(candidate_id) for candidate_id in candidate_ids]
+        if not candidates:
+            return []
+        return self._top_k(query_embedding, limit, ' AND id IN :candidate_ids', {'candidate_ids': candidates})
+
+
+def _write_vector(connection, target):
+    from models import load_embedding
+
+    state = target.__dict__
+    embedding = load_embedding(state.get('embedding_blob'), state.get('embedding_json'))
+    connection.execute(
+        text(f"UPDATE conversation SET {VECTOR_COLUMN} = CAST(:vector AS vector) WHERE id = :id"),
+        {'vector': to_vector_literal(embedding) if embedding is not None else None, 'id': target.id}
+    )
+
+
+def _after_insert(mapper, connection, target):
+    """新的用户消息在同一事务内写入pgvector列"""
+    if connection.dialect.name != 'postgresql' or target.role != 'user':
+        return
+    if target.__dict__.get('embedding_blob') is not None or target.__dict__.get('embedding_json') is not None:
+        _write_vector(connection, target)
+
+
+def _after_update(mapper, connection, target):
+    """向量修改后同步pgvector列"""
+    if connection.dialect.name != 'postgresql' or target.role != 'user':
+        return
+    attrs = inspect(target).attrs
+    if attrs.embedding_blob.history.has_changes() or attrs.embedding_json.history.has_changes():
+        _write_vector(connection, target)
+
+
+def register_pgvector_hooks():
+    """注册建表和ORM写入钩子，使pgvector列与Conversation的向量保持同步（只在PostgreSQL上生效）"""
+    from models import Conversation
+
+    if event.contains(Conversation, 'after_insert', _after_insert):
+        return
+    # db.create_all()（测试中使用）时一并创建扩展、向量列和近似最近邻索引
+    table = Conversation.__table__
+    event.listen(table, 'before_create', DDL(CREATE_VECTOR_EXTENSION).execute_if(dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(ADD_VECTOR_COLUMN).execute_if(dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(CREATE_VECTOR_INDEX).execute_if(dialect='postgresql'))
+    event.listen(Conversation, 'after_insert', _after_insert)
+    event.listen(Conversation, 'after_update', _after_update)
+
+
+register_pgvector_hooks()
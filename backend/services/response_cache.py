@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# 语义回复缓存默认关闭，设置SEMANTIC_CACHE_ENABLED=1开启
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+# 查询向量与缓存提问的余弦相似度不低于该值时视为同一个问题
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+
+# 缓存回复的有效期（秒）
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+
+# 全部用户合计最多缓存的回复数（按LRU淘汰）
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '2048'))
+
+# 单个用户最多缓存的回复数，查找时逐条比较，需保持较小
+SEMANTIC_CACHE_MAX_PER_USER = int(os.getenv('SEMANTIC_CACHE_MAX_PER_USER', '32'))
+
+
+def context_key(*parts: str) -> str:
+    """
+    回复所依赖的固定配置（系统提示、模型等）的摘要，配置变化后旧的回复不再命中
+    检索到的记忆不参与缓存键：每轮对话保存后用户的记忆都会变化（刚保存的提问本身就会被检索到），
+    以记忆为键时重复提问永远无法命中；记忆更新后仍可能返回旧回复，最长持续SEMANTIC_CACHE_TTL
+    """
+    context = json.dumps(parts, ensure_ascii=False)
+    return hashlib.blake2b(context.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class SemanticResponseCache:
+    """
+    按用户隔离的语义回复缓存
+    同一用户在相同系统配置下提出的问题，只要与缓存的提问足够相似就直接返回缓存的回复，
+    省去一次大模型调用。条目按TTL过期，超出容量时淘汰最久未命中的条目
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 max_per_user: int = SEMANTIC_CACHE_MAX_PER_USER):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_per_user = max_per_user
+        # (用户ID, 条目序号) -> (过期时间, 上下文摘要, 归一化向量, 回复)，顺序即LRU顺序
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[0]]
+
+    def get(self, user_id, query_embedding, context: str) -> Optional[str]:
+        """
+        查找与查询足够相似的缓存回复
+
+        Args:
+            user_id: 用户ID
+            query_embedding: 用户消息向量
+            context (str): 上下文摘要（见context_key）
+
+        Returns:
+            Optional[str]: 缓存的回复，未命中时返回None
+        """
+        query = self._normalize(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key in list(self._user_keys.get(int(user_id), ())):
+                expires_at, entry_context, vector, _ = self._entries[key]
+                if expires_at <= now:
+                    self._remove(key)
+                    continue
+                if query is None or entry_context != context or vector.shape != query.shape:
+                    continue
+                score = float(vector @ query)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][3]
+
+    def put(self, user_id, query_embedding, context: str, response: str):
+        """缓存一次成功的回复"""
+        vector = self._normalize(query_embedding)
+        if vector is None or self.max_entries <= 0 or self.max_per_user <= 0:
+            return
+        user_id = int(user_id)
+        with self._lock:
+            self._next_id += 1
+            key = (user_id, self._next_id)
+            self._entries[key] = (time.monotonic() + self.ttl, context, vector, response)
+            user_keys = self._user_keys.setdefault(user_id, set())
+            user_keys.add(key)
+            if len(user_keys) > self.max_per_user:
+                # 同一用户超出配额时淘汰该用户最久未用的条目
+                oldest = next(k for k in self._entries if k[0] == user_id)
+                self._remove(oldest)
+                self.evictions += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：是否开启、条目数、命中/未命中/淘汰次数"""
+        with self._lock:
+            return {
+                'enabled': SEMANTIC_CACHE_ENABLED,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# 全局实例
+semantic_cache = SemanticResponseCache()
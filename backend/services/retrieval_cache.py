@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# 检索结果缓存的最大条目数（按LRU淘汰），为0时关闭缓存
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '1024'))
+
+# 缓存条目的有效期（秒）：其他worker写入的新消息最多在这段时间后可见
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '60'))
+
+# 查询向量归一化后按该步长量化，几乎相同的查询会落到同一个缓存键
+RETRIEVAL_CACHE_QUANTUM = float(os.getenv('RETRIEVAL_CACHE_QUANTUM', '0.01'))
+
+
+def quantize_embedding(embedding, quantum: float = RETRIEVAL_CACHE_QUANTUM) -> bytes:
+    """
+    把查询向量量化为定长摘要，作为缓存键的一部分
+
+    Args:
+        embedding: 查询向量
+        quantum (float): 量化步长
+
+    Returns:
+        bytes: 量化后向量的摘要
+    """
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    levels = np.rint(vector / quantum).astype(np.int32)
+    return hashlib.blake2b(levels.tobytes(), digest_size=16).digest()
+
+
+class RetrievalCache:
+    """
+    进程内的检索结果缓存（LRU + TTL）
+    键为 (用户ID, 用户索引版本, 返回数量, 量化查询向量)；本进程提交该用户的对话写入后版本号递增，
+    旧条目随之失效并被立即清除，其他worker的写入则由TTL兜底
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE, ttl: float = RETRIEVAL_CACHE_TTL,
+                 quantum: float = RETRIEVAL_CACHE_QUANTUM):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.quantum = quantum
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def _key(self, user_id, version: int, query_embedding, limit: int):
+        return (int(user_id), version, int(limit), quantize_embedding(query_embedding, self.quantum))
+
+    def get(self, user_id, query_embedding, limit: int) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """
+        查找缓存的检索结果
+
+        Returns:
+            Tuple: (结果，未命中或已过期时为None; 查找时读到的用户索引版本)，
+            未命中时须把该版本传给put
+        """
+        user_id = int(user_id)
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            if self.max_entries <= 0:
+                return None, version
+            key = self._key(user_id, version, query_embedding, limit)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, version
+            expires_at, results = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None, version
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # 返回副本，调用方修改结果不会影响缓存
+        return [dict(result) for result in results], version
+
+    def put(self, user_id, query_embedding, limit: int, results: List[Dict[str, Any]], version: int):
+        """
+        写入一次检索的结果
+
+        Args:
+            version (int): 检索前get返回的版本；检索期间该用户有新消息提交（版本已递增）时丢弃本次写入，
+                避免把失效前的结果写到新版本的键下
+        """
+        if self.max_entries <= 0:
+            return
+        user_id = int(user_id)
+        stored = [dict(result) for result in results]
+        with self._lock:
+            if self._versions.get(user_id, 0) != version:
+                self.stale_puts += 1
+                return
+            key = self._key(user_id, version, query_embedding, limit)
+            self._entries[key] = (time.monotonic() + self.ttl, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """用户有新消息写入时调用：递增索引版本并清除该用户的全部条目"""
+        user_id = int(user_id)
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            stale = [key for key in self._entries if key[0] == user_id]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+            self.stale_puts = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        缓存统计，用于评估容量是否合适
+
+        Returns:
+            Dict: 条目数、容量、命中/未命中/淘汰/过期/失效/丢弃的过期写入次数和命中率
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'stale_puts': self.stale_puts,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# 全局实例
+retrieval_cache = RetrievalCache()
+
+
+def _collect_changed_user(mapper, connection, target):
+    """记录本次事务中对话有变化的用户，提交后再使其缓存失效"""
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('retrieval_cache_users', set()).add(target.user_id)
+
+
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('retrieval_cache_users', ()):
+        retrieval_cache.invalidate(user_id)
+
+
+def _discard_after_rollback(session):
+    session.info.pop('retrieval_cache_users', None)
+
+
+def register_invalidation_hooks():
+    """通过ORM新增、修改或删除对话并提交后，使该用户缓存的检索结果失效"""
+    from models import Conversation
+
+    if event.contains(Conversation, 'after_insert', _collect_changed_user):
+        return
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Conversation, identifier, _collect_changed_user)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_rollback', _discard_after_rollback)
+
+
+register_invalidation_hooks()
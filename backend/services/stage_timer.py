@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageTimer:
+    """
+    单个请求内的阶段计时器
+    记录每个阶段（向量化、检索、大模型调用等）的执行次数和累计耗时
+    """
+
+    def __init__(self):
+        self._stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name: str):
+        """计时一个阶段，同名阶段的次数和耗时会累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            count, total = self._stages.get(name, (0, 0.0))
+            self._stages[name] = (count + 1, total + elapsed)
+
+    def count(self, name: str) -> int:
+        """某个阶段在本次请求中执行的次数"""
+        return self._stages.get(name, (0, 0.0))[0]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        汇总各阶段的执行情况
+
+        Returns:
+            Dict: {阶段名: {'count': 次数, 'ms': 累计毫秒}}
+        """
+        return {
+            name: {'count': count, 'ms': round(total * 1000, 3)}
+            for name, (count, total) in self._stages.items()
+        }
+
+    def server_timing_header(self) -> str:
+        """生成Server-Timing响应头，浏览器开发者工具可以直接展示"""
+        return ', '.join(
+            f'{name};desc="x{count}";dur={total * 1000:.3f}'
+            for name, (count, total) in self._stages.items()
+        )
+
+
+def get_stage_timer() -> StageTimer:
+    """
+    获取当前请求的计时器
+    不在请求上下文中时（脚本、测试）返回一个临时计时器
+    """
+    from flask import g, has_request_context
+
+    if not has_request_context():
+        return StageTimer()
+    if 'stage_timer' not in g:
+        g.stage_timer = StageTimer()
+    return g.stage_timer
+
+
+def timed_stage(name: str):
+    """在当前请求的计时器上计时一个阶段"""
+    return get_stage_timer().stage(name)
@@ -0,0 +1,255 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from .circuit_breaker import llm_breaker, CircuitOpen
+from .embedding_service import get_text_embedding
+from .llm_limiter import llm_limiter, LimiterSaturated
+
+# 是否在应用进程中启动后台摘要任务（默认关闭）
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+# 后台摘要任务的运行间隔（秒）
+SUMMARY_INTERVAL = float(os.getenv('SUMMARY_INTERVAL', '300'))
+
+# 每个用户最近的多少条对话保持原样，不参与摘要
+SUMMARY_KEEP_RECENT = int(os.getenv('SUMMARY_KEEP_RECENT', '40'))
+
+# 每条摘要覆盖的对话条数（用户消息和AI回复各算一条）
+SUMMARY_CHUNK_SIZE = int(os.getenv('SUMMARY_CHUNK_SIZE', '20'))
+
+# 后台摘要任务的锁文件：每个gunicorn worker都会启动摘要线程，每轮只有拿到锁的进程执行，
+# 避免多个进程为同一段对话重复调用大模型
+SUMMARY_LOCK_PATH = os.getenv(
+    'SUMMARY_LOCK_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'summary_worker.lock')
+)
+
+# 构建上下文时最多使用的摘要条数
+SUMMARY_MAX_MEMORIES = int(os.getenv('SUMMARY_MAX_MEMORIES', '2'))
+
+SUMMARY_PROMPT = (
+    "请把下面这段用户与AI教练的对话压缩成一段简洁的中文摘要（不超过200字），"
+    "保留用户的目标、进展、偏好和重要的个人情况，不要添加对话中没有的信息。"
+)
+
+# 摘要函数：接收对话文本，返回摘要；失败时返回None
+Summarize = Callable[[str], Optional[str]]
+
+
+def summarize_with_llm(transcript: str) -> Optional[str]:
+    """
+    调用豆包大模型生成对话摘要
+    与对话请求共用并发限制器和熔断器：上游故障或熔断期间不生成摘要，留到下一轮
+
+    Args:
+        transcript (str): 按行排列的对话文本
+
+    Returns:
+        Optional[str]: 摘要，请求失败、排队已满或熔断中时返回None
+    """
+    import requests
+    from .ai_service import API_ENDPOINT, VOLC_ARK_API_KEY, build_payload
+    from .ark_client import ark_client
+
+    payload = build_payload([
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": transcript}
+    ])
+    try:
+        with llm_limiter.slot():
+            response = llm_breaker.call(ark_client.post_chat_completion, API_ENDPOINT, VOLC_ARK_API_KEY, payload)
+        if response.status_code != 200:
+            print(f"摘要请求失败，状态码: {response.status_code}")
+            return None
+        choices = response.json().get("choices") or []
+        content = choices[0]["message"]["content"].strip() if choices else ''
+        return content or None
+    except (LimiterSaturated, CircuitOpen) as e:
+        print(f"跳过本次摘要: {str(e)}")
+        return None
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"摘要请求错误: {str(e)}")
+        return None
+
+
+def format_transcript(rows) -> str:
+    """把一段对话记录整理为摘要的输入文本"""
+    speakers = {'user': '用户', 'ai': 'AI教练'}
+    return '\n'.join(f"{speakers.get(row.role, row.role)}：{row.content}" for row in rows)
+
+
+def summarized_until(user_id) -> int:
+    """该用户已被摘要覆盖的最大对话ID，没有摘要时为0"""
+    from models import db, ConversationSummary
+
+    last_id = db.session.query(func.max(ConversationSummary.end_id)).filter(
+        ConversationSummary.user_id == int(user_id)
+    ).scalar()
+    return last_id or 0
+
+
+def summarize_user(user_id, summarize: Summarize = None) -> int:
+    """
+    把该用户尚未摘要的较早对话按SUMMARY_CHUNK_SIZE条一段生成摘要
+    最近SUMMARY_KEEP_RECENT条对话和凑不满一段的对话留到以后处理
+
+    Args:
+        user_id: 用户ID
+        summarize (Callable): 摘要函数，默认调用大模型（测试中可传入本地模拟函数）
+
+    Returns:
+        int: 新生成的摘要条数
+    """
+    from models import db, Conversation, ConversationSummary
+
+    summarize = summarize or summarize_with_llm
+    user_id = int(user_id)
+    rows = Conversation.query.with_entities(
+        Conversation.id, Conversation.role, Conversation.content
+    ).filter(
+        Conversation.user_id == user_id,
+        Conversation.id > summarized_until(user_id)
+    ).order_by(Conversation.id.asc()).all()
+
+    pending = rows[:max(len(rows) - SUMMARY_KEEP_RECENT, 0)]
+    created = 0
+    for start in range(0, len(pending) - SUMMARY_CHUNK_SIZE + 1, SUMMARY_CHUNK_SIZE):
+        chunk = pending[start:start + SUMMARY_CHUNK_SIZE]
+        content = summarize(format_transcript(chunk))
+        if not content:
+            break
+        db.session.add(ConversationSummary(
+            user_id=user_id,
+            content=content,
+            start_id=chunk[0].id,
+            end_id=chunk[-1].id,
+            message_count=len(chunk),
+            embedding=get_text_embedding(content)
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 其他worker已经为这段对话生成了摘要
+            db.session.rollback()
+            break
+        created += 1
+    return created
+
+
+def summarize_all(summarize: Summarize = None) -> int:
+    """
+    为所有对话足够多的用户生成摘要
+
+    Returns:
+        int: 新生成的摘要总数
+    """
+    from models import db, Conversation
+
+    user_ids = [row[0] for row in db.session.query(Conversation.user_id).group_by(
+        Conversation.user_id
+    ).having(func.count(Conversation.id) >= SUMMARY_KEEP_RECENT + SUMMARY_CHUNK_SIZE).all()]
+    return sum(summarize_user(user_id, summarize) for user_id in user_ids)
+
+
+def search_summaries(user_id, query_embedding, limit: int = SUMMARY_MAX_MEMORIES) -> List[Dict[str, Any]]:
+    """
+    在用户的摘要中查找与查询最相关的几条
+    每个用户的摘要数量约为对话数的1/SUMMARY_CHUNK_SIZE，直接整体计算相似度
+
+    Args:
+        user_id: 用户ID
+        query_embedding: 查询向量
+        limit (int): 返回数量
+
+    Returns:
+        List[Dict]: 摘要列表，按相似度降序，包含summary、end_id和similarity
+    """
+    from models import ConversationSummary, decode_embedding
+
+    rows = ConversationSummary.query.with_entities(
+        ConversationSummary.content, ConversationSummary.end_id, ConversationSummary.embedding_blob
+    ).filter(
+        ConversationSummary.user_id == int(user_id),
+        ConversationSummary.embedding_blob.isnot(None)
+    ).order_by(ConversationSummary.id.asc()).all()
+    if not rows or limit <= 0:
+        return []
+
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    matrix = np.array([decode_embedding(row.embedding_blob) for row in rows], dtype=np.float32)
+    denominator = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    scores = np.divide(matrix @ query, denominator, out=np.zeros(len(rows), dtype=np.float32),
+                       where=denominator > 0)
+    np.maximum(scores, 0.0, out=scores)
+    order = np.argsort(-scores, kind='stable')[:limit]
+    return [
+        {'summary': rows[i].content, 'end_id': rows[i].end_id, 'similarity': float(scores[i])}
+        for i in order
+    ]
+
+
+class SummaryWorker:
+    """
+    按固定间隔在后台线程中运行summarize_all
+    每轮先以非阻塞方式获取SUMMARY_LOCK_PATH的文件锁，锁被其他进程持有时跳过本轮；
+    持有锁的进程退出后锁自动释放，下一轮由其他进程接手
+    """
+
+    def __init__(self, app, interval: float = SUMMARY_INTERVAL, summarize: Summarize = None,
+                 lock_path: str = SUMMARY_LOCK_PATH):
+        import fcntl  # 仅在类Unix系统上可用
+
+        self._fcntl = fcntl
+        self.app = app
+        self.interval = interval
+        self.summarize = summarize
+        self.lock_path = lock_path
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _try_lock(self) -> Optional[int]:
+        """获取摘要锁，返回文件描述符；其他进程正在摘要时返回None"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    def run_once(self) -> int:
+        """在应用上下文中执行一轮摘要，其他进程正在执行时返回0"""
+        fd = self._try_lock()
+        if fd is None:
+            return 0
+        try:
+            with self.app.app_context():
+                try:
+                    return summarize_all(self.summarize)
+                except Exception as e:
+                    self.app.logger.error(f"对话摘要任务出错: {str(e)}")
+                    return 0
+        finally:
+            self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='summary-worker', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,236 @@
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DDL, event, inspect, text
+
+from .vector_index import sync_user_index
+
+# 检索模式：'vector'（只用向量索引，默认）或 'hybrid'（先用FTS5按BM25预筛选候选，再按向量相似度重排）
+# 混合模式会把词项命中的记录排在纯向量命中之前，尚未在真实数据上评估召回率，需要时显式开启。
+# 只有混合模式下写入对话时才同步全文索引；切换到混合模式后，每个进程首次检索前补齐缺失的记录
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+
+# 补齐全文索引时每批写入的记录数
+BACKFILL_CHUNK_SIZE = int(os.getenv('FTS_BACKFILL_CHUNK_SIZE', '1000'))
+
+# BM25预筛选保留的候选数量
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '200'))
+
+# 单次查询最多使用的词项数，避免长消息生成过大的MATCH表达式
+MAX_QUERY_TERMS = 64
+
+# 与conversation表同步的FTS5全文索引（只收录用户消息，rowid即对话ID）
+FTS_TABLE = 'conversation_fts'
+
+CREATE_FTS_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(owner, terms, tokenize='unicode61 remove_diacritics 2')"
+)
+DROP_FTS_TABLE = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+# 中日韩文字没有空格分词，按连续字符的二元组（bigram）切分
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_PATTERN = re.compile(f'[{_CJK_CHARS}]+|[^\\W_{_CJK_CHARS}]+')
+_CJK_PATTERN = re.compile(f'[{_CJK_CHARS}]')
+
+
+def tokenize(content: str) -> List[str]:
+    """
+    把文本切分为全文索引的词项
+    英文等按单词切分并转小写；中文按相邻两个字切分，单独一个字时保留单字
+
+    Args:
+        content (str): 文本内容
+
+    Returns:
+        List[str]: 词项列表
+    """
+    terms = []
+    for run in _TOKEN_PATTERN.findall(content.lower()):
+        if _CJK_PATTERN.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def owner_term(user_id) -> str:
+    """owner列中标识用户的词项，查询时用它把匹配限定在当前用户"""
+    return f'u{int(user_id)}'
+
+
+def build_match_query(user_id, content: str) -> Optional[str]:
+    """
+    构造FTS5的MATCH表达式：限定用户，并对所有词项取OR交给BM25排序
+
+    Returns:
+        Optional[str]: MATCH表达式，文本中没有可用词项时返回None
+    """
+    terms = list(dict.fromkeys(tokenize(content)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    # 词项只包含文字和数字，直接加引号作为短语即可
+    alternatives = ' OR '.join(f'"{term}"' for term in terms)
+    return f'owner : "{owner_term(user_id)}" AND terms : ({alternatives})'
+
+
+def search_candidates(user_id, content: str, limit: int = HYBRID_CANDIDATES) -> List[int]:
+    """
+    用BM25在用户的历史消息中预筛选候选
+
+    Args:
+        user_id: 用户ID
+        content (str): 查询文本
+        limit (int): 候选数量上限
+
+    Returns:
+        List[int]: 候选对话ID，按BM25相关度降序
+    """
+    from models import db
+
+    query = build_match_query(user_id, content)
+    if query is None or db.session.get_bind().dialect.name != 'sqlite':
+        return []
+    rows = db.session.execute(
+        text(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query "
+            f"ORDER BY bm25({FTS_TABLE}, 0.0, 1.0) LIMIT :limit"
+        ),
+        {'query': query, 'limit': limit}
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def hybrid_search(user_id, content: str, query_embedding, limit: int = 5) -> List[Tuple[int, float]]:
+    """
+    混合检索：BM25预筛选出的候选按向量相似度重排
+    候选不足limit条时，用全量向量检索的结果补足
+
+    Args:
+        user_id: 用户ID
+        content (str): 查询文本
+        query_embedding: 查询向量
+        limit (int): 返回数量
+
+    Returns:
+        List[Tuple[int, float]]: (对话ID, 相似度) 列表，词项命中的记录排在前面
+    """
+    backfill_index()
+    index = sync_user_index(user_id)
+    candidates = search_candidates(user_id, content)
+    matches = index.rerank(query_embedding, candidates, limit) if candidates else []
+    if len(matches) < limit:
+        seen = {conversation_id for conversation_id, _ in matches}
+        fallback = index.search(query_embedding, limit + len(matches))
+        matches += [match for match in fallback if match[0] not in seen][:limit - len(matches)]
+    return matches
+
+
+def _index_conversation(connection, conversation):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': conversation.id})
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, owner, terms) VALUES (:id, :owner, :terms)"),
+        {
+            'id': conversation.id,
+            'owner': owner_term(conversation.user_id),
+            'terms': ' '.join(tokenize(conversation.content))
+        }
+    )
+
+
+# 本进程是否已补齐全文索引
+_index_complete = False
+_index_lock = threading.Lock()
+
+
+def backfill_index() -> int:
+    """
+    把尚未进入全文索引的用户消息补写进去（混合模式下每个进程首次检索时执行一次）
+    非混合模式期间写入的消息不同步全文索引，切换到混合模式后由这里按对话ID分批补齐
+
+    Returns:
+        int: 补写的记录数
+    """
+    global _index_complete
+    from models import db
+
+    if _index_complete:
+        return 0
+    with _index_lock:
+        if _index_complete:
+            return 0
+        if db.session.get_bind().dialect.name != 'sqlite':
+            _index_complete = True
+            return 0
+        total = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                text(
+                    f"SELECT c.id, c.user_id, c.content FROM conversation AS c "
+                    f"LEFT JOIN {FTS_TABLE} AS f ON f.rowid = c.id "
+                    "WHERE c.role = 'user' AND c.id > :last_id AND f.rowid IS NULL "
+                    "ORDER BY c.id LIMIT :limit"
+                ),
+                {'last_id': last_id, 'limit': BACKFILL_CHUNK_SIZE}
+            ).fetchall()
+            if not rows:
+                break
+            connection = db.session.connection()
+            for row in rows:
+                _index_conversation(connection, row)
+            db.session.commit()
+            total += len(rows)
+            last_id = rows[-1].id
+        _index_complete = True
+        return total
+
+
+def reset_backfill():
+    """让下一次混合检索重新检查全文索引是否完整（测试中重建数据库后使用）"""
+    global _index_complete
+    with _index_lock:
+        _index_complete = False
+
+
+def _after_insert(mapper, connection, target):
+    """混合模式下新的用户消息在同一事务内写入全文索引"""
+    if connection.dialect.name == 'sqlite' and target.role == 'user' and RETRIEVAL_MODE == 'hybrid':
+        _index_conversation(connection, target)
+
+
+def _after_update(mapper, connection, target):
+    """消息内容修改后重建该条记录的全文索引；非混合模式下只删除旧记录，切换到混合模式时再补写"""
+    if connection.dialect.name != 'sqlite' or target.role != 'user':
+        return
+    if not inspect(target).attrs.content.history.has_changes():
+        return
+    if RETRIEVAL_MODE == 'hybrid':
+        _index_conversation(connection, target)
+    else:
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+
+
+def _after_delete(mapper, connection, target):
+    """删除消息时删除其全文索引（任何模式下都执行，避免留下失效的记录）"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+
+
+def register_text_search_hooks():
+    """注册建表和ORM写入钩子，使全文索引与Conversation.content保持同步"""
+    from models import Conversation
+
+    if event.contains(Conversation, 'after_insert', _after_insert):
+        return
+    # db.create_all()/drop_all()（测试中使用）时一并创建和删除全文索引
+    event.listen(Conversation.__table__, 'after_create', DDL(CREATE_FTS_TABLE).execute_if(dialect='sqlite'))
+    event.listen(Conversation.__table__, 'before_drop', DDL(DROP_FTS_TABLE).execute_if(dialect='sqlite'))
+    event.listen(Conversation, 'after_insert', _after_insert)
+    event.listen(Conversation, 'after_update', _after_update)
+    event.listen(Conversation, 'after_delete', _after_delete)
+
+
+register_text_search_hooks()
@@ -0,0 +1,325 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.engine import make_url
+
+from .db_profile import DATABASE_URL
+
+# 每个进程最多缓存多少个用户的向量索引（按LRU淘汰）
+VECTOR_INDEX_MAX_USERS = int(os.getenv('VECTOR_INDEX_MAX_USERS', '1024'))
+
+# 向量索引实现：'exact'（整块矩阵暴力扫描，默认）、'ivf'（近似最近邻，见ann_index.py）
+# 、'mmap'（多个worker共享的内存映射段文件，见vector_segments.py）
+# 或 'pgvector'（在PostgreSQL内用pgvector索引计算top-k，见pgvector_store.py）
+# 未设置时，数据库为PostgreSQL则使用'pgvector'，否则使用'exact'
+VECTOR_INDEX_BACKEND = os.getenv(
+    'VECTOR_INDEX_BACKEND', 'pgvector' if make_url(DATABASE_URL).get_backend_name() == 'postgresql' else 'exact'
+)
+
+# 索引矩阵的初始容量，之后按倍数扩容
+_INITIAL_CAPACITY = 64
+
+
+class UserVectorIndex:
+    """
+    单个用户的内存向量索引
+    所有向量按行存放在一块连续的float32矩阵中（已归一化），
+    查询时只需一次矩阵-向量乘法加argpartition即可得到top-k
+    """
+
+    # 向量是否直接在数据库中检索（为True时无需从数据库同步到索引）
+    stored_in_database = False
+
+    def __init__(self, vector_dim: int = 384):
+        self.vector_dim = vector_dim
+        self._matrix = np.zeros((_INITIAL_CAPACITY, vector_dim), dtype=np.float32)
+        self._ids = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        self._size = 0
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, extra: int):
+        """确保矩阵还能再容纳extra行"""
+        needed = self._size + extra
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.vector_dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix = matrix
+        self._ids = ids
+
+    def add_many(self, conversation_ids: Iterable[int], embeddings) -> int:
+        """
+        批量追加向量（增量写入，不重建已有数据）
+
+        Args:
+            conversation_ids (Iterable[int]): 对话记录ID，需按升序给出
+            embeddings: 形状为 (n, dim) 的向量集合
+
+        Returns:
+            int: 实际追加的行数
+        """
+        ids = np.asarray(list(conversation_ids), dtype=np.int64)
+        if ids.size == 0:
+            return 0
+        vectors = np.array(embeddings, dtype=np.float32).reshape(ids.size, self.vector_dim)
+
+        # 预先归一化，查询时点积即为余弦相似度
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        with self._lock:
+            # 跳过已经写入过的记录，保证重复同步时幂等
+            fresh = ids > self.last_id
+            if not fresh.all():
+                ids = ids[fresh]
+                vectors = vectors[fresh]
+            if ids.size == 0:
+                return 0
+            self._reserve(ids.size)
+            start = self._size
+            self._matrix[start:start + ids.size] = vectors
+            self._ids[start:start + ids.size] = ids
+            self._size += ids.size
+            self.last_id = int(ids.max())
+            self._on_append(start, self._size)
+        return int(ids.size)
+
+    def _on_append(self, start: int, stop: int):
+        """新行[start, stop)写入后的钩子（持有锁时调用），供子类维护额外结构"""
+        pass
+
+    def add(self, conversation_id: int, embedding) -> int:
+        """追加单条向量"""
+        return self.add_many([conversation_id], [embedding])
+
+    def search(self, query_embedding, limit: int = 5) -> List[Tuple[int, float]]:
+        """
+        查询与给定向量最相似的记录
+
+        Args:
+            query_embedding: 查询向量
+            limit (int): 返回数量
+
+        Returns:
+            List[Tuple[int, float]]: (对话ID, 相似度) 列表，按相似度降序
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        matrix, ids = self._snapshot()
+        size = ids.shape[0]
+        if size == 0 or limit <= 0:
+            return []
+        if norm == 0:
+            scores = np.zeros(size, dtype=np.float32)
+        else:
+            scores = matrix @ (query / norm)
+            np.maximum(scores, 0.0, out=scores)  # 与calculate_similarity一致，确保非负
+
+        return top_k(scores, ids, limit)
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """当前已写入的 (向量矩阵, ID数组) 视图，ID按升序排列"""
+        with self._lock:
+            return self._matrix[:self._size], self._ids[:self._size]
+
+    def rerank(self, query_embedding, candidate_ids: Iterable[int], limit: int = 5) -> List[Tuple[int, float]]:
+        """
+        只在给定的候选记录中按相似度排序（不在索引中的候选会被忽略）
+
+        Args:
+            query_embedding: 查询向量
+            candidate_ids (Iterable[int]): 候选对话ID
+            limit (int): 返回数量
+
+        Returns:
+            List[Tuple[int, float]]: (对话ID, 相似度) 列表，按相似度降序
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        matrix, ids = self._snapshot()
+        candidates = np.unique(np.asarray(list(candidate_ids), dtype=np.int64))
+        if ids.shape[0] == 0 or candidates.size == 0 or limit <= 0:
+            return []
+
+        # ID升序排列，二分查找候选所在的行
+        positions = np.searchsorted(ids, candidates)
+        found = positions < ids.shape[0]
+        positions = positions[found]
+        positions = positions[ids[positions] == candidates[found]]
+        if positions.size == 0:
+            return []
+        if norm == 0:
+            scores = np.zeros(positions.size, dtype=np.float32)
+        else:
+            scores = matrix[positions] @ (query / norm)
+            np.maximum(scores, 0.0, out=scores)
+        return top_k(scores, ids[positions], limit)
+
+
+def top_k(scores: np.ndarray, ids: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+    """
+    从分数数组中选出前limit个，按分数降序返回 (ID, 分数)
+
+    Args:
+        scores (np.ndarray): 分数，与ids一一对应（ids需为升序，决定并列时的顺序）
+        ids (np.ndarray): 对话记录ID
+        limit (int): 返回数量
+
+    Returns:
+        List[Tuple[int, float]]: (对话ID, 相似度) 列表
+    """
+    size = scores.shape[0]
+    if limit < size:
+        # argpartition只找出第limit大的分数，再把所有不低于该分数的行都纳入，
+        # 这样并列分数也能与逐条扫描时的稳定排序保持一致
+        kth = np.argpartition(-scores, limit - 1)[limit - 1]
+        candidates = np.flatnonzero(scores >= scores[kth])
+    else:
+        candidates = np.arange(size)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')][:limit]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def create_vector_index(vector_dim: int = 384, user_id=None) -> UserVectorIndex:
+    """按VECTOR_INDEX_BACKEND创建一个空索引（mmap和pgvector后端需要user_id）"""
+    if VECTOR_INDEX_BACKEND == 'pgvector':
+        from .pgvector_store import PGVectorIndex
+        return PGVectorIndex(user_id, vector_dim)
+    if VECTOR_INDEX_BACKEND == 'mmap':
+        from .vector_segments import SegmentVectorIndex
+        return SegmentVectorIndex(user_id, vector_dim)
+    if VECTOR_INDEX_BACKEND == 'ivf':
+        from .ann_index import IVFVectorIndex
+        return IVFVectorIndex(vector_dim)
+    return UserVectorIndex(vector_dim)
+
+
+class VectorIndexRegistry:
+    """
+    进程内的用户向量索引注册表
+    首次查询时从数据库加载，之后只增量同步新写入的记录
+    """
+
+    def __init__(self, max_users: int = VECTOR_INDEX_MAX_USERS, vector_dim: int = 384):
+        self.max_users = max_users
+        self.vector_dim = vector_dim
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> Optional[UserVectorIndex]:
+        """获取已加载的索引，不存在时返回None"""
+        with self._lock:
+            index = self._indexes.get(int(user_id))
+            if index is not None:
+                self._indexes.move_to_end(int(user_id))
+            return index
+
+    def get_or_create(self, user_id) -> UserVectorIndex:
+        """获取用户索引，不存在时创建一个空索引"""
+        user_id = int(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = create_vector_index(self.vector_dim, user_id)
+                self._indexes[user_id] = index
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def discard(self, user_id=None):
+        """丢弃某个用户（或全部用户）的索引"""
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(int(user_id), None)
+
+
+# 全局实例
+vector_index_registry = VectorIndexRegistry()
+
+
+def sync_user_index(user_id) -> UserVectorIndex:
+    """
+    把数据库中尚未进入索引的用户消息增量同步到索引
+    其他worker写入的新消息也会在这里被补上
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        UserVectorIndex: 已同步的索引
+    """
+    from models import Conversation, load_embedding
+
+    index = vector_index_registry.get_or_create(user_id)
+    if index.stored_in_database:
+        return index
+    rows = Conversation.query.with_entities(
+        Conversation.id,
+        Conversation.embedding_blob,
+        Conversation.embedding_json
+    ).filter(
+        Conversation.user_id == int(user_id),
+        Conversation.role == 'user',
+        Conversation.id > index.last_id,
+        or_(Conversation.embedding_blob.isnot(None), Conversation.embedding_json.isnot(None))
+    ).order_by(Conversation.id.asc()).all()
+
+    if rows:
+        conversation_ids = [row.id for row in rows]
+        embeddings = np.array(
+            [load_embedding(row.embedding_blob, row.embedding_json) for row in rows], dtype=np.float32
+        )
+        index.add_many(conversation_ids, embeddings)
+    return index
+
+
+def search_user_index(user_id, query_embedding, limit: int = 5) -> List[Tuple[int, float]]:
+    """
+    在用户索引中查询top-k相似记录
+
+    Args:
+        user_id: 用户ID
+        query_embedding: 查询向量
+        limit (int): 返回数量
+
+    Returns:
+        List[Tuple[int, float]]: (对话ID, 相似度) 列表
+    """
+    return sync_user_index(user_id).search(query_embedding, limit)
+
+
+def refresh_user_index(user_id):
+    """
+    新消息提交后把它增量追加到本进程已加载的索引
+    索引尚未加载时无需处理，首次查询时会从数据库完整加载
+
+    Args:
+        user_id: 用户ID
+    """
+    if vector_index_registry.get(user_id) is not None:
+        sync_user_index(user_id)
+
+
+# 在PostgreSQL上把用户消息的向量同步到pgvector列
+from . import pgvector_store  # noqa: E402,F401
+
+if VECTOR_INDEX_BACKEND == 'mmap':
+    from .vector_segments import register_deletion_hooks
+    register_deletion_hooks()
@@ -0,0 +1,324 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .vector_index import UserVectorIndex, top_k
+
+# 向量段文件目录，所有gunicorn worker共享同一份文件并通过操作系统页缓存零拷贝读取
+VECTOR_SEGMENT_DIR = os.getenv(
+    'VECTOR_SEGMENT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'vector_segments')
+)
+
+# 按用户ID分目录，避免单个目录下文件过多
+VECTOR_SEGMENT_SHARDS = 256
+
+# 已删除记录达到段内行数的该比例（且不少于COMPACT_MIN_DELETED条）时在后台压缩
+COMPACT_DELETED_RATIO = float(os.getenv('VECTOR_SEGMENT_COMPACT_RATIO', '0.1'))
+COMPACT_MIN_DELETED = 16
+
+
+class SegmentVectorIndex(UserVectorIndex):
+    """
+    基于内存映射段文件的用户向量索引
+    每个用户两个只追加的文件：{shard}/{user_id}.ids（小端int64对话ID）和
+    {user_id}.vec（小端float32向量，已归一化，按行连续存放），第i个ID对应第i行向量。
+    向量文件映射为连续的 (n, dim) 矩阵，查询时矩阵-向量乘法直接读取页缓存，不复制数据。
+    删除的记录先写入墓碑文件（.del），再由后台线程压缩重写段文件。
+    多个worker进程共享页缓存，无需各自从数据库预热
+    """
+
+    def __init__(self, user_id: int, vector_dim: int = 384, directory: str = None):
+        super().__init__(vector_dim)
+        self.user_id = int(user_id)
+        self.row_bytes = vector_dim * 4
+        self.shard_dir = os.path.join(directory or VECTOR_SEGMENT_DIR, f'{self.user_id % VECTOR_SEGMENT_SHARDS:02x}')
+        base = os.path.join(self.shard_dir, str(self.user_id))
+        self.ids_path = base + '.ids'
+        self.vectors_path = base + '.vec'
+        self.deleted_path = base + '.del'
+        self.lock_path = base + '.lock'
+        self._mapping = (np.zeros(0, dtype='<i8'), np.zeros((0, vector_dim), dtype='<f4'))
+        self._mapping_key = None
+        self._deleted = np.zeros(0, dtype=np.int64)
+        self._deleted_key = None
+        self._compacting = False
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False):
+        """
+        跨进程的文件锁：追加、删除标记和压缩持有排他锁；
+        重新映射时持有共享锁，保证读到的ID文件和向量文件属于同一次写入
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _stat_key(self):
+        """(ID文件inode, 向量文件inode, 完整记录数)，文件不存在时返回None"""
+        try:
+            ids_stat = os.stat(self.ids_path)
+            vectors_stat = os.stat(self.vectors_path)
+        except FileNotFoundError:
+            return None
+        count = min(ids_stat.st_size // 8, vectors_stat.st_size // self.row_bytes)
+        return ids_stat.st_ino, vectors_stat.st_ino, count
+
+    def _records(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        当前段文件的只读内存映射：(ID数组, 向量矩阵)
+        文件被追加或被压缩替换（inode变化）后重新映射，只读取两个文件都已写完整的记录
+        """
+        key = self._stat_key()
+        if key is None:
+            return self._empty()
+        with self._lock:
+            if key == self._mapping_key:
+                return self._mapping
+        with self._file_lock(shared=True):
+            key = self._stat_key()
+            if key is None:
+                return self._empty()
+            with self._lock:
+                if key != self._mapping_key:
+                    count = key[2]
+                    if count:
+                        ids = np.memmap(self.ids_path, dtype='<i8', mode='r', shape=(count,))
+                        matrix = np.memmap(self.vectors_path, dtype='<f4', mode='r', shape=(count, self.vector_dim))
+                    else:
+                        ids, matrix = self._empty()
+                    self._mapping = (ids, matrix)
+                    self._mapping_key = key
+                return self._mapping
+
+    def _empty(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.zeros(0, dtype='<i8'), np.zeros((0, self.vector_dim), dtype='<f4')
+
+    def _write_files(self, ids: np.ndarray, vectors: np.ndarray):
+        """重写ID文件和向量文件（持有排他锁时调用，各自写临时文件后原子替换）"""
+        np.ascontiguousarray(vectors, dtype='<f4').tofile(self.vectors_path + '.tmp')
+        np.ascontiguousarray(ids, dtype='<i8').tofile(self.ids_path + '.tmp')
+        os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        os.replace(self.ids_path + '.tmp', self.ids_path)
+
+    def _deleted_ids(self) -> np.ndarray:
+        """已标记删除、尚未压缩掉的对话ID（升序）"""
+        try:
+            stat = os.stat(self.deleted_path)
+        except FileNotFoundError:
+            return np.zeros(0, dtype=np.int64)
+        key = (stat.st_ino, stat.st_size)
+        with self._lock:
+            if key != self._deleted_key:
+                self._deleted = np.unique(np.fromfile(self.deleted_path, dtype='<i8'))
+                self._deleted_key = key
+            return self._deleted
+
+    def __len__(self) -> int:
+        return int(self._records()[0].shape[0])
+
+    @property
+    def last_id(self) -> int:
+        """段文件中最后一条记录的ID（包括其他worker追加的记录）"""
+        ids = self._records()[0]
+        return int(ids[-1]) if ids.shape[0] else 0
+
+    @last_id.setter
+    def last_id(self, value):
+        # 父类初始化时会赋值，段索引的last_id始终以文件内容为准
+        pass
+
+    def add_many(self, conversation_ids: Iterable[int], embeddings) -> int:
+        ids = np.asarray(list(conversation_ids), dtype=np.int64)
+        if ids.size == 0:
+            return 0
+        vectors = np.array(embeddings, dtype=np.float32).reshape(ids.size, self.vector_dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        os.makedirs(self.shard_dir, exist_ok=True)
+        with self._file_lock():
+            with open(self.ids_path, 'ab') as ids_file, open(self.vectors_path, 'ab') as vectors_file:
+                # 截掉进程崩溃时可能残留的半条记录，两个文件保持相同的行数
+                count = min(ids_file.tell() // 8, vectors_file.tell() // self.row_bytes)
+                for handle, size in ((ids_file, count * 8), (vectors_file, count * self.row_bytes)):
+                    if handle.tell() != size:
+                        handle.truncate(size)
+                        handle.seek(size)
+                # 其他worker可能已经追加过同一批记录（已持有排他锁，直接读文件中最后一个ID）
+                last_id = 0
+                if count:
+                    with open(self.ids_path, 'rb') as reader:
+                        reader.seek((count - 1) * 8)
+                        last_id = int(np.frombuffer(reader.read(8), dtype='<i8')[0])
+                fresh = ids > last_id
+                if not fresh.any():
+                    return 0
+                # 先写向量再写ID：读取方按两个文件中较短的一个计算记录数
+                vectors_file.write(np.ascontiguousarray(vectors[fresh], dtype='<f4').tobytes())
+                vectors_file.flush()
+                ids_file.write(ids[fresh].astype('<i8').tobytes())
+        return int(fresh.sum())
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        ids, matrix = self._records()
+        return matrix, ids
+
+    def search(self, query_embedding, limit: int = 5) -> List[Tuple[int, float]]:
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        ids, matrix = self._records()
+        size = ids.shape[0]
+        if size == 0 or limit <= 0:
+            return []
+        if norm == 0:
+            scores = np.zeros(size, dtype=np.float32)
+        else:
+            # matrix是映射文件上的连续float32矩阵，矩阵-向量乘法直接读取页缓存
+            scores = matrix @ (query / norm)
+            np.maximum(scores, 0.0, out=scores)  # 与calculate_similarity一致，确保非负
+
+        deleted = self._deleted_ids()
+        if deleted.size:
+            live = ~np.isin(ids, deleted)
+            return top_k(scores[live], np.asarray(ids)[live], limit)
+        return top_k(scores, ids, limit)
+
+    def rerank(self, query_embedding, candidate_ids: Iterable[int], limit: int = 5) -> List[Tuple[int, float]]:
+        # 已标记删除、尚未压缩掉的记录不参与重排
+        candidates = np.asarray(list(candidate_ids), dtype=np.int64)
+        deleted = self._deleted_ids()
+        if deleted.size:
+            candidates = candidates[~np.isin(candidates, deleted)]
+        return super().rerank(query_embedding, candidates, limit)
+
+    def mark_deleted(self, conversation_ids: Iterable[int]) -> Optional[threading.Thread]:
+        """
+        标记记录已删除，达到阈值时在后台线程中压缩段文件
+
+        Args:
+            conversation_ids (Iterable[int]): 被删除的对话ID
+
+        Returns:
+            Optional[threading.Thread]: 启动的压缩线程，未触发压缩时为None
+        """
+        ids = np.asarray(list(conversation_ids), dtype='<i8')
+        if ids.size == 0 or len(self) == 0:
+            return None
+        with self._file_lock():
+            with open(self.deleted_path, 'ab') as deleted_file:
+                deleted_file.write(ids.tobytes())
+
+        deleted_count = self._deleted_ids().size
+        if deleted_count >= max(COMPACT_MIN_DELETED, COMPACT_DELETED_RATIO * len(self)):
+            return self.compact_in_background()
+        return None
+
+    def compact_in_background(self) -> Optional[threading.Thread]:
+        """启动后台压缩线程（同一索引同时只运行一个）"""
+        with self._lock:
+            if self._compacting:
+                return None
+            self._compacting = True
+        thread = threading.Thread(target=self.compact, name=f'vector-segment-compact-{self.user_id}', daemon=True)
+        thread.start()
+        return thread
+
+    def compact(self) -> int:
+        """
+        重写段文件，去掉已删除的记录
+        新文件写完后通过os.replace替换，正在读取旧文件的worker会在下次查询时（持有共享锁）重新映射
+
+        Returns:
+            int: 删除的记录数
+        """
+        try:
+            with self._file_lock():
+                if not os.path.exists(self.deleted_path):
+                    return 0
+                deleted = np.unique(np.fromfile(self.deleted_path, dtype='<i8'))
+                key = self._stat_key()
+                size = key[2] if key else 0
+                ids = np.fromfile(self.ids_path, dtype='<i8', count=size) if size else np.zeros(0, dtype='<i8')
+                vectors = (np.fromfile(self.vectors_path, dtype='<f4', count=size * self.vector_dim)
+                           .reshape(size, self.vector_dim))
+                keep = ~np.isin(ids, deleted)
+                self._write_files(ids[keep], vectors[keep])
+                os.remove(self.deleted_path)
+                return int(size - keep.sum())
+        finally:
+            with self._lock:
+                self._compacting = False
+
+
+def _collect_deleted_conversation(mapper, connection, target):
+    """记录本次事务中删除的用户消息，提交后再写入墓碑文件"""
+    if target.role == 'user':
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault('deleted_conversations', []).append((target.user_id, target.id))
+
+
+def _collect_bulk_deleted_conversations(orm_execute_state):
+    """
+    Conversation.query.filter(...).delete()等批量删除不会触发after_delete，
+    执行前按同样的条件查出将被删除的用户消息，提交后同样写入墓碑文件
+    """
+    from models import Conversation
+
+    if not orm_execute_state.is_delete:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not Conversation:
+        return
+    statement = orm_execute_state.statement
+    query = select(Conversation.user_id, Conversation.id).where(Conversation.role == 'user')
+    if statement.whereclause is not None:
+        query = query.where(statement.whereclause)
+    rows = orm_execute_state.session.execute(query, orm_execute_state.parameters).all()
+    if rows:
+        orm_execute_state.session.info.setdefault('deleted_conversations', []).extend(
+            (row.user_id, row.id) for row in rows
+        )
+
+
+def _mark_deleted_after_commit(session):
+    deleted = session.info.pop('deleted_conversations', None)
+    if not deleted:
+        return
+    from .vector_index import vector_index_registry
+
+    by_user = {}
+    for user_id, conversation_id in deleted:
+        by_user.setdefault(user_id, []).append(conversation_id)
+    for user_id, conversation_ids in by_user.items():
+        index = vector_index_registry.get(user_id) or SegmentVectorIndex(user_id, vector_index_registry.vector_dim)
+        index.mark_deleted(conversation_ids)
+
+
+def _discard_deleted_after_rollback(session):
+    session.info.pop('deleted_conversations', None)
+
+
+def register_deletion_hooks():
+    """
+    通过ORM删除用户消息时同步标记段文件中的记录
+    覆盖session.delete(对象)和ORM批量删除（query.delete()、session.execute(delete(Conversation))）；
+    绕过ORM直接执行的DELETE语句（text()或Core的表级delete）不会被记录，启用mmap后端时不要使用
+    """
+    from models import Conversation
+
+    if not event.contains(Conversation, 'after_delete', _collect_deleted_conversation):
+        event.listen(Conversation, 'after_delete', _collect_deleted_conversation)
+        event.listen(Session, 'do_orm_execute', _collect_bulk_deleted_conversations)
+        event.listen(Session, 'after_commit', _mark_deleted_after_commit)
+        event.listen(Session, 'after_rollback', _discard_deleted_after_rollback)
@@ -0,0 +1,360 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 是否启用后台批量写入（默认关闭，对话在请求内同步提交）
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+# 单个事务最多写入的对话轮数
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '64'))
+
+# 收到第一轮对话后最多再等待多久凑成一批（秒）
+WRITE_BEHIND_LINGER = float(os.getenv('WRITE_BEHIND_LINGER', '0.02'))
+
+# 读取历史时等待该用户未落库对话的最长时间（秒）
+WRITE_BEHIND_READ_TIMEOUT = float(os.getenv('WRITE_BEHIND_READ_TIMEOUT', '5'))
+
+# 进程退出时等待队列写完的最长时间（秒）
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv('WRITE_BEHIND_SHUTDOWN_TIMEOUT', '30'))
+
+# 逐条重试仍写入失败的对话追加到该文件（每行一个JSON），下次启动时由一个worker认领并重新写入
+WRITE_BEHIND_SPILL_PATH = os.getenv(
+    'WRITE_BEHIND_SPILL_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'write_behind_failed.jsonl')
+)
+
+# 待落库凭据签发后超过这段时间（秒）仍查不到对话时，视为没有保存成功
+WRITE_BEHIND_TOKEN_TIMEOUT = float(os.getenv('WRITE_BEHIND_TOKEN_TIMEOUT', '60'))
+
+# 批量提交失败后逐条重试前的等待时间（秒）
+_RETRY_DELAY = 0.5
+
+_STOP = object()
+
+
+def new_token() -> str:
+    """签发待落库凭据：十六进制的签发时间（秒）加随机部分"""
+    return f'{int(time.time()):x}.{uuid.uuid4().hex}'
+
+
+def token_age(token: str) -> Optional[float]:
+    """凭据签发至今的秒数，格式无效时返回None"""
+    issued, _, random_part = token.partition('.')
+    try:
+        return time.time() - int(issued, 16) if random_part else None
+    except ValueError:
+        return None
+
+
+class PendingConversation:
+    """
+    已进入写入队列、尚未落库的AI回复
+    提供与Conversation相同的id/role/content/timestamp属性，落库前id为None；
+    token是返回给客户端的待落库凭据，落库后保存在AI回复的client_token列上，任意worker都能据此查到它
+    """
+
+    def __init__(self, user_id, user_message: str, user_embedding, ai_response: str,
+                 token: str = None, timestamp: datetime = None):
+        self.user_id = int(user_id)
+        self.user_message = user_message
+        self.user_embedding = user_embedding
+        self.content = ai_response
+        self.role = 'ai'
+        self.timestamp = timestamp or datetime.utcnow()
+        self.token = token or new_token()
+        self.id = None
+        self.error = None
+        self._conversation = None
+        self._written = threading.Event()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待该轮对话落库，返回是否已写入"""
+        return self._written.wait(timeout)
+
+
+class WriteBehindWriter:
+    """
+    对话记录的后台批量写入器
+    请求把一轮对话放入进程内队列后立即返回，后台线程把多轮对话合并到一个事务中提交，
+    减少并发对话在SQLite单写者锁上的排队。同一用户读取历史前会等待其未落库的对话写完；
+    进程正常退出时把队列写完（强制杀死进程时队列中的对话会丢失）。
+    逐条重试仍失败的对话记录日志并追加到WRITE_BEHIND_SPILL_PATH，下次启动时重新写入
+    """
+
+    def __init__(self, batch_size: int = WRITE_BEHIND_BATCH_SIZE, linger: float = WRITE_BEHIND_LINGER,
+                 spill_path: str = WRITE_BEHIND_SPILL_PATH):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.spill_path = spill_path
+        self.app = None
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._tokens = set()
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.replayed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def init_app(self, app):
+        """绑定Flask应用，启动后台写入线程，并重新写入上次运行时写入失败的对话"""
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+            self.replay_spilled()
+
+    def enqueue(self, user_id, user_message: str, user_embedding, ai_response: str,
+                token: str = None, timestamp: datetime = None) -> PendingConversation:
+        """
+        把一轮对话放入写入队列
+
+        Returns:
+            PendingConversation: 尚未落库的AI回复
+        """
+        turn = PendingConversation(user_id, user_message, user_embedding, ai_response, token, timestamp)
+        with self._condition:
+            self._pending[turn.user_id] = self._pending.get(turn.user_id, 0) + 1
+            self._tokens.add(turn.token)
+        self._queue.put(turn)
+        return turn
+
+    def is_queued(self, token: str) -> bool:
+        """该凭据对应的对话是否还在本进程的写入队列中"""
+        with self._condition:
+            return token in self._tokens
+
+    def _spill(self, turn: PendingConversation, error: Exception):
+        """把写入失败的一轮对话追加到溢出文件，供下次启动时重放"""
+        record = {
+            'user_id': turn.user_id,
+            'user_message': turn.user_message,
+            'user_embedding': None if turn.user_embedding is None else np.asarray(turn.user_embedding).tolist(),
+            'ai_response': str(turn.content),
+            'timestamp': turn.timestamp.isoformat(),
+            'token': turn.token,
+            'error': str(error)
+        }
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+                with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                    spill_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    spill_file.flush()
+                    os.fsync(spill_file.fileno())
+        except OSError as e:
+            print(f"写入溢出文件失败，对话已丢失（用户{turn.user_id}，凭据{turn.token}）: {str(e)}")
+
+    def replay_spilled(self, timeout: float = WRITE_BEHIND_SHUTDOWN_TIMEOUT) -> int:
+        """
+        认领溢出文件并把其中的对话重新放入写入队列
+        用os.rename认领，多个worker同时启动时只有一个会拿到文件；写完后删除，仍然失败的对话会重新溢出
+
+        Returns:
+            int: 重新入队的对话轮数
+        """
+        from models import Conversation
+
+        claimed = f'{self.spill_path}.{os.getpid()}.replay'
+        try:
+            os.rename(self.spill_path, claimed)
+        except FileNotFoundError:
+            return 0
+        records = []
+        with open(claimed, encoding='utf-8') as spill_file:
+            for line in spill_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"跳过无法解析的溢出记录: {line.strip()[:200]}")
+        # 上次的写入可能其实已经成功（例如提交后才报错），跳过已经落库的对话
+        tokens = [record['token'] for record in records]
+        written = set()
+        if tokens:
+            with self.app.app_context():
+                rows = Conversation.query.with_entities(Conversation.client_token).filter(
+                    Conversation.client_token.in_(tokens)
+                ).all()
+                written = {row.client_token for row in rows}
+        for record in records:
+            if record['token'] in written:
+                continue
+            embedding = record['user_embedding']
+            self.enqueue(record['user_id'], record['user_message'],
+                         None if embedding is None else np.asarray(embedding, dtype=np.float32),
+                         record['ai_response'], record['token'], datetime.fromisoformat(record['timestamp']))
+            self.replayed += 1
+        if self.flush(timeout):
+            os.remove(claimed)
+        print(f"已重放写入失败的对话: {self.replayed}")
+        return self.replayed
+
+    def wait_for_user(self, user_id, timeout: float = WRITE_BEHIND_READ_TIMEOUT) -> bool:
+        """
+        等待该用户已入队的对话全部落库（读己之写）
+
+        Returns:
+            bool: 是否已全部写入（超时返回False）
+        """
+        user_id = int(user_id)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending.get(user_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def flush(self, timeout: float = WRITE_BEHIND_SHUTDOWN_TIMEOUT) -> bool:
+        """等待队列中所有对话落库"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: float = WRITE_BEHIND_SHUTDOWN_TIMEOUT):
+        """写完队列中的对话后停止后台线程"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def _next_batch(self) -> Optional[List[Any]]:
+        """阻塞取出第一轮对话，再在linger时间内尽量凑满一批；收到停止信号时返回剩余内容或None"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # 停止前先把这一批写完
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            with self.app.app_context():
+                self._write(batch)
+
+    def _write(self, batch: List[PendingConversation]):
+        """在一个事务中写入一批对话；失败时逐条重试，单条仍失败则记录错误"""
+        from models import db
+
+        try:
+            self._add_all(batch)
+            db.session.commit()
+            self.batches += 1
+        except Exception as e:
+            db.session.rollback()
+            print(f"批量写入对话失败，逐条重试: {str(e)}")
+            time.sleep(_RETRY_DELAY)
+            for turn in batch:
+                try:
+                    self._add_all([turn])
+                    db.session.commit()
+                except Exception as single_error:
+                    db.session.rollback()
+                    turn.id = None
+                    turn.error = single_error
+                    self.failed += 1
+                    print(f"写入对话失败，已记录到{self.spill_path}（用户{turn.user_id}，凭据{turn.token}）: "
+                          f"{str(single_error)}")
+                    self._spill(turn, single_error)
+        self._finish(batch)
+
+    def _add_all(self, batch: List[PendingConversation]):
+        from models import db, Conversation
+
+        for turn in batch:
+            user_conversation = Conversation(
+                user_id=turn.user_id,
+                content=turn.user_message,
+                role='user',
+                embedding=turn.user_embedding,
+                timestamp=turn.timestamp
+            )
+            ai_conversation = Conversation(
+                user_id=turn.user_id,
+                content=turn.content,
+                role='ai',
+                reply_to=user_conversation,
+                timestamp=turn.timestamp,
+                client_token=turn.token
+            )
+            db.session.add(user_conversation)
+            db.session.add(ai_conversation)
+            turn._conversation = ai_conversation
+        db.session.flush()
+        for turn in batch:
+            turn.id = turn._conversation.id
+
+    def _finish(self, batch: List[PendingConversation]):
+        from .vector_index import refresh_user_index
+
+        # 把新消息增量追加到本进程的向量索引
+        for user_id in {turn.user_id for turn in batch}:
+            try:
+                refresh_user_index(user_id)
+            except Exception as e:
+                print(f"刷新向量索引失败（用户{user_id}）: {str(e)}")
+        with self._condition:
+            for turn in batch:
+                if turn.error is None:
+                    self.written += 1
+                self._tokens.discard(turn.token)
+                remaining = self._pending.get(turn.user_id, 0) - 1
+                if remaining > 0:
+                    self._pending[turn.user_id] = remaining
+                else:
+                    self._pending.pop(turn.user_id, None)
+                turn._written.set()
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """队列长度和写入统计"""
+        with self._condition:
+            return {
+                'enabled': self.running,
+                'queued': sum(self._pending.values()),
+                'batches': self.batches,
+                'written': self.written,
+                'failed': self.failed,
+                'replayed': self.replayed
+            }
+
+
+# 全局实例（每个worker进程一个）
+write_behind = WriteBehindWriter()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+近似最近邻（IVF）索引测试脚本：与精确扫描对比recall@k
+"""
+
+import sys
+import os
+import threading
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services import vector_index, ann_index
+from services.vector_index import UserVectorIndex, create_vector_index
+from services.ann_index import IVFVectorIndex
+
+
+def make_clustered_data(rng, count, dim=384, clusters=100):
+    """生成带聚类结构的向量（真实对话的向量同样按话题聚集）"""
+    centers = rng.normal(size=(clusters, dim))
+    data = centers[rng.integers(0, clusters, count)] + rng.normal(size=(count, dim)) * 0.8
+    queries = centers[rng.integers(0, clusters, 50)] + rng.normal(size=(50, dim)) * 0.8
+    return data.astype(np.float32), queries
+
+
+def recall_at_k(exact, approximate, queries, k, **kwargs):
+    """计算近似索引相对精确扫描的平均recall@k"""
+    recalls = []
+    for query in queries:
+        expected = {i for i, _ in exact.search(query, k)}
+        actual = {i for i, _ in approximate.search(query, k, **kwargs)}
+        recalls.append(len(expected & actual) / k)
+    return float(np.mean(recalls))
+
+
+def test_recall_against_exact_scan():
+    """默认nprobe下recall@10不低于0.95，探测全部聚类时与精确扫描一致"""
+    rng = np.random.default_rng(7)
+    data, queries = make_clustered_data(rng, 30000)
+
+    exact = UserVectorIndex()
+    exact.add_many(range(1, len(data) + 1), data)
+    ivf = IVFVectorIndex(min_size=5000)
+    ivf.add_many(range(1, len(data) + 1), data)
+    assert ivf.wait_for_training(60) and ivf.trained
+
+    start = time.perf_counter()
+    recall = recall_at_k(exact, ivf, queries, 10)
+    elapsed = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"nprobe={ivf.nprobe}, nlist={len(ivf._lists)}: recall@10={recall:.3f} ({elapsed:.2f} ms/查询，含精确扫描)")
+    assert recall >= 0.95
+
+    full_recall = recall_at_k(exact, ivf, queries, 10, nprobe=len(ivf._lists))
+    assert full_recall == 1.0
+
+    # 召回率随nprobe单调不减
+    recalls = [recall_at_k(exact, ivf, queries, 10, nprobe=n) for n in (1, 4, 16)]
+    print(f"nprobe=1/4/16: recall@10={recalls}")
+    assert recalls == sorted(recalls)
+
+
+def test_fallback_and_incremental_insert():
+    """规模不足时使用精确扫描；训练后增量插入的向量可以被查到"""
+    rng = np.random.default_rng(11)
+    data, queries = make_clustered_data(rng, 6000)
+
+    ivf = IVFVectorIndex(min_size=5000)
+    exact = UserVectorIndex()
+    ivf.add_many(range(1, 4001), data[:4000])
+    exact.add_many(range(1, 4001), data[:4000])
+    assert not ivf.trained
+    for query in queries[:10]:
+        assert ivf.search(query, 5) == exact.search(query, 5)
+
+    ivf.add_many(range(4001, 5001), data[4000:5000])
+    assert ivf.wait_for_training(60) and ivf.trained
+    for i in range(5001, 6001):
+        ivf.add(i, data[i - 1])
+    assert len(ivf) == 6000
+    # 训练之后逐条插入的向量自己查自己应排在第一
+    for i in (5001, 5500, 6000):
+        assert ivf.search(data[i - 1], 1)[0][0] == i
+
+
+def test_training_does_not_block():
+    """训练在后台进行：追加和查询不等待训练，训练前用精确扫描，训练期间追加的向量在替换后仍可查到"""
+    rng = np.random.default_rng(3)
+    data, queries = make_clustered_data(rng, 3000)
+    release = threading.Event()
+    original_train = ann_index.train_centroids
+
+    def slow_train(*args, **kwargs):
+        release.wait(10)
+        return original_train(*args, **kwargs)
+
+    ann_index.train_centroids = slow_train
+    try:
+        ivf = IVFVectorIndex(min_size=2000)
+        exact = UserVectorIndex()
+        start = time.perf_counter()
+        ivf.add_many(range(1, 2001), data[:2000])
+        exact.add_many(range(1, 2001), data[:2000])
+        for i in range(2001, 3001):
+            ivf.add(i, data[i - 1])
+            exact.add(i, data[i - 1])
+        assert ivf.search(queries[0], 5) == exact.search(queries[0], 5)
+        assert time.perf_counter() - start < 5
+        assert not ivf.trained
+
+        release.set()
+        assert ivf.wait_for_training(60) and ivf.trained
+        assert sum(len(positions) for positions in ivf._lists) == 3000
+        assert ivf.search(data[2999], 1)[0][0] == 3000
+    finally:
+        release.set()
+        ann_index.train_centroids = original_train
+
+
+def test_registry_backend_setting():
+    """VECTOR_INDEX_BACKEND选择注册表创建的索引类型"""
+    original_backend = vector_index.VECTOR_INDEX_BACKEND
+    try:
+        vector_index.VECTOR_INDEX_BACKEND = 'ivf'
+        assert isinstance(create_vector_index(), IVFVectorIndex)
+        vector_index.VECTOR_INDEX_BACKEND = 'exact'
+        assert type(create_vector_index()) is UserVectorIndex
+    finally:
+        vector_index.VECTOR_INDEX_BACKEND = original_backend
+
+
+if __name__ == '__main__':
+    test_recall_against_exact_scan()
+    test_fallback_and_incremental_insert()
+    test_training_does_not_block()
+    test_registry_backend_setting()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+方舟API客户端测试脚本：使用本地模拟的HTTP服务
+"""
+
+import sys
+import os
+import json
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.ark_client import ArkClient
+
+
+class StubArkHandler(BaseHTTPRequestHandler):
+    """按预设的状态码序列依次响应，并记录客户端使用的连接"""
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive
+    statuses = []
+    client_ports = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        StubArkHandler.client_ports.append(self.client_address[1])
+        status = StubArkHandler.statuses.pop(0) if StubArkHandler.statuses else 200
+        body = json.dumps({"choices": [{"message": {"content": "好的"}}]}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubArkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v3/chat/completions"
+
+
+def test_keep_alive_connection_reused():
+    """多次请求复用同一条keep-alive连接"""
+    server, endpoint = start_stub_server()
+    StubArkHandler.statuses = []
+    StubArkHandler.client_ports = []
+    try:
+        client = ArkClient(pool_size=2)
+        for _ in range(5):
+            response = client.post_chat_completion(endpoint, 'test-key', {"messages": []})
+            assert response.status_code == 200
+        print(f"客户端连接端口: {StubArkHandler.client_ports}")
+        assert len(set(StubArkHandler.client_ports)) == 1
+    finally:
+        server.shutdown()
+
+
+def test_retry_on_429_and_5xx():
+    """429/5xx会带退避重试，超过次数后返回最后一次响应"""
+    server, endpoint = start_stub_server()
+    try:
+        client = ArkClient(max_retries=2, backoff_base=0.01, backoff_max=0.05)
+
+        StubArkHandler.statuses = [429, 503]
+        StubArkHandler.client_ports = []
+        response = client.post_chat_completion(endpoint, 'test-key', {"messages": []})
+        assert response.status_code == 200
+        assert len(StubArkHandler.client_ports) == 3
+
+        StubArkHandler.statuses = [500, 502, 504, 200]
+        StubArkHandler.client_ports = []
+        response = client.post_chat_completion(endpoint, 'test-key', {"messages": []})
+        assert response.status_code == 504
+        assert len(StubArkHandler.client_ports) == 3
+
+        # 4xx（429除外）不重试
+        StubArkHandler.statuses = [400]
+        StubArkHandler.client_ports = []
+        response = client.post_chat_completion(endpoint, 'test-key', {"messages": []})
+        assert response.status_code == 400
+        assert len(StubArkHandler.client_ports) == 1
+    finally:
+        StubArkHandler.statuses = []
+        server.shutdown()
+
+
+def test_connection_error_retried_then_raised():
+    """连接失败重试用尽后抛出异常"""
+    client = ArkClient(max_retries=1, connect_timeout=0.5, backoff_base=0.01)
+    try:
+        client.post_chat_completion("http://127.0.0.1:9/api/v3/chat/completions", 'test-key', {})
+        assert False, "应当抛出连接错误"
+    except requests.exceptions.ConnectionError:
+        pass
+
+
+def test_backoff_delay_bounds():
+    """退避时间带抖动且不超过上限，并遵循Retry-After"""
+    client = ArkClient(backoff_base=0.5, backoff_max=2)
+    for attempt in range(6):
+        delay = client.backoff_delay(attempt)
+        assert 0 <= delay <= min(2, 0.5 * 2 ** attempt)
+    assert client.backoff_delay(0, '1.5') == 1.5
+    assert client.backoff_delay(0, '30') == 2
+
+
+if __name__ == '__main__':
+    test_keep_alive_connection_reused()
+    test_retry_on_429_and_5xx()
+    test_connection_error_retried_then_raised()
+    test_backoff_delay_bounds()
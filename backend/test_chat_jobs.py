@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+异步对话任务测试脚本：202立即返回、任意worker可轮询结果、按用户隔离、排队上限、幂等键冲突和丢失的任务
+"""
+
+import sys
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时的SQLite文件，避免影响instance/app.db（需在导入app之前设置）；
+# 后台任务线程需要自己的数据库连接，不能用所有会话共用一个连接的内存数据库
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+from app import app, db
+from models import User, Conversation, ChatJob
+from services.chat_jobs import (
+    ChatJobManager, JobQueueFull, JobConflict, job_to_dict, CHAT_JOB_TIMEOUT, DONE, LOST, RUNNING
+)
+
+
+def create_user(email):
+    """新建测试用户，返回其ID"""
+    User.query.filter_by(email=email).delete()
+    user = User(email=email, password_hash=generate_password_hash('pw'))
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def new_manager(**kwargs):
+    """绑定到测试应用的任务队列，每个实例模拟一个worker进程"""
+    manager = ChatJobManager(**kwargs)
+    manager.init_app(app)
+    return manager
+
+
+def test_job_manager():
+    """任务在后台执行，另一个worker能读到结果；排队已满时拒绝，相同幂等键返回同一个任务"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('chat-jobs-manager@example.com')
+        worker_a, worker_b = new_manager(workers=1, max_pending=1), new_manager()
+        release = threading.Event()
+        try:
+            job, is_new = worker_a.submit(user_id, lambda: release.wait() and ({'ok': True}, 201, {}), 'key', 'a')
+            assert is_new
+            job_id = job.id
+            duplicate, is_new = worker_b.submit(user_id, lambda: None, 'key', 'a')
+            assert duplicate.id == job_id and not is_new
+            try:
+                worker_b.submit(user_id, lambda: None, 'key', 'b')
+                assert False, "内容不同的提交应冲突"
+            except JobConflict:
+                pass
+            try:
+                worker_a.submit(user_id, lambda: ({}, 201, {}))
+                assert False, "排队已满时应拒绝"
+            except JobQueueFull:
+                pass
+            assert worker_b.get(user_id + 1, job_id) is None
+
+            release.set()
+            # worker_b上没有该任务的完成通知，轮询数据库等待
+            worker_b.wait(job_id, 5)
+            assert job_to_dict(worker_b.get(user_id, job_id)) == {
+                'job_id': job_id, 'status': DONE, 'result_status': 201, 'result': {'ok': True}
+            }
+
+            failed, _ = worker_a.submit(user_id, lambda: 1 / 0)
+            worker_a.wait(failed.id, 5)
+            assert worker_a.get(user_id, failed.id).result_status == 500
+            assert worker_a.stats()['pending'] == 0
+        finally:
+            ChatJob.query.delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+def test_lost_job():
+    """执行它的worker退出后任务报告为lost，用同一个幂等键重新提交会创建新任务"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('chat-jobs-lost@example.com')
+        manager = new_manager()
+        try:
+            db.session.add(ChatJob(id='lost-job', user_id=user_id, status=RUNNING, idempotency_key='key',
+                                   fingerprint='a', created_at=datetime.utcnow() - timedelta(seconds=CHAT_JOB_TIMEOUT + 1)))
+            db.session.commit()
+            assert job_to_dict(manager.get(user_id, 'lost-job'))['status'] == LOST
+            # 丢失的任务不再等待
+            start = time.monotonic()
+            manager.wait('lost-job', 5)
+            assert time.monotonic() - start < 1
+
+            job, is_new = manager.submit(user_id, lambda: ({'ok': True}, 201, {}), 'key', 'a')
+            assert is_new and job.id != 'lost-job'
+            manager.wait(job.id, 5)
+            assert manager.get(user_id, job.id).status == DONE
+        finally:
+            ChatJob.query.delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+def test_async_submission():
+    """Prefer: respond-async时立即返回202，轮询拿到与同步接口相同的结果"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('chat-jobs@example.com')
+        token = create_access_token(identity=str(user_id))
+        other_token = create_access_token(identity=str(user_id + 100000))
+
+    def slow_llm_response(*args, **kwargs):
+        time.sleep(0.3)
+        return "好的，我们继续。"
+
+    original_llm_response = app_module.get_llm_response
+    original_max_wait = app_module.CHAT_JOB_MAX_WAIT
+    app_module.get_llm_response = slow_llm_response
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}', 'Prefer': 'respond-async', 'Idempotency-Key': 'job-1'}
+    try:
+        start = time.monotonic()
+        response = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert time.monotonic() - start < 0.3
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert response.headers['Location'] == f'/api/jobs/{job_id}'
+        conflict = client.post('/api/conversations', json={'message': '别的问题'}, headers=headers)
+        assert conflict.status_code == 409
+
+        auth = {'Authorization': f'Bearer {token}'}
+        # sync worker下不支持长轮询：wait被截断为0，立即返回并提示轮询间隔
+        app_module.CHAT_JOB_MAX_WAIT = 0
+        start = time.monotonic()
+        pending = client.get(f'/api/jobs/{job_id}?wait=5', headers=auth)
+        assert time.monotonic() - start < 0.3
+        assert pending.get_json()['status'] in ('pending', 'running') and pending.headers['Retry-After'] == '1'
+        assert client.get(f'/api/jobs/{job_id}',
+                          headers={'Authorization': f'Bearer {other_token}'}).status_code == 404
+
+        app_module.CHAT_JOB_MAX_WAIT = 5
+        done = client.get(f'/api/jobs/{job_id}?wait=5', headers=auth)
+        data = done.get_json()
+        assert data['status'] == 'done' and data['result_status'] == 201 and 'Retry-After' not in done.headers
+        assert data['result']['content'] == "好的，我们继续。"
+        with app.app_context():
+            assert Conversation.query.filter_by(user_id=user_id).count() == 2
+        assert client.get(f'/api/jobs/{job_id}?wait=abc', headers=auth).status_code == 400
+        print("异步任务结果:", data)
+    finally:
+        app_module.get_llm_response = original_llm_response
+        app_module.CHAT_JOB_MAX_WAIT = original_max_wait
+        with app.app_context():
+            ChatJob.query.delete()
+            Conversation.query.filter_by(user_id=user_id).delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    test_job_manager()
+    test_lost_job()
+    test_async_submission()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+熔断器测试脚本：连续失败后断开、冷却期内快速失败、半开探测后恢复或重新断开
+"""
+
+import sys
+import os
+import time
+import requests
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services import ai_service
+from services.circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+
+
+class StatusResponse:
+    """只带状态码的模拟响应"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+    def json(self):
+        return {"choices": [{"message": {"content": "好的"}}]}
+
+
+class StreamResponse:
+    """模拟豆包API的流式响应：逐行产出SSE数据，可在中途抛出异常"""
+
+    status_code = 200
+    text = ''
+
+    def __init__(self, lines, error=None):
+        self.lines = lines
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_lines(self):
+        for line in self.lines:
+            yield line.encode('utf-8')
+        if self.error is not None:
+            raise self.error
+
+
+DELTA_LINE = 'data: {"choices": [{"delta": {"content": "好的"}}]}'
+
+
+def failing_call(*args, **kwargs):
+    raise requests.exceptions.ReadTimeout("模拟超时")
+
+
+def test_trips_and_recovers():
+    """连续失败达到阈值后断开，冷却后半开探测成功则恢复"""
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=0.05, probes=1)
+    breaker.call(lambda: StatusResponse(500))
+    breaker.call(lambda: StatusResponse(200))
+    assert breaker.consecutive_failures == 0
+
+    for _ in range(2):
+        breaker.call(lambda: StatusResponse(503))
+    try:
+        breaker.call(failing_call)
+    except requests.exceptions.ReadTimeout:
+        pass
+    assert breaker.state == OPEN
+
+    calls = []
+    try:
+        breaker.call(lambda: calls.append(1))
+        assert False, "断开时应直接失败"
+    except CircuitOpen as e:
+        assert 0 < e.retry_after <= 0.05
+    assert calls == []
+
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    probe = breaker.before_call()
+    assert probe
+    # 探测进行中时其他请求仍被拒绝
+    try:
+        breaker.before_call()
+        assert False, "探测名额已满时应直接失败"
+    except CircuitOpen:
+        pass
+    breaker.record_success(probe)
+    assert breaker.state == CLOSED
+    stats = breaker.stats()
+    assert stats['times_opened'] == 1 and stats['rejected'] == 2
+    print("熔断器统计:", stats)
+
+
+def test_failed_probe_reopens():
+    """半开状态下探测失败立即重新断开"""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    breaker.call(lambda: StatusResponse(502))
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    breaker.call(lambda: StatusResponse(429))
+    assert breaker.state == OPEN and breaker.stats()['times_opened'] == 2
+
+
+def test_unrelated_error_releases_probe():
+    """与上游无关的异常只归还探测名额，不改变状态"""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.call(lambda: StatusResponse(500))
+
+    def broken():
+        raise ValueError("本地错误")
+
+    try:
+        breaker.call(broken)
+    except ValueError:
+        pass
+    assert breaker.state == HALF_OPEN
+    breaker.call(lambda: StatusResponse(200))
+    assert breaker.state == CLOSED
+
+
+def test_llm_response_fails_fast_when_open():
+    """熔断时get_llm_response不再调用上游，立即返回失败提示"""
+    original_breaker = ai_service.llm_breaker
+    original_post = ai_service.ark_client.post_chat_completion
+    calls = []
+    ai_service.llm_breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: calls.append(1) or StatusResponse(503)
+    try:
+        assert ai_service.get_llm_response("你好") == "抱歉，AI服务暂时不可用，请稍后再试。"
+        start = time.monotonic()
+        assert ai_service.get_llm_response("你好") == "抱歉，AI服务暂时不可用，请稍后再试。"
+        assert list(ai_service.stream_llm_response("你好")) == ["抱歉，AI服务暂时不可用，请稍后再试。"]
+        assert time.monotonic() - start < 1
+        assert calls == [1]
+    finally:
+        ai_service.llm_breaker = original_breaker
+        ai_service.ark_client.post_chat_completion = original_post
+
+
+def interrupted_deltas():
+    """读取一次流式回复，确认它以StreamInterrupted结束，返回中断前产出的内容"""
+    deltas = []
+    try:
+        for delta in ai_service.stream_llm_response("你好"):
+            deltas.append(delta)
+    except ai_service.StreamInterrupted:
+        return deltas
+    raise AssertionError("应抛出StreamInterrupted")
+
+
+def test_stream_failure_after_headers_counts():
+    """流式响应返回200后正文中途断开计为失败；读完才计为成功；客户端提前断开不计入"""
+    original_breaker = ai_service.llm_breaker
+    original_post = ai_service.ark_client.post_chat_completion
+    breaker = ai_service.llm_breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+    try:
+        ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: StreamResponse(
+            [DELTA_LINE], requests.exceptions.ChunkedEncodingError("连接中断"))
+        # 已产出部分内容后出错抛出StreamInterrupted，熔断器记录一次失败
+        assert interrupted_deltas() == ["好的"]
+        assert breaker.consecutive_failures == 1
+        assert interrupted_deltas() == ["好的"]
+        assert breaker.state == OPEN
+        assert list(ai_service.stream_llm_response("你好")) == ["抱歉，AI服务暂时不可用，请稍后再试。"]
+
+        breaker = ai_service.llm_breaker = CircuitBreaker(failure_threshold=2, cooldown=0)
+        breaker.record_failure()
+        ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: StreamResponse(
+            [DELTA_LINE, 'data: [DONE]'])
+        # 客户端读到第一段就断开：不计成功也不计失败
+        stream = ai_service.stream_llm_response("你好")
+        assert next(stream) == "好的"
+        stream.close()
+        assert breaker.consecutive_failures == 1
+        assert list(ai_service.stream_llm_response("你好")) == ["好的"]
+        assert breaker.consecutive_failures == 0 and breaker.state == CLOSED
+    finally:
+        ai_service.llm_breaker = original_breaker
+        ai_service.ark_client.post_chat_completion = original_post
+
+
+if __name__ == '__main__':
+    test_trips_and_recovers()
+    test_failed_probe_reopens()
+    test_unrelated_error_releases_probe()
+    test_llm_response_fails_fast_when_open()
+    test_stream_failure_after_headers_counts()
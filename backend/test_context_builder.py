@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+上下文打包测试脚本：token估算、预算内舍弃低排名记忆、可替换的分词器
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services import context_builder
+from services.context_builder import estimate_tokens, assemble_context, set_tokenizer, TOKENS_PER_MESSAGE
+
+
+def make_memory(content, similarity, ai_response=None):
+    return {'user_message': content, 'ai_response': ai_response, 'timestamp': '', 'similarity': similarity}
+
+
+def test_estimate_tokens():
+    """中文每个字计一个token，其余文字每4个字符计一个token"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("我喜欢篮球") == 5
+    assert estimate_tokens("hello world!") == 3
+    assert estimate_tokens("学习Python") == 2 + 2
+
+
+def test_drops_lowest_ranked_memories():
+    """预算不足时从排名最低的记忆开始舍弃，低相似度的记忆不进入上下文"""
+    memories = [
+        make_memory("我在学习Python编程", 0.9, "很好，继续加油" * 20),
+        make_memory("我周末喜欢打篮球", 0.8),
+        make_memory("今天天气很好", 0.1)
+    ]
+    messages, report = assemble_context("系统提示", memories, "我该怎么学编程？", budget=10000)
+    assert len(messages) == 3
+    assert report['memories_used'] == 2 and report['memories_dropped'] == 0
+    assert "继续加油" * 20 not in messages[1]['content']
+    assert report['total'] == sum(estimate_tokens(m['content']) + TOKENS_PER_MESSAGE for m in messages)
+
+    budget = report['total'] - 1
+    messages, report = assemble_context("系统提示", memories, "我该怎么学编程？", budget=budget)
+    assert report['memories_used'] == 1 and report['memories_dropped'] == 1
+    assert "Python" in messages[1]['content'] and "篮球" not in messages[1]['content']
+    assert report['total'] <= budget
+
+    messages, report = assemble_context("系统提示", memories, "我该怎么学编程？", budget=20)
+    assert [m['role'] for m in messages] == ['system', 'user']
+    assert report['memory'] == 0 and report['memories_dropped'] == 2
+    print("上下文token统计:", report)
+
+
+def test_pluggable_tokenizer():
+    """替换分词器后按新的计数函数打包"""
+    try:
+        set_tokenizer(len)
+        assert context_builder.count_tokens("abcd") == 4
+        _, report = assemble_context("ab", [], "cd", budget=100)
+        assert report['system'] == 2 + TOKENS_PER_MESSAGE
+    finally:
+        set_tokenizer(None)
+    assert context_builder.count_tokens("abcd") == 1
+
+
+if __name__ == '__main__':
+    test_estimate_tokens()
+    test_drops_lowest_ranked_memories()
+    test_pluggable_tokenizer()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+数据库性能配置测试脚本：WAL等连接参数、连接池参数，以及读写互不阻塞
+"""
+
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+
+from services.db_profile import engine_options, SQLITE_BUSY_TIMEOUT_MS, DB_POOL_SIZE
+
+
+def test_engine_options():
+    """文件数据库使用固定大小的连接池，内存数据库和default配置不改动"""
+    options = engine_options('sqlite:///app.db', 'performance')
+    assert options['pool_size'] == DB_POOL_SIZE
+    assert options['connect_args'] == {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    assert engine_options('sqlite://', 'performance') == {}
+    assert engine_options('sqlite:///app.db', 'default') == {}
+    assert engine_options('postgresql://localhost/evolveme', 'performance')['pool_pre_ping'] is True
+
+
+def test_wal_reads_do_not_block_writes():
+    """连接开启WAL；读事务进行中时写事务可以立即提交，读事务仍读到自己的快照"""
+    path = os.path.join(tempfile.mkdtemp(), 'profile.db')
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **engine_options(uri, 'performance'))
+    try:
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == SQLITE_BUSY_TIMEOUT_MS
+            conn.execute(text('CREATE TABLE conversation (id INTEGER PRIMARY KEY, content TEXT)'))
+            conn.execute(text("INSERT INTO conversation (content) VALUES ('你好')"))
+            conn.commit()
+
+        # 读事务持有快照期间（回滚日志模式下会让写事务等到busy_timeout后失败）
+        reader = engine.raw_connection()
+        try:
+            cursor = reader.cursor()
+            cursor.execute('BEGIN')
+            assert cursor.execute('SELECT COUNT(*) FROM conversation').fetchone()[0] == 1
+
+            start = time.monotonic()
+            with engine.connect() as writer:
+                writer.execute(text("INSERT INTO conversation (content) VALUES ('好的')"))
+                writer.commit()
+            assert time.monotonic() - start < 1
+
+            assert cursor.execute('SELECT COUNT(*) FROM conversation').fetchone()[0] == 1
+            reader.rollback()
+            assert cursor.execute('SELECT COUNT(*) FROM conversation').fetchone()[0] == 2
+        finally:
+            reader.close()
+        print("连接池状态:", engine.pool.status())
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    test_engine_options()
+    test_wal_reads_do_not_block_writes()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+批量向量化接口测试脚本
+"""
+
+import sys
+import os
+import time
+import random
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.embedding_service import get_text_embedding, get_text_embeddings
+
+
+def make_texts(count):
+    """生成中英文混合的测试文本"""
+    rng = random.Random(0)
+    alphabet = "abcdefg hijk，。我你他学习编程 123!?.\n\t"
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60))) for _ in range(count)]
+
+
+def test_encode_batch_matches_encode():
+    """批量结果应与逐条编码一致"""
+    texts = [
+        "我喜欢编程", "Hello World!  foo\tbar", "", "   ", "A" * 2000,
+        "İstanbul ÇAĞ", "x　y z", "emoji 😀 test, ok?"
+    ] + make_texts(500)
+    batch = get_text_embeddings(texts)
+    assert batch.shape == (len(texts), 384)
+    assert batch.dtype == np.float32
+
+    expected = np.array([get_text_embedding(text) for text in texts])
+    assert np.allclose(batch, expected, atol=1e-6)
+    assert get_text_embeddings([]).shape == (0, 384)
+    print("批量编码结果与逐条编码一致")
+
+
+def test_encode_batch_throughput():
+    """批量编码的吞吐量至少是逐条调用的10倍"""
+    texts = make_texts(5000)
+
+    start = time.perf_counter()
+    for text in texts:
+        get_text_embedding(text)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_text_embeddings(texts)
+    batch_seconds = time.perf_counter() - start
+
+    speedup = loop_seconds / batch_seconds
+    print(f"逐条: {loop_seconds:.3f}s, 批量: {batch_seconds:.3f}s, 加速比: {speedup:.1f}x")
+    assert speedup >= 10
+
+
+if __name__ == '__main__':
+    test_encode_batch_matches_encode()
+    test_encode_batch_throughput()
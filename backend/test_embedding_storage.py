@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+二进制向量存储测试脚本
+"""
+
+import sys
+import os
+import json
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import event
+
+import models
+from models import db, User, Conversation
+from services.embedding_service import get_text_embedding
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def test_binary_round_trip():
+    """float32二进制格式应能零拷贝读回，大小为384*4字节"""
+    embedding = get_text_embedding("我喜欢编程")
+    conversation = Conversation(user_id=1, content="我喜欢编程", role='user', embedding=embedding)
+
+    assert len(conversation.embedding_blob) == 384 * 4
+    assert conversation.embedding_json is None
+    restored = conversation.embedding
+    assert restored.dtype == np.float32
+    assert np.allclose(restored, embedding, atol=1e-6)
+    print(f"二进制向量大小: {len(conversation.embedding_blob)} 字节")
+
+
+def test_storage_format_setting():
+    """迁移期间按设置读取JSON格式，未迁移的记录回退到JSON"""
+    embedding = get_text_embedding("我在学习Python")
+    legacy = Conversation(user_id=1, content="我在学习Python", role='user')
+    legacy.embedding_json = json.dumps(embedding)
+    assert np.allclose(legacy.embedding, embedding, atol=1e-6)
+
+    original_format = models.EMBEDDING_STORAGE_FORMAT
+    models.EMBEDDING_STORAGE_FORMAT = 'json'
+    try:
+        conversation = Conversation(user_id=1, content="我在学习Python", role='user', embedding=embedding)
+        # JSON阶段双写两种格式
+        assert conversation.embedding_json is not None
+        assert conversation.embedding_blob is not None
+        assert conversation.embedding.dtype == np.float64
+        assert np.allclose(conversation.embedding, embedding)
+    finally:
+        models.EMBEDDING_STORAGE_FORMAT = original_format
+    print("存储格式设置生效")
+
+
+def test_history_reads_skip_embeddings():
+    """普通查询不读取向量列，访问embedding时再按需加载"""
+    with app.app_context():
+        db.create_all()
+        user = User(email='deferred@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        embedding = get_text_embedding("我喜欢编程")
+        db.session.add(Conversation(user_id=user.id, content="我喜欢编程", role='user', embedding=embedding))
+        db.session.commit()
+        user_id = user.id
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            conversation = Conversation.query.filter_by(user_id=user_id).first()
+            assert 'embedding' not in statements[-1]
+            assert np.allclose(conversation.embedding, embedding, atol=1e-6)
+            assert 'embedding_blob' in statements[-1]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+            db.drop_all()
+    print("历史查询不再加载向量列")
+
+
+if __name__ == '__main__':
+    test_binary_round_trip()
+    test_storage_format_setting()
+    test_history_reads_skip_embeddings()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn配置冒烟测试：gevent模式下放大连接池和大模型并发名额、允许长轮询，显式设置的环境变量不被覆盖；
+未安装gevent时回退为sync worker
+"""
+
+import sys
+import os
+import subprocess
+import json
+import tempfile
+
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = (
+    "import json, os, runpy; "
+    "config = runpy.run_path('gunicorn_config.py'); "
+    "print(json.dumps({'worker_class': config['worker_class'], "
+    "'env': {k: os.environ.get(k) for k in "
+    "('ARK_POOL_SIZE', 'LLM_MAX_CONCURRENCY', 'LLM_MAX_QUEUE', 'CHAT_JOB_MAX_WAIT')}}))"
+)
+
+
+def load_config(gevent_installed=False, **env):
+    """
+    在子进程中加载gunicorn_config.py，返回worker类型和加载后的相关环境变量
+    gevent_installed为True时在子进程的PYTHONPATH中放一个空的gevent包（配置只检查能否找到该模块），
+    为False时让子进程找不到gevent
+    """
+    base = {k: v for k, v in os.environ.items()
+            if k not in ('GUNICORN_WORKER_CLASS', 'ARK_POOL_SIZE', 'LLM_MAX_CONCURRENCY', 'LLM_MAX_QUEUE',
+                         'CHAT_JOB_MAX_WAIT', 'PYTHONPATH')}
+    if gevent_installed:
+        package_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(package_dir, 'gevent'))
+        open(os.path.join(package_dir, 'gevent', '__init__.py'), 'w').close()
+        base['PYTHONPATH'] = package_dir
+        probe = _PROBE
+    else:
+        probe = "import sys; sys.modules['gevent'] = None; " + _PROBE
+    output = subprocess.check_output([sys.executable, '-c', probe], cwd=CONFIG_DIR, env={**base, **env},
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output)
+
+
+def test_sync_defaults():
+    """sync模式不修改连接池、并发名额和长轮询时长"""
+    config = load_config()
+    assert config['worker_class'] == 'sync'
+    assert config['env'] == {'ARK_POOL_SIZE': None, 'LLM_MAX_CONCURRENCY': None, 'LLM_MAX_QUEUE': None,
+                             'CHAT_JOB_MAX_WAIT': None}
+
+
+def test_gevent_raises_limits():
+    """gevent模式下大模型并发名额与连接池一致，排队上限随之放大，并允许长轮询"""
+    config = load_config(gevent_installed=True, GUNICORN_WORKER_CLASS='gevent', LLM_MAX_QUEUE='50')
+    assert config['worker_class'] == 'gevent'
+    assert config['env'] == {'ARK_POOL_SIZE': '100', 'LLM_MAX_CONCURRENCY': '100', 'LLM_MAX_QUEUE': '50',
+                             'CHAT_JOB_MAX_WAIT': '25'}
+
+
+def test_gevent_missing_falls_back():
+    """未安装gevent时回退为sync worker，不放大并发名额"""
+    config = load_config(GUNICORN_WORKER_CLASS='gevent')
+    assert config['worker_class'] == 'sync'
+    assert config['env'] == {'ARK_POOL_SIZE': None, 'LLM_MAX_CONCURRENCY': None, 'LLM_MAX_QUEUE': None,
+                             'CHAT_JOB_MAX_WAIT': None}
+
+
+if __name__ == '__main__':
+    test_sync_defaults()
+    test_gevent_raises_limits()
+    test_gevent_missing_falls_back()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+幂等键测试脚本：跨worker共享的幂等键，并发重复提交只执行一次，完成后重放结果，不写入重复的对话，降级回复不重放
+"""
+
+import sys
+import os
+import runpy
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用内存数据库，避免影响instance/app.db（需在导入app之前设置）
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+from app import app, db
+from models import User, Conversation, IdempotencyKey
+from services.ai_service import FallbackReply
+from services import idempotency
+from services.idempotency import IdempotencyStore, IdempotencyConflict, idempotency_store, FALLBACK_HEADER
+
+
+def create_user(email):
+    """新建测试用户，返回其ID"""
+    User.query.filter_by(email=email).delete()
+    user = User(email=email, password_hash=generate_password_hash('pw'))
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def test_store_lifecycle():
+    """幂等键保存在数据库中：另一个worker的重复请求等待并读到结果，成功结果可重放，失败结果不保留"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('idempotency-store@example.com')
+        other_id = create_user('idempotency-other@example.com')
+        # 两个实例模拟两个worker进程，只通过数据库共享状态
+        worker_a, worker_b = IdempotencyStore(ttl=60), IdempotencyStore(ttl=60)
+        try:
+            entry, is_new = worker_a.begin(user_id, 'key', 'a')
+            assert is_new
+            duplicate, is_new = worker_b.begin(user_id, 'key', 'a')
+            assert not is_new and duplicate.wait(0) is None
+            try:
+                worker_b.begin(user_id, 'key', 'b')
+                assert False, "内容不同的请求应冲突"
+            except IdempotencyConflict:
+                pass
+            # 不同用户的同名键互不影响
+            assert worker_b.begin(other_id, 'key', 'b')[1]
+
+            worker_a.finish(entry, ({'id': 1}, 201, {}))
+            assert duplicate.wait(1) == ({'id': 1}, 201, {})
+            replay, is_new = worker_b.begin(user_id, 'key', 'a')
+            assert not is_new and replay.result == ({'id': 1}, 201, {})
+
+            failed, _ = worker_a.begin(user_id, 'other', 'a')
+            waiter, _ = worker_b.begin(user_id, 'other', 'a')
+            worker_a.finish(failed, ({'error': 'x'}, 500, {}))
+            # 正在等待的请求拿到失败结果，之后的重试重新执行
+            assert waiter.wait(1) == ({'error': 'x'}, 500, {})
+            assert worker_b.begin(user_id, 'other', 'a')[1] is True
+            assert worker_b.stats() == {'executed': 2, 'attached': 2, 'replayed': 1}
+        finally:
+            IdempotencyKey.query.delete()
+            User.query.filter(User.id.in_([user_id, other_id])).delete()
+            db.session.commit()
+
+
+def test_fallback_reply_not_replayed():
+    """降级回复不保留：重试会重新执行；进行中的请求超过租期后由重试接管"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('idempotency-fallback@example.com')
+        store = IdempotencyStore(ttl=60, lease=0)
+        try:
+            entry, _ = store.begin(user_id, 'key', 'a')
+            store.finish(entry, ({'id': 1}, 201, {FALLBACK_HEADER: 'true'}))
+            assert store.begin(user_id, 'key', 'a')[1] is True
+
+            # 上一个请求没有记录结果（worker已退出），租期为0时立即被接管
+            assert store.begin(user_id, 'key', 'a')[1] is True
+        finally:
+            IdempotencyKey.query.delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+def test_fallback_reply_through_endpoint():
+    """大模型不可用时的提示语带X-Fallback-Reply，同一个键重试会重新调用大模型"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('idempotency-endpoint@example.com')
+        token = create_access_token(identity=str(user_id))
+
+    replies = [FallbackReply("抱歉，AI服务暂时不可用，请稍后再试。"), "好的，我们继续。"]
+    original_llm_response = app_module.get_llm_response
+    app_module.get_llm_response = lambda *args, **kwargs: replies.pop(0)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'fallback-1'}
+    try:
+        first = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert first.status_code == 201 and first.headers[FALLBACK_HEADER] == 'true'
+        second = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert second.status_code == 201 and FALLBACK_HEADER not in second.headers
+        assert 'Idempotent-Replayed' not in second.headers
+        assert second.get_json()['content'] == "好的，我们继续。" and replies == []
+    finally:
+        app_module.get_llm_response = original_llm_response
+        with app.app_context():
+            IdempotencyKey.query.delete()
+            Conversation.query.filter_by(user_id=user_id).delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+def test_duplicate_submissions():
+    """并发的重复提交只调用一次大模型、只保存一轮对话，之后的重试直接重放"""
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('idempotency@example.com')
+        token = create_access_token(identity=str(user_id))
+
+    calls = []
+    llm_started = threading.Event()
+
+    def slow_llm_response(*args, **kwargs):
+        calls.append(args[0])
+        llm_started.set()
+        time.sleep(0.3)
+        return "好的，我们继续。"
+
+    original_llm_response = app_module.get_llm_response
+    app_module.get_llm_response = slow_llm_response
+    idempotency_store.clear()
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'retry-1'}
+    responses = []
+
+    def submit():
+        responses.append(client.post('/api/conversations', json={'message': '你好'}, headers=headers))
+
+    try:
+        # 内存数据库的所有会话共用一个连接，这里让重复请求依次在首个请求调用大模型期间登记，
+        # 避免它们的事务在同一个连接上交错（多个worker各自持有连接的情形见test_store_lifecycle）
+        threads = [threading.Thread(target=submit) for _ in range(3)]
+        threads[0].start()
+        assert llm_started.wait(5)
+        for attached, thread in enumerate(threads[1:], start=1):
+            thread.start()
+            while idempotency_store.stats()['attached'] < attached:
+                time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+        assert calls == ['你好']
+        assert [r.status_code for r in responses] == [201, 201, 201]
+        assert len({r.get_json()['id'] for r in responses}) == 1
+        assert sum(r.headers.get('Idempotent-Replayed') == 'true' for r in responses) == 2
+
+        replay = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert replay.status_code == 201 and replay.headers['Idempotent-Replayed'] == 'true'
+        conflict = client.post('/api/conversations', json={'message': '别的问题'}, headers=headers)
+        assert conflict.status_code == 422
+        assert calls == ['你好']
+
+        with app.app_context():
+            assert Conversation.query.filter_by(user_id=user_id).count() == 2
+        print("重复提交已合并:", idempotency_store.stats())
+    finally:
+        app_module.get_llm_response = original_llm_response
+        idempotency_store.clear()
+        with app.app_context():
+            IdempotencyKey.query.delete()
+            Conversation.query.filter_by(user_id=user_id).delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+def test_in_flight_duplicate_returns_409():
+    """首个请求仍在执行时，重复请求最多等待IDEMPOTENCY_WAIT秒，之后返回409和Retry-After"""
+    gunicorn_timeout = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'gunicorn_config.py'))['timeout']
+    assert idempotency.IDEMPOTENCY_WAIT < gunicorn_timeout
+
+    with app.app_context():
+        db.create_all()
+        user_id = create_user('idempotency-in-flight@example.com')
+        token = create_access_token(identity=str(user_id))
+        # 模拟另一个worker正在执行的首个请求
+        idempotency_store.begin(user_id, 'in-flight-1', idempotency.request_fingerprint('你好'))
+
+    original_wait = idempotency.IDEMPOTENCY_WAIT
+    idempotency.IDEMPOTENCY_WAIT = 0.2
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'in-flight-1'}
+    try:
+        started = time.monotonic()
+        response = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert response.status_code == 409
+        assert response.headers['Retry-After'] == str(idempotency.IDEMPOTENCY_RETRY_AFTER)
+        assert time.monotonic() - started < 5
+    finally:
+        idempotency.IDEMPOTENCY_WAIT = original_wait
+        with app.app_context():
+            IdempotencyKey.query.delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    test_store_lifecycle()
+    test_fallback_reply_not_replayed()
+    test_fallback_reply_through_endpoint()
+    test_duplicate_submissions()
+    test_in_flight_duplicate_returns_409()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+大模型并发限制测试脚本：有界排队、等待超时、跨进程名额和饱和时的错误
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services import ai_service
+from services.llm_limiter import ConcurrencyLimiter, LimiterSaturated
+
+
+def test_queue_and_rejection():
+    """名额用尽时排队等待，队列已满时立即拒绝，释放名额后排队的请求继续"""
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1, max_wait=5)
+    release = threading.Event()
+    entered = threading.Event()
+    order = []
+
+    def hold():
+        with limiter.slot():
+            entered.set()
+            release.wait()
+            order.append('first')
+
+    def queued():
+        with limiter.slot():
+            order.append('second')
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait()
+    waiter = threading.Thread(target=queued)
+    waiter.start()
+    while limiter.stats()['queue_depth'] < 1:
+        time.sleep(0.01)
+
+    try:
+        with limiter.slot():
+            pass
+        assert False, "队列已满时应拒绝"
+    except LimiterSaturated as e:
+        assert e.retry_after >= 1
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert order == ['first', 'second']
+    stats = limiter.stats()
+    assert stats['admitted'] == 2 and stats['rejected'] == 1
+    assert stats['active'] == 0 and stats['queue_depth'] == 0
+    assert stats['peak_queue_depth'] == 1 and stats['max_wait_ms'] > 0
+    print("并发限制统计:", stats)
+
+
+def test_wait_deadline():
+    """排队超过最长等待时间后拒绝"""
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, max_wait=0.05)
+    with limiter.slot():
+        start = time.monotonic()
+        try:
+            with limiter.slot():
+                pass
+            assert False, "等待超时时应拒绝"
+        except LimiterSaturated:
+            assert time.monotonic() - start >= 0.05
+    assert limiter.stats()['timed_out'] == 1
+    with limiter.slot():
+        assert limiter.stats()['active'] == 1
+
+
+def test_global_slots():
+    """跨进程名额用尽时等待超时，释放后可再次占用"""
+    directory = tempfile.mkdtemp()
+    try:
+        first = ConcurrencyLimiter(max_concurrency=4, max_wait=0.1, global_concurrency=1, slot_dir=directory)
+        second = ConcurrencyLimiter(max_concurrency=4, max_wait=0.1, global_concurrency=1, slot_dir=directory)
+        with first.slot():
+            try:
+                with second.slot():
+                    pass
+                assert False, "跨进程名额用尽时应拒绝"
+            except LimiterSaturated:
+                pass
+        assert second.stats()['active'] == 0
+        with second.slot():
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_llm_response_raises_when_saturated():
+    """饱和时get_llm_response抛出LimiterSaturated，而不是返回通用的失败提示"""
+    original_limiter = ai_service.llm_limiter
+    ai_service.llm_limiter = ConcurrencyLimiter(max_concurrency=0, max_queue=0)
+    try:
+        try:
+            ai_service.get_llm_response("你好")
+            assert False, "饱和时应抛出LimiterSaturated"
+        except LimiterSaturated:
+            pass
+        try:
+            list(ai_service.stream_llm_response("你好"))
+            assert False, "饱和时应抛出LimiterSaturated"
+        except LimiterSaturated:
+            pass
+    finally:
+        ai_service.llm_limiter = original_limiter
+
+
+if __name__ == '__main__':
+    test_queue_and_rejection()
+    test_wait_deadline()
+    test_global_slots()
+    test_llm_response_raises_when_saturated()
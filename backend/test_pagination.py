@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+对话历史游标分页测试脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用内存数据库，避免影响instance/app.db（需在导入app之前设置）
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from app import app, db
+from models import User, Conversation
+
+
+def test_keyset_pagination():
+    """向前翻页、获取新消息和参数校验"""
+    with app.app_context():
+        db.create_all()
+        User.query.filter_by(email='pagination@example.com').delete()
+        user = User(email='pagination@example.com', password_hash=generate_password_hash('pw'))
+        db.session.add(user)
+        db.session.commit()
+
+        # 125条记录，其中每5条共享同一个时间戳，用于验证(timestamp, id)排序的稳定性
+        base_time = datetime.utcnow() - timedelta(days=1)
+        for i in range(125):
+            db.session.add(Conversation(
+                user_id=user.id, role='user' if i % 2 == 0 else 'ai',
+                content=f"消息{i}", timestamp=base_time + timedelta(seconds=i // 5)
+            ))
+        db.session.commit()
+        all_ids = [conv.id for conv in Conversation.query.filter_by(user_id=user.id).order_by(
+            Conversation.timestamp.asc(), Conversation.id.asc()
+        ).all()]
+        token = create_access_token(identity=str(user.id))
+        user_id = user.id
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    try:
+        # 默认返回最近一页（升序）
+        response = client.get('/api/conversations', headers=headers)
+        data = response.get_json()
+        assert response.status_code == 200
+        assert [c['id'] for c in data['conversations']] == all_ids[-50:]
+        assert data['next_cursor'] == all_ids[-50]
+
+        # 沿before向更早翻页，直到取完
+        collected = [c['id'] for c in data['conversations']]
+        cursor = data['next_cursor']
+        while cursor is not None:
+            data = client.get(f'/api/conversations?before={cursor}&limit=40', headers=headers).get_json()
+            collected = [c['id'] for c in data['conversations']] + collected
+            cursor = data['next_cursor']
+        assert collected == all_ids
+
+        # 沿after获取新消息
+        data = client.get(f'/api/conversations?after={all_ids[100]}&limit=10', headers=headers).get_json()
+        assert [c['id'] for c in data['conversations']] == all_ids[101:111]
+        assert data['next_cursor'] == all_ids[110]
+        data = client.get(f'/api/conversations?after={all_ids[110]}&limit=50', headers=headers).get_json()
+        assert [c['id'] for c in data['conversations']] == all_ids[111:]
+        assert data['next_cursor'] is None
+
+        # 翻页查询在复合索引上做范围查找，而不是扫描该用户的全部记录
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if 'ORDER BY conversation.timestamp DESC' in statement:
+                statements.append((statement, parameters))
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                client.get(f'/api/conversations?before={all_ids[60]}&limit=10', headers=headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            statement, parameters = statements[-1]
+            plan = ' '.join(row[-1] for row in db.session.connection().exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + statement, parameters
+            ))
+            assert 'ix_conversation_user_id_timestamp_id' in plan and 'timestamp<' in plan.replace(' ', '')
+            print("查询计划:", plan)
+
+        # 参数校验
+        assert client.get('/api/conversations?before=abc', headers=headers).status_code == 400
+        assert client.get('/api/conversations?before=1&after=2', headers=headers).status_code == 400
+        assert client.get('/api/conversations?before=999999999', headers=headers).status_code == 400
+        print("游标分页结果正确")
+    finally:
+        with app.app_context():
+            Conversation.query.filter_by(user_id=user_id).delete()
+            User.query.filter_by(id=user_id).delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    test_keyset_pagination()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+pgvector检索测试脚本：PostgreSQL后端的检索结果与内存索引一致
+需要设置TEST_POSTGRES_URL（如 postgresql://postgres@localhost/evolveme_test，
+需已安装pgvector扩展和psycopg2），未设置时跳过
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+from models import db, User, Conversation
+from services import vector_index
+from services.vector_index import UserVectorIndex, create_vector_index
+from services.pgvector_store import PGVectorIndex, to_vector_literal
+
+TEST_POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+
+BACKENDS = [
+    pytest.param(TEST_POSTGRES_URL, PGVectorIndex, id='pgvector', marks=pytest.mark.skipif(
+        not TEST_POSTGRES_URL, reason='未设置TEST_POSTGRES_URL'
+    )),
+]
+
+
+def create_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def test_vector_literal():
+    """向量按pgvector的文本格式传给数据库"""
+    assert to_vector_literal([1, 0.5, -2]) == '[1.0,0.5,-2.0]'
+
+
+@pytest.mark.parametrize('uri,index_class', BACKENDS)
+def test_top_k_matches_exact_index(uri, index_class):
+    """数据库内top-k与内存索引一致，候选重排只在候选中排序，并且只检索当前用户的消息"""
+    app = create_app(uri)
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='retrieval-backend@example.com', password_hash='x')
+            other = User(email='retrieval-backend-other@example.com', password_hash='x')
+            db.session.add_all([user, other])
+            db.session.commit()
+
+            rng = np.random.default_rng(11)
+            data = rng.normal(size=(200, 384)).astype(np.float32)
+            conversations = [
+                Conversation(user_id=user.id, content=f"消息{i}", role='user', embedding=data[i])
+                for i in range(200)
+            ]
+            db.session.add_all(conversations)
+            db.session.add(Conversation(user_id=other.id, content="别人的消息", role='user', embedding=data[0]))
+            db.session.add(Conversation(user_id=user.id, content="回复", role='ai'))
+            db.session.commit()
+
+            exact = UserVectorIndex()
+            exact.add_many([conv.id for conv in conversations], data)
+            index = index_class(user.id)
+            for query in rng.normal(size=(5, 384)):
+                expected = exact.search(query, 5)
+                actual = index.search(query, 5)
+                assert [i for i, _ in actual] == [i for i, _ in expected]
+                assert np.allclose([s for _, s in actual], [s for _, s in expected], atol=1e-5)
+
+            candidates = [conv.id for conv in conversations[:20]]
+            expected = exact.rerank(data[3], candidates, 3)
+            assert [i for i, _ in index.rerank(data[3], candidates, 3)] == [i for i, _ in expected]
+            assert index.search(data[0], 1)[0][0] == conversations[0].id
+            assert index.rerank(data[0], [], 3) == []
+
+            # 修改向量后检索结果随之更新
+            conversations[1].embedding = data[0]
+            db.session.commit()
+            assert {i for i, _ in index.search(data[0], 2)} == {conversations[0].id, conversations[1].id}
+        finally:
+            db.session.rollback()
+            db.drop_all()
+
+
+@pytest.mark.parametrize('uri,index_class', BACKENDS)
+def test_small_user_in_large_table(uri, index_class):
+    """用户的消息只占全表很小一部分时，近似索引扫描后的user_id过滤不会让结果少于limit条或漏掉最相似的消息"""
+    app = create_app(uri)
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='retrieval-small@example.com', password_hash='x')
+            other = User(email='retrieval-large@example.com', password_hash='x')
+            db.session.add_all([user, other])
+            db.session.commit()
+
+            rng = np.random.default_rng(23)
+            data = rng.normal(size=(8, 384)).astype(np.float32)
+            conversations = [
+                Conversation(user_id=user.id, content=f"消息{i}", role='user', embedding=data[i])
+                for i in range(8)
+            ]
+            db.session.add_all(conversations)
+            # 其他用户的大量消息都与查询向量更相似，近似索引的候选全部被它们占满
+            query = rng.normal(size=384).astype(np.float32)
+            noise = rng.normal(scale=0.05, size=(2000, 384)).astype(np.float32)
+            db.session.add_all([
+                Conversation(user_id=other.id, content="别人的消息", role='user', embedding=query + noise[i])
+                for i in range(2000)
+            ])
+            db.session.commit()
+
+            exact = UserVectorIndex()
+            exact.add_many([conv.id for conv in conversations], data)
+            expected = exact.search(query, 5)
+            actual = index_class(user.id).search(query, 5)
+            assert [i for i, _ in actual] == [i for i, _ in expected]
+            assert len(index_class(user.id).search(query, 20)) == 8
+        finally:
+            db.session.rollback()
+            db.drop_all()
+
+
+@pytest.mark.parametrize('uri,index_class', BACKENDS)
+def test_search_relevant_conversations_matches_exact(uri, index_class):
+    """应用的检索入口在pgvector后端上返回与exact后端相同的对话、AI回复和相似度"""
+    from services import ai_service
+    from services.retrieval_cache import retrieval_cache
+    from services.vector_index import vector_index_registry
+
+    app = create_app(uri)
+    original_backend = vector_index.VECTOR_INDEX_BACKEND
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='retrieval-app@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+
+            rng = np.random.default_rng(31)
+            data = rng.normal(size=(60, 384)).astype(np.float32)
+            for i in range(60):
+                message = Conversation(user_id=user.id, content=f"消息{i}", role='user', embedding=data[i])
+                db.session.add(message)
+                db.session.flush()
+                db.session.add(Conversation(user_id=user.id, content=f"回复{i}", role='ai', reply_to_id=message.id))
+            db.session.commit()
+
+            def search(backend_name, query):
+                vector_index.VECTOR_INDEX_BACKEND = backend_name
+                vector_index_registry.discard()
+                retrieval_cache.clear()
+                return ai_service.search_relevant_conversations('查询', user.id, limit=5, user_embedding=query)
+
+            for query in rng.normal(size=(3, 384)):
+                expected = search('exact', query)
+                actual = search('pgvector', query)
+                assert [c['id'] for c in actual] == [c['id'] for c in expected]
+                assert [c['ai_response'] for c in actual] == [c['ai_response'] for c in expected]
+                assert np.allclose([c['similarity'] for c in actual], [c['similarity'] for c in expected], atol=1e-5)
+        finally:
+            vector_index.VECTOR_INDEX_BACKEND = original_backend
+            vector_index_registry.discard()
+            retrieval_cache.clear()
+            db.session.rollback()
+            db.drop_all()
+
+
+def test_registry_backend_setting():
+    """VECTOR_INDEX_BACKEND=pgvector时注册表创建不缓存向量的索引，同步时不读取数据库"""
+    original_backend = vector_index.VECTOR_INDEX_BACKEND
+    try:
+        vector_index.VECTOR_INDEX_BACKEND = 'pgvector'
+        index = create_vector_index(384, user_id=5)
+        assert isinstance(index, PGVectorIndex)
+        assert index.stored_in_database
+        assert index.add_many([1], np.ones((1, 384))) == 0
+    finally:
+        vector_index.VECTOR_INDEX_BACKEND = original_backend
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
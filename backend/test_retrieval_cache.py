@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+检索结果缓存测试脚本：命中、量化、LRU淘汰、TTL过期和提交新消息后的失效
+"""
+
+import sys
+import os
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+from models import db, User, Conversation
+from services import ai_service
+from services.retrieval_cache import RetrievalCache, retrieval_cache
+from services.embedding_service import get_text_embedding
+from services.vector_index import vector_index_registry
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def test_quantized_lookup_and_eviction():
+    """几乎相同的查询向量命中同一条目，超出容量时淘汰最久未用的条目"""
+    cache = RetrievalCache(max_entries=2, ttl=60)
+    query = np.random.default_rng(1).normal(size=384)
+    cache.put(1, query, 3, [{'user_message': 'a', 'similarity': 0.9}], 0)
+    assert cache.get(1, query + 1e-6, 3) == ([{'user_message': 'a', 'similarity': 0.9}], 0)
+    assert cache.get(2, query, 3) == (None, 0)
+    assert cache.get(1, query, 5) == (None, 0)
+
+    cache.put(1, -query, 3, [], 0)
+    cache.put(1, np.ones(384), 3, [], 0)
+    assert cache.get(1, query, 3)[0] is None
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 1
+    assert stats['hits'] == 1 and stats['misses'] == 3
+
+
+def test_ttl_expiry():
+    """过期的条目视为未命中并被移除"""
+    cache = RetrievalCache(max_entries=10, ttl=0.01)
+    cache.put(1, np.ones(384), 3, [], 0)
+    time.sleep(0.02)
+    assert cache.get(1, np.ones(384), 3)[0] is None
+    assert cache.stats()['expirations'] == 1 and cache.stats()['size'] == 0
+
+
+def test_put_after_invalidate_is_dropped():
+    """未命中后、写入前该用户有新消息提交：旧的检索结果不能写到新版本的键下"""
+    cache = RetrievalCache(max_entries=10, ttl=60)
+    query = np.ones(384)
+    results, version = cache.get(1, query, 3)
+    assert results is None
+
+    # 检索进行期间另一个请求提交了新消息
+    cache.invalidate(1)
+    cache.put(1, query, 3, [{'user_message': 'old', 'similarity': 0.9}], version)
+    assert cache.get(1, query, 3) == (None, version + 1)
+    assert cache.stats()['size'] == 0 and cache.stats()['stale_puts'] == 1
+
+    # 用新版本重新检索的结果可以正常写入
+    cache.put(1, query, 3, [{'user_message': 'new', 'similarity': 0.9}], version + 1)
+    assert cache.get(1, query, 3) == ([{'user_message': 'new', 'similarity': 0.9}], version + 1)
+
+
+def test_commit_invalidates_user():
+    """重复查询直接命中缓存；提交该用户的新消息后重新检索并能找到新消息"""
+    vector_index_registry.discard()
+    retrieval_cache.clear()
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='retrieval-cache@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Conversation(user_id=user.id, content="我喜欢编程", role='user',
+                                        embedding=get_text_embedding("我喜欢编程")))
+            db.session.commit()
+
+            query = "我喜欢编程吗"
+            first = ai_service.search_relevant_conversations(query, user.id, limit=5)
+            second = ai_service.search_relevant_conversations(query, user.id, limit=5)
+            assert first == second and len(first) == 1
+            assert retrieval_cache.stats()['hits'] == 1
+
+            db.session.add(Conversation(user_id=user.id, content="我喜欢编程和跑步", role='user',
+                                        embedding=get_text_embedding("我喜欢编程和跑步")))
+            db.session.commit()
+            assert retrieval_cache.stats()['size'] == 0
+            third = ai_service.search_relevant_conversations(query, user.id, limit=5)
+            assert len(third) == 2
+            assert retrieval_cache.stats()['hits'] == 1
+        finally:
+            db.drop_all()
+            retrieval_cache.clear()
+    print("提交新消息后检索缓存已失效")
+
+
+if __name__ == '__main__':
+    test_quantized_lookup_and_eviction()
+    test_ttl_expiry()
+    test_put_after_invalidate_is_dropped()
+    test_commit_invalidates_user()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+语义回复缓存测试脚本：相似提问复用回复、按用户隔离、上下文变化、TTL、淘汰、跳过缓存和经接口保存对话后的命中
+"""
+
+import sys
+import os
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用内存数据库，避免影响instance/app.db（需在导入app之前设置）
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import Flask
+from flask_jwt_extended import create_access_token
+
+import app as app_module
+
+from models import db, User, Conversation
+from services import ai_service, response_cache
+from services.response_cache import SemanticResponseCache, semantic_cache
+from services.embedding_service import get_text_embedding
+from services.vector_index import vector_index_registry
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+class FakeResponse:
+    """模拟豆包API的成功响应"""
+    status_code = 200
+    text = ''
+
+    def json(self):
+        return {"choices": [{"message": {"content": "保持动力的关键是设定小目标。"}}]}
+
+
+def test_similarity_threshold_and_scoping():
+    """足够相似的提问命中，不同用户或不同上下文不命中"""
+    cache = SemanticResponseCache(threshold=0.95, ttl=60)
+    query = np.random.default_rng(2).normal(size=384)
+    cache.put(1, query, 'ctx', "回复")
+    assert cache.get(1, query * 2 + 1e-3, 'ctx') == "回复"
+    assert cache.get(2, query, 'ctx') is None
+    assert cache.get(1, query, 'other') is None
+    assert cache.get(1, -query, 'ctx') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_ttl_and_eviction():
+    """过期条目不再命中；超出单用户配额时淘汰最久未用的条目"""
+    cache = SemanticResponseCache(threshold=0.99, ttl=0.01)
+    cache.put(1, np.ones(384), 'ctx', "回复")
+    time.sleep(0.02)
+    assert cache.get(1, np.ones(384), 'ctx') is None
+    assert cache.stats()['size'] == 0
+
+    cache = SemanticResponseCache(threshold=0.99, ttl=60, max_entries=10, max_per_user=2)
+    vectors = np.eye(3, 384)
+    for i in range(3):
+        cache.put(1, vectors[i], 'ctx', f"回复{i}")
+    assert cache.get(1, vectors[0], 'ctx') is None
+    assert cache.get(1, vectors[2], 'ctx') == "回复2"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_repeated_prompt_skips_upstream():
+    """开启缓存后重复提问只调用一次大模型，use_cache=False时强制重新调用"""
+    calls = []
+    original_post = ai_service.ark_client.post_chat_completion
+    original_enabled = response_cache.SEMANTIC_CACHE_ENABLED
+    ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: calls.append(args) or FakeResponse()
+    response_cache.SEMANTIC_CACHE_ENABLED = True
+    semantic_cache.clear()
+    vector_index_registry.discard()
+    try:
+        with app.app_context():
+            db.create_all()
+            try:
+                user = User(email='semantic-cache@example.com', password_hash='x')
+                db.session.add(user)
+                db.session.commit()
+                message = "我该如何保持动力？"
+                embedding = np.array(get_text_embedding(message))
+
+                first = ai_service.get_llm_response(message, user.id, embedding)
+                second = ai_service.get_llm_response(message, user.id, embedding)
+                assert first == second == "保持动力的关键是设定小目标。"
+                assert len(calls) == 1
+
+                ai_service.get_llm_response(message, user.id, embedding, use_cache=False)
+                assert len(calls) == 2
+                # 没有用户ID时不使用缓存
+                ai_service.get_llm_response(message)
+                assert len(calls) == 3
+            finally:
+                db.drop_all()
+    finally:
+        ai_service.ark_client.post_chat_completion = original_post
+        response_cache.SEMANTIC_CACHE_ENABLED = original_enabled
+        semantic_cache.clear()
+    print("重复提问命中语义缓存")
+
+
+def test_repeated_prompt_through_endpoint():
+    """经POST /api/conversations提问：第一轮保存后记忆已变化，重复提问仍命中缓存"""
+    calls = []
+    original_post = ai_service.ark_client.post_chat_completion
+    original_enabled = response_cache.SEMANTIC_CACHE_ENABLED
+    ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: calls.append(args) or FakeResponse()
+    response_cache.SEMANTIC_CACHE_ENABLED = True
+    semantic_cache.clear()
+    vector_index_registry.discard()
+    flask_app = app_module.app
+    try:
+        with flask_app.app_context():
+            db.create_all()
+            try:
+                user = User(email='semantic-endpoint@example.com', password_hash='x')
+                db.session.add(user)
+                db.session.commit()
+                token = create_access_token(identity=str(user.id))
+                user_id = user.id
+
+                client = flask_app.test_client()
+                headers = {'Authorization': f'Bearer {token}'}
+                first = client.post('/api/conversations', json={'message': '我该如何保持动力？'}, headers=headers)
+                second = client.post('/api/conversations', json={'message': '我该如何保持动力？'}, headers=headers)
+                assert first.status_code == second.status_code == 201
+                assert first.get_json()['content'] == second.get_json()['content']
+                assert len(calls) == 1
+                # 两轮对话都已保存
+                assert Conversation.query.filter_by(user_id=user_id).count() == 4
+            finally:
+                db.session.remove()
+                db.drop_all()
+    finally:
+        ai_service.ark_client.post_chat_completion = original_post
+        response_cache.SEMANTIC_CACHE_ENABLED = original_enabled
+        semantic_cache.clear()
+        vector_index_registry.discard()
+    print("经接口保存对话后重复提问命中语义缓存")
+
+
+if __name__ == '__main__':
+    test_similarity_threshold_and_scoping()
+    test_ttl_and_eviction()
+    test_repeated_prompt_skips_upstream()
+    test_repeated_prompt_through_endpoint()
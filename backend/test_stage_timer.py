@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+请求阶段计时测试脚本：验证每个请求只计算一次用户消息向量
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Conversation
+from services import ai_service
+from services.embedding_service import get_text_embedding
+from services.stage_timer import get_stage_timer
+from services.vector_index import vector_index_registry
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+class FakeResponse:
+    """模拟豆包API的成功响应"""
+    status_code = 200
+    text = ''
+
+    def json(self):
+        return {"choices": [{"message": {"content": "好的，我们继续聊编程。"}}]}
+
+
+def test_embedding_computed_once():
+    """预先计算的向量贯穿整个流程，不再重复向量化"""
+    original_post = ai_service.ark_client.post_chat_completion
+    ai_service.ark_client.post_chat_completion = lambda *args, **kwargs: FakeResponse()
+    try:
+        with app.app_context():
+            db.create_all()
+            vector_index_registry.discard()
+            user = User(email='timer@example.com', password_hash=generate_password_hash('pw'))
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Conversation(
+                user_id=user.id, content="我喜欢编程", role='user',
+                embedding=get_text_embedding("我喜欢编程")
+            ))
+            db.session.commit()
+            user_id = user.id
+
+        # 每个请求上下文都有独立的计时器
+        with app.test_request_context('/api/conversations', method='POST'):
+            user_message = "我想学习编程语言"
+            user_embedding = get_text_embedding(user_message)
+            reply = ai_service.get_llm_response(user_message, user_id, user_embedding)
+
+            timer = get_stage_timer()
+            print(f"阶段耗时: {timer.summary()}")
+            assert reply == "好的，我们继续聊编程。"
+            assert timer.count('embedding') == 1
+            assert timer.count('retrieval') == 1
+            assert timer.count('llm') == 1
+            assert 'embedding;desc="x1"' in timer.server_timing_header()
+
+        with app.test_request_context('/api/conversations', method='POST'):
+            # 未传入向量时仍会自行计算（兼容旧调用方式）
+            ai_service.build_context_with_memory("我想学习编程语言", user_id)
+            assert get_stage_timer().count('embedding') == 1
+
+        with app.app_context():
+            db.drop_all()
+    finally:
+        ai_service.ark_client.post_chat_completion = original_post
+
+
+if __name__ == '__main__':
+    test_embedding_computed_once()
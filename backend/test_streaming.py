@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+流式回复测试脚本：使用本地模拟的豆包SSE接口，覆盖ai_service的流式调用和/api/conversations/stream接口
+"""
+
+import sys
+import os
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时的SQLite文件，避免影响instance/app.db（需在导入app和services之前设置）
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+from app import app, db
+from models import User, Conversation
+from services import ai_service
+
+
+class StubStreamHandler(BaseHTTPRequestHandler):
+    """按豆包接口的SSE格式逐段返回回复"""
+    deltas = ["你好", "，我是", "你的AI教练。"]
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        assert body['stream'] is True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for delta in self.deltas:
+            chunk = {"choices": [{"delta": {"content": delta}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(self.tail)
+
+    tail = b"data: [DONE]\n\n"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BrokenStreamHandler(StubStreamHandler):
+    """返回一段回复后发送无法解析的数据，模拟上游中途出错"""
+    deltas = ["你好"]
+    tail = b"data: {broken\n\n"
+
+
+def start_stub(handler):
+    """启动模拟的豆包接口并让ai_service指向它，返回 (server, 原API地址)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_endpoint = ai_service.API_ENDPOINT
+    ai_service.API_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/api/v3/chat/completions"
+    return server, original_endpoint
+
+
+def parse_sse(body):
+    """把SSE响应体解析为 [(事件名, 数据)]"""
+    events = []
+    for message in body.split('\n\n'):
+        if not message.strip():
+            continue
+        lines = message.split('\n')
+        assert lines[0].startswith('event: ') and lines[1].startswith('data: ') and len(lines) == 2
+        events.append((lines[0][len('event: '):], json.loads(lines[1][len('data: '):])))
+    return events
+
+
+def create_user(email):
+    with app.app_context():
+        db.create_all()
+        User.query.filter_by(email=email).delete()
+        user = User(email=email, password_hash=generate_password_hash('pw'))
+        db.session.add(user)
+        db.session.commit()
+        return user.id, create_access_token(identity=str(user.id))
+
+
+def delete_user(user_id):
+    with app.app_context():
+        Conversation.query.filter_by(user_id=user_id).delete()
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+def test_stream_llm_response():
+    """流式接口应逐段产出增量内容"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubStreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_endpoint = ai_service.API_ENDPOINT
+    ai_service.API_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/api/v3/chat/completions"
+    try:
+        deltas = list(ai_service.stream_llm_response("你好"))
+        print(f"收到的增量内容: {deltas}")
+        assert deltas == StubStreamHandler.deltas
+    finally:
+        ai_service.API_ENDPOINT = original_endpoint
+        server.shutdown()
+
+
+def test_stream_llm_response_unavailable():
+    """上游不可用时产出与非流式接口相同的提示语"""
+    original_endpoint = ai_service.API_ENDPOINT
+    ai_service.API_ENDPOINT = "http://127.0.0.1:9/api/v3/chat/completions"
+    try:
+        deltas = list(ai_service.stream_llm_response("你好"))
+        assert deltas == ["抱歉，网络连接出现问题，请检查网络后重试。"]
+    finally:
+        ai_service.API_ENDPOINT = original_endpoint
+
+
+def test_stream_llm_response_interrupted():
+    """已产出部分内容后上游出错时抛出StreamInterrupted，而不是当作完整回复结束"""
+    server, original_endpoint = start_stub(BrokenStreamHandler)
+    deltas = []
+    try:
+        try:
+            for delta in ai_service.stream_llm_response("你好"):
+                deltas.append(delta)
+            assert False, "应抛出StreamInterrupted"
+        except ai_service.StreamInterrupted:
+            pass
+        assert deltas == BrokenStreamHandler.deltas
+    finally:
+        ai_service.API_ENDPOINT = original_endpoint
+        server.shutdown()
+
+
+def test_stream_endpoint():
+    """流式接口按SSE格式逐段返回token，流结束后保存本轮对话并在done中返回记录和统计"""
+    user_id, token = create_user('stream-endpoint@example.com')
+    server, original_endpoint = start_stub(StubStreamHandler)
+    try:
+        response = app.test_client().post('/api/conversations/stream', json={'message': '你好'},
+                                          headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = parse_sse(response.get_data(as_text=True))
+        assert [name for name, _ in events] == ['token'] * len(StubStreamHandler.deltas) + ['done']
+        assert [data['content'] for _, data in events[:-1]] == StubStreamHandler.deltas
+        done = events[-1][1]
+        assert done['role'] == 'ai' and done['content'] == ''.join(StubStreamHandler.deltas)
+        assert 'llm' in done['metrics']['server_timing'] and done['metrics']['context_tokens'] > 0
+
+        with app.app_context():
+            rows = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.id).all()
+            assert [(row.role, row.content) for row in rows] == [('user', '你好'), ('ai', done['content'])]
+            assert rows[1].id == done['id'] and rows[1].reply_to_id == rows[0].id
+    finally:
+        ai_service.API_ENDPOINT = original_endpoint
+        server.shutdown()
+        delete_user(user_id)
+
+
+def test_stream_endpoint_interrupted():
+    """回复中途上游出错时发送error事件，不保存不完整的回复"""
+    user_id, token = create_user('stream-broken@example.com')
+    server, original_endpoint = start_stub(BrokenStreamHandler)
+    try:
+        response = app.test_client().post('/api/conversations/stream', json={'message': '你好'},
+                                          headers={'Authorization': f'Bearer {token}'})
+        events = parse_sse(response.get_data(as_text=True))
+        assert [name for name, _ in events] == ['token', 'error']
+        with app.app_context():
+            assert Conversation.query.filter_by(user_id=user_id).count() == 0
+    finally:
+        ai_service.API_ENDPOINT = original_endpoint
+        server.shutdown()
+        delete_user(user_id)
+
+
+if __name__ == '__main__':
+    test_stream_llm_response()
+    test_stream_llm_response_unavailable()
+    test_stream_llm_response_interrupted()
+    test_stream_endpoint()
+    test_stream_endpoint_interrupted()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+对话摘要测试脚本：用本地模拟的大模型生成摘要，检索时摘要优先于已覆盖的原始对话
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+from models import db, User, Conversation, ConversationSummary
+from services import ai_service, summarizer
+from services.ark_client import ark_client
+from services.circuit_breaker import CircuitBreaker
+from services.embedding_service import get_text_embedding
+from services.retrieval_cache import retrieval_cache
+from services.vector_index import vector_index_registry
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def mock_summarize(transcript):
+    """本地模拟的大模型：取第一行作为摘要"""
+    mock_summarize.calls += 1
+    return "用户一直在坚持学习Python编程。" + transcript.splitlines()[0]
+
+
+mock_summarize.calls = 0
+
+
+def add_turns(user_id, count, topic):
+    for i in range(count):
+        content = f"{topic}第{i}天"
+        user_message = Conversation(user_id=user_id, content=content, role='user',
+                                    embedding=get_text_embedding(content))
+        db.session.add(user_message)
+        db.session.add(Conversation(user_id=user_id, content="继续加油", role='ai', reply_to=user_message))
+    db.session.commit()
+
+
+def test_summaries_cover_old_turns():
+    """超出保留条数的较早对话按段生成摘要，重复运行不会重复生成，凑不满一段的留到下次"""
+    mock_summarize.calls = 0
+    vector_index_registry.discard()
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='summary@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+            add_turns(user.id, 35, "我在学习Python编程")
+
+            # 70条对话，保留最近40条，剩余30条只够生成一段20条的摘要
+            assert summarizer.summarize_user(user.id, mock_summarize) == 1
+            assert summarizer.summarize_user(user.id, mock_summarize) == 0
+            assert mock_summarize.calls == 1
+            summary = ConversationSummary.query.filter_by(user_id=user.id).one()
+            assert summary.message_count == summarizer.SUMMARY_CHUNK_SIZE
+            assert summarizer.summarized_until(user.id) == summary.end_id
+
+            add_turns(user.id, 10, "我在学习Python编程")
+            assert summarizer.summarize_all(mock_summarize) == 1
+            assert ConversationSummary.query.count() == 2
+
+            # 模拟的大模型失败时不写入摘要
+            add_turns(user.id, 10, "我在学习Python编程")
+            assert summarizer.summarize_user(user.id, lambda transcript: None) == 0
+            assert ConversationSummary.query.count() == 2
+        finally:
+            db.drop_all()
+
+
+def test_context_prefers_summaries():
+    """构建上下文时使用摘要，摘要已覆盖的原始对话不再重复进入上下文"""
+    mock_summarize.calls = 0
+    vector_index_registry.discard()
+    retrieval_cache.clear()
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='summary-context@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+            add_turns(user.id, 30, "我在学习Python编程")
+            assert summarizer.summarize_user(user.id, mock_summarize) == 1
+
+            summaries = summarizer.search_summaries(user.id, get_text_embedding("学习Python编程"))
+            assert len(summaries) == 1 and summaries[0]['similarity'] > 0
+
+            messages = ai_service.build_context_with_memory("我在学习Python编程", user.id)
+            memory = messages[1]['content']
+            assert "我们之前聊过：用户一直在坚持学习Python编程" in memory
+            covered = [f"我在学习Python编程第{i}天\"" for i in range(10)]
+            assert not any(text in memory for text in covered)
+            print(memory)
+        finally:
+            db.drop_all()
+
+
+def test_background_worker():
+    """后台任务在应用上下文中运行一轮摘要"""
+    with app.app_context():
+        db.create_all()
+        user = User(email='summary-worker@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        add_turns(user.id, 30, "我在练习跑步")
+    lock_path = os.path.join(tempfile.mkdtemp(), 'summary_worker.lock')
+    worker = summarizer.SummaryWorker(app, interval=3600, summarize=mock_summarize, lock_path=lock_path)
+    try:
+        # 另一个进程持有摘要锁时本进程跳过这一轮，不调用大模型
+        other = summarizer.SummaryWorker(app, lock_path=lock_path)
+        fd = other._try_lock()
+        calls = mock_summarize.calls
+        try:
+            assert worker.run_once() == 0
+            assert mock_summarize.calls == calls
+        finally:
+            os.close(fd)
+        assert worker.run_once() == 1
+    finally:
+        with app.app_context():
+            db.drop_all()
+
+
+def test_summary_respects_breaker():
+    """熔断器断开时摘要请求不发往上游"""
+    original_breaker = summarizer.llm_breaker
+    original_post = ark_client.post_chat_completion
+    calls = []
+    summarizer.llm_breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    summarizer.llm_breaker.record_failure()
+    ark_client.post_chat_completion = lambda *args, **kwargs: calls.append(1)
+    try:
+        assert summarizer.summarize_with_llm("用户：你好") is None
+        assert calls == []
+    finally:
+        summarizer.llm_breaker = original_breaker
+        ark_client.post_chat_completion = original_post
+
+
+if __name__ == '__main__':
+    test_summaries_cover_old_turns()
+    test_context_prefers_summaries()
+    test_background_worker()
+    test_summary_respects_breaker()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+混合检索测试脚本：FTS5全文索引同步（只在混合模式下写入，切换后补齐）、中文分词、BM25预筛选加向量重排
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, User, Conversation
+from services import text_search
+from services.text_search import tokenize, search_candidates, hybrid_search, FTS_TABLE
+from services.ai_service import search_relevant_conversations
+from services.embedding_service import get_text_embedding
+from services.vector_index import vector_index_registry
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def add_message(user_id, content, role='user'):
+    conversation = Conversation(user_id=user_id, content=content, role=role, embedding=get_text_embedding(content))
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+def test_tokenize():
+    """中文按二元组切分，英文按单词切分并转小写"""
+    assert tokenize("我喜欢篮球") == ['我喜', '喜欢', '欢篮', '篮球']
+    assert tokenize("学习Python编程!") == ['学习', 'python', '编程']
+    assert tokenize("好") == ['好']
+    assert tokenize("，。！") == []
+
+
+def test_index_stays_in_sync():
+    """混合模式下新增、修改、删除用户消息时全文索引同步更新，AI回复不进入索引"""
+    vector_index_registry.discard()
+    original_mode = text_search.RETRIEVAL_MODE
+    text_search.RETRIEVAL_MODE = 'hybrid'
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='fts@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+
+            message = add_message(user.id, "周末想去打篮球")
+            add_message(user.id, "篮球是很好的运动", role='ai')
+            assert search_candidates(user.id, "篮球") == [message.id]
+
+            message.content = "周末想去游泳"
+            db.session.commit()
+            assert search_candidates(user.id, "篮球") == []
+            assert search_candidates(user.id, "游泳") == [message.id]
+
+            db.session.delete(message)
+            db.session.commit()
+            assert db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() == 0
+        finally:
+            text_search.RETRIEVAL_MODE = original_mode
+            db.drop_all()
+    print("全文索引与对话内容保持同步")
+
+
+def test_vector_mode_skips_index():
+    """非混合模式下写入不同步全文索引，修改内容时删除旧记录，补齐后与混合模式下写入的结果一致"""
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='fts-vector@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+
+            assert text_search.RETRIEVAL_MODE == 'vector'
+            message = add_message(user.id, "周末想去打篮球")
+            assert db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() == 0
+
+            text_search.reset_backfill()
+            assert text_search.backfill_index() == 1
+            assert text_search.backfill_index() == 0
+            assert search_candidates(user.id, "篮球") == [message.id]
+
+            message.content = "周末想去游泳"
+            db.session.commit()
+            assert search_candidates(user.id, "篮球") == []
+            text_search.reset_backfill()
+            assert text_search.backfill_index() == 1
+            assert search_candidates(user.id, "游泳") == [message.id]
+        finally:
+            db.drop_all()
+
+
+def test_hybrid_retrieval():
+    """词项命中的记录经向量重排后排在前面，只检索当前用户，命中不足时由向量检索补足"""
+    vector_index_registry.discard()
+    with app.app_context():
+        db.create_all()
+        try:
+            user = User(email='hybrid@example.com', password_hash='x')
+            other = User(email='hybrid-other@example.com', password_hash='x')
+            db.session.add_all([user, other])
+            db.session.commit()
+
+            for i in range(30):
+                add_message(user.id, f"今天的工作安排第{i}项")
+            basketball = add_message(user.id, "我每周三晚上打篮球")
+            swimming = add_message(user.id, "最近开始学游泳")
+            add_message(other.id, "我也喜欢打篮球")
+
+            # 默认的向量模式下写入的消息在首次混合检索前补入全文索引
+            text_search.reset_backfill()
+            assert text_search.backfill_index() == 33
+
+            candidates = search_candidates(user.id, "篮球打得怎么样了")
+            assert candidates == [basketball.id]
+
+            matches = hybrid_search(user.id, "篮球打得怎么样了", get_text_embedding("篮球打得怎么样了"), 3)
+            assert matches[0][0] == basketball.id
+            assert len(matches) == 3
+            assert len({conversation_id for conversation_id, _ in matches}) == 3
+
+            # 默认只用向量检索，混合检索需要显式开启
+            assert text_search.RETRIEVAL_MODE == 'vector'
+            assert len(search_relevant_conversations("游泳学会了吗", user.id, limit=3)) == 3
+            original_mode = text_search.RETRIEVAL_MODE
+            text_search.RETRIEVAL_MODE = 'hybrid'
+            try:
+                results = search_relevant_conversations("游泳学会了吗", user.id, limit=1)
+                assert results[0]['user_message'] == swimming.content
+            finally:
+                text_search.RETRIEVAL_MODE = original_mode
+            db.session.commit()
+        finally:
+            db.drop_all()
+            vector_index_registry.discard()
+    print("混合检索结果正确")
+
+
+if __name__ == '__main__':
+    test_tokenize()
+    test_index_stays_in_sync()
+    test_vector_mode_skips_index()
+    test_hybrid_retrieval()
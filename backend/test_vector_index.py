@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+内存向量索引测试脚本
+"""
+
+import sys
+import os
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime, timedelta
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Conversation
+from services.ai_service import search_relevant_conversations
+from services.embedding_service import get_text_embedding, calculate_similarity
+from services.vector_index import UserVectorIndex, vector_index_registry, refresh_user_index
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def brute_force_scan(query, embeddings, limit):
+    """与原先逐条计算相似度的实现保持一致"""
+    scored = [(i, calculate_similarity(query, emb)) for i, emb in enumerate(embeddings)]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:limit]
+
+
+def test_index_matches_scan():
+    """索引的top-k结果应与逐条扫描一致"""
+    rng = np.random.default_rng(42)
+    embeddings = rng.normal(size=(1000, 384))
+    index = UserVectorIndex()
+    index.add_many(range(1, 601), embeddings[:600])
+    index.add_many(range(601, 1001), embeddings[600:])  # 增量追加
+    assert len(index) == 1000
+
+    for _ in range(20):
+        query = rng.normal(size=384)
+        expected = brute_force_scan(query, embeddings, 5)
+        actual = index.search(query, 5)
+        assert [i for i, _ in actual] == [i + 1 for i, _ in expected]
+        assert np.allclose([s for _, s in actual], [s for _, s in expected], atol=1e-5)
+
+    # 重复追加已有记录不会产生重复行
+    index.add_many([999, 1000], embeddings[998:])
+    assert len(index) == 1000
+    print("索引结果与逐条扫描一致")
+
+
+def test_search_relevant_conversations():
+    """search_relevant_conversations通过索引检索，并能增量同步新消息"""
+    with app.app_context():
+        db.create_all()
+        vector_index_registry.discard()
+
+        user = User(email='index@example.com', password_hash=generate_password_hash('pw'))
+        db.session.add(user)
+        db.session.commit()
+
+        messages = ["我喜欢编程", "我在学习Python", "我想做一个网站", "我喜欢看电影", "我在学习机器学习"]
+        for i, message in enumerate(messages):
+            user_conversation = Conversation(
+                user_id=user.id, content=message, role='user',
+                embedding=get_text_embedding(message),
+                timestamp=datetime.utcnow() - timedelta(days=10 - i)
+            )
+            db.session.add(user_conversation)
+            db.session.add(Conversation(
+                user_id=user.id, content=f"回复{i}", role='ai', reply_to=user_conversation,
+                timestamp=datetime.utcnow() - timedelta(days=10 - i, seconds=-30)
+            ))
+        db.session.commit()
+
+        query = "我想学习编程语言"
+        results = search_relevant_conversations(query, user.id, limit=3)
+        expected = brute_force_scan(get_text_embedding(query), [get_text_embedding(m) for m in messages], 3)
+        assert [r['user_message'] for r in results] == [messages[i] for i, _ in expected]
+        # AI回复通过reply_to_id关联取回
+        assert [r['ai_response'] for r in results] == [f"回复{i}" for i, _ in expected]
+
+        # 新消息提交后只追加到已加载的索引
+        index = vector_index_registry.get(user.id)
+        assert len(index) == len(messages)
+        db.session.add(Conversation(
+            user_id=user.id, content=query, role='user', embedding=get_text_embedding(query)
+        ))
+        db.session.commit()
+        refresh_user_index(user.id)
+        assert vector_index_registry.get(user.id) is index
+        assert len(index) == len(messages) + 1
+
+        results = search_relevant_conversations(query, user.id, limit=1)
+        assert results[0]['user_message'] == query
+        assert abs(results[0]['similarity'] - 1.0) < 1e-5
+
+        db.drop_all()
+        print("检索结果正确，新消息已增量追加")
+
+
+if __name__ == '__main__':
+    test_index_matches_scan()
+    test_search_relevant_conversations()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+内存映射向量段测试脚本：多个worker共享段文件、删除与压缩
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, User, Conversation
+from services import vector_index, vector_segments
+from services.vector_index import UserVectorIndex, create_vector_index, vector_index_registry
+from services.vector_segments import SegmentVectorIndex
+from services.embedding_service import get_text_embedding
+
+# 使用内存数据库，避免影响instance/app.db
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def test_workers_share_segment():
+    """一个worker追加的向量，另一个worker直接通过内存映射看到，结果与内存索引一致"""
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(3)
+        data = rng.normal(size=(500, 384)).astype(np.float32)
+        worker_a = SegmentVectorIndex(42, directory=directory)
+        worker_b = SegmentVectorIndex(42, directory=directory)
+        exact = UserVectorIndex()
+
+        assert worker_a.add_many(range(1, 301), data[:300]) == 300
+        exact.add_many(range(1, 301), data[:300])
+        assert worker_b.last_id == 300
+        # 重复同步同一批记录不会重复写入
+        assert worker_b.add_many(range(1, 301), data[:300]) == 0
+        assert worker_b.add_many(range(301, 501), data[300:]) == 200
+        exact.add_many(range(301, 501), data[300:])
+
+        assert len(worker_a) == 500
+        # 向量文件映射为连续的float32矩阵，查询时直接在映射上做乘法，不复制
+        ids, matrix = worker_a._records()
+        assert isinstance(matrix, np.memmap) and matrix.flags['C_CONTIGUOUS'] and matrix.dtype == np.float32
+        for query in rng.normal(size=(10, 384)):
+            expected = exact.search(query, 5)
+            actual = worker_a.search(query, 5)
+            assert [i for i, _ in actual] == [i for i, _ in expected]
+            assert np.allclose([s for _, s in actual], [s for _, s in expected], atol=1e-5)
+        print(f"向量文件大小: {os.path.getsize(worker_a.vectors_path)} 字节")
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_partial_record_is_truncated():
+    """进程崩溃残留的半条记录不会被读到，下次追加前两个文件被截到相同的行数"""
+    directory = tempfile.mkdtemp()
+    try:
+        index = SegmentVectorIndex(7, directory=directory)
+        index.add_many([1, 2], np.eye(2, 384, dtype=np.float32))
+        # 模拟第三条记录的向量已写入一半、ID尚未写入时崩溃
+        with open(index.vectors_path, 'ab') as vectors_file:
+            vectors_file.write(b'\x00' * 1000)
+        assert len(index) == 2
+        index.add_many([3], np.eye(1, 384, 2, dtype=np.float32))
+        assert os.path.getsize(index.vectors_path) == 3 * index.row_bytes
+        assert os.path.getsize(index.ids_path) == 3 * 8
+        assert index.search(np.eye(1, 384, 2)[0], 1)[0][0] == 3
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_delete_and_compact():
+    """删除的记录立即不再返回，后台压缩后段文件变小，其他worker重新映射"""
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(5)
+        data = rng.normal(size=(100, 384)).astype(np.float32)
+        worker_a = SegmentVectorIndex(9, directory=directory)
+        worker_b = SegmentVectorIndex(9, directory=directory)
+        worker_a.add_many(range(1, 101), data)
+
+        assert worker_b.search(data[9], 1)[0][0] == 10
+        assert worker_a.mark_deleted([10]) is None
+        assert worker_b.search(data[9], 1)[0][0] != 10
+        # 混合检索的重排路径同样跳过已删除的记录
+        assert [i for i, _ in worker_b.rerank(data[9], [10, 11], 2)] == [11]
+
+        # 删除达到阈值时在后台压缩
+        thread = worker_a.mark_deleted(range(11, 30))
+        assert thread is not None
+        thread.join()
+        assert not os.path.exists(worker_a.deleted_path)
+        assert len(worker_b) == 80
+        assert worker_b.last_id == 100
+        ids = [i for i, _ in worker_b.search(data[0], 100)]
+        assert len(ids) == 80 and not set(ids) & set(range(10, 30))
+        print("压缩后段文件记录数:", len(worker_b))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_orm_delete_marks_segment():
+    """通过ORM删除（逐条或批量）用户消息并提交后，段索引不再返回该记录；回滚则不标记"""
+    directory = tempfile.mkdtemp()
+    original_backend = vector_index.VECTOR_INDEX_BACKEND
+    original_dir = vector_segments.VECTOR_SEGMENT_DIR
+    vector_index.VECTOR_INDEX_BACKEND = 'mmap'
+    vector_segments.VECTOR_SEGMENT_DIR = directory
+    vector_index_registry.discard()
+    vector_segments.register_deletion_hooks()
+    try:
+        with app.app_context():
+            db.create_all()
+            user = User(email='segments@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+            texts = ["我喜欢编程", "我在学习Python", "今天天气很好"]
+            conversations = [
+                Conversation(user_id=user.id, content=text, role='user', embedding=get_text_embedding(text))
+                for text in texts
+            ]
+            db.session.add_all(conversations)
+            db.session.commit()
+            target_id = conversations[0].id
+            query = get_text_embedding("我喜欢编程")
+            assert vector_index.search_user_index(user.id, query, 1)[0][0] == target_id
+
+            db.session.delete(conversations[0])
+            db.session.flush()
+            db.session.rollback()
+            assert vector_index.search_user_index(user.id, query, 1)[0][0] == target_id
+
+            db.session.delete(db.session.get(Conversation, target_id))
+            db.session.commit()
+            assert target_id not in [i for i, _ in vector_index.search_user_index(user.id, query, 3)]
+
+            # 批量删除同样会标记
+            python_id = conversations[1].id
+            Conversation.query.filter(Conversation.id == python_id).delete()
+            db.session.commit()
+            assert [i for i, _ in vector_index.search_user_index(user.id, query, 3)] == [conversations[2].id]
+            db.drop_all()
+    finally:
+        event.remove(Conversation, 'after_delete', vector_segments._collect_deleted_conversation)
+        event.remove(Session, 'do_orm_execute', vector_segments._collect_bulk_deleted_conversations)
+        event.remove(Session, 'after_commit', vector_segments._mark_deleted_after_commit)
+        event.remove(Session, 'after_rollback', vector_segments._discard_deleted_after_rollback)
+        vector_index.VECTOR_INDEX_BACKEND = original_backend
+        vector_segments.VECTOR_SEGMENT_DIR = original_dir
+        vector_index_registry.discard()
+        shutil.rmtree(directory)
+    print("ORM删除已同步到段文件")
+
+
+def test_registry_backend_setting():
+    """VECTOR_INDEX_BACKEND=mmap时注册表按用户创建段索引"""
+    original_backend = vector_index.VECTOR_INDEX_BACKEND
+    try:
+        vector_index.VECTOR_INDEX_BACKEND = 'mmap'
+        index = create_vector_index(384, user_id=1000001)
+        assert isinstance(index, SegmentVectorIndex)
+        assert index.vectors_path.endswith(os.path.join('41', '1000001.vec'))
+    finally:
+        vector_index.VECTOR_INDEX_BACKEND = original_backend
+
+
+if __name__ == '__main__':
+    test_workers_share_segment()
+    test_partial_record_is_truncated()
+    test_delete_and_compact()
+    test_orm_delete_marks_segment()
+    test_registry_backend_setting()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+后台批量写入测试脚本：多轮对话合并为一个事务、读己之写、退出前写完队列、202待落库凭据、写入失败的溢出与重放
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时的SQLite文件，避免影响instance/app.db（需在导入app之前设置）；
+# 后台写入线程需要自己的数据库连接，不能用所有会话共用一个连接的内存数据库
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+from app import app, db
+from models import User, Conversation
+from services.write_behind import WriteBehindWriter, write_behind, token_age
+
+
+def create_user(email):
+    with app.app_context():
+        db.create_all()
+        User.query.filter_by(email=email).delete()
+        user = User(email=email, password_hash=generate_password_hash('pw'))
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def delete_user(user_id):
+    with app.app_context():
+        Conversation.query.filter_by(user_id=user_id).delete()
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+def test_batched_writes():
+    """排队的多轮对话在一个事务中写入，落库后补上id，退出前写完剩余队列"""
+    user_id = create_user('write-behind@example.com')
+    writer = WriteBehindWriter(batch_size=10, linger=0.2)
+    try:
+        writer.init_app(app)
+        turns = [writer.enqueue(user_id, f'问题{i}', None, f'回答{i}') for i in range(3)]
+        assert turns[0].id is None
+        assert writer.wait_for_user(user_id, timeout=5)
+        assert all(turn.wait(0) and turn.id is not None for turn in turns)
+        assert writer.stats()['batches'] == 1 and writer.stats()['written'] == 3
+
+        with app.app_context():
+            rows = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.id).all()
+            assert [row.content for row in rows if row.role == 'ai'] == ['回答0', '回答1', '回答2']
+            ai_row = db.session.get(Conversation, turns[1].id)
+            assert ai_row.reply_to.content == '问题1'
+
+        # 停止时队列中尚未写入的对话也会落库
+        last = writer.enqueue(user_id, '问题3', None, '回答3')
+        writer.shutdown()
+        assert last.wait(0) and not writer.running
+        with app.app_context():
+            assert Conversation.query.filter_by(user_id=user_id).count() == 8
+        print("批量写入统计:", writer.stats())
+    finally:
+        writer.shutdown()
+        delete_user(user_id)
+
+
+def test_read_your_writes():
+    """开启后台写入时，提交对话后立即读取历史能看到刚发送的消息"""
+    user_id = create_user('write-behind-read@example.com')
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+
+    original_llm_response = app_module.get_llm_response
+    app_module.get_llm_response = lambda *args, **kwargs: "好的，我们继续。"
+    original_linger = write_behind.linger
+    write_behind.linger = 0.3
+    write_behind.init_app(app)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    try:
+        response = client.post('/api/conversations', json={'message': '你好'}, headers=headers)
+        assert response.status_code == 202
+        data = response.get_json()
+        assert data['content'] == "好的，我们继续。" and data['id'] is None
+        assert response.headers['Location'] == f"/api/conversations/pending/{data['pending_token']}"
+        assert 0 <= token_age(data['pending_token']) < 5
+
+        history = client.get('/api/conversations', headers=headers).get_json()
+        assert [item['content'] for item in history['conversations']] == ['你好', "好的，我们继续。"]
+        assert client.get('/api/health').get_json()['write_behind']['written'] >= 1
+        # 落库后凭据解析为AI回复记录
+        resolved = client.get(response.headers['Location'], headers=headers)
+        assert resolved.status_code == 200
+        assert resolved.get_json()['content'] == "好的，我们继续。" and resolved.get_json()['id'] is not None
+        assert client.get('/api/conversations/pending/invalid', headers=headers).status_code == 404
+    finally:
+        write_behind.shutdown()
+        write_behind.linger = original_linger
+        app_module.get_llm_response = original_llm_response
+        delete_user(user_id)
+
+
+def test_failed_write_spilled_and_replayed():
+    """逐条重试仍失败的对话写入溢出文件，凭据过期后查询返回404；下次启动时重放并可通过凭据查到"""
+    user_id = create_user('write-behind-spill@example.com')
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+    spill_path = os.path.join(tempfile.mkdtemp(), 'write_behind_failed.jsonl')
+    writer = WriteBehindWriter(linger=0, spill_path=spill_path)
+    original_add_all = writer._add_all
+    failures = []
+
+    def failing_add_all(batch):
+        # 批量写入和逐条重试都失败
+        failures.append(len(batch))
+        raise RuntimeError("模拟数据库故障")
+
+    writer._add_all = failing_add_all
+    original_timeout = app_module.WRITE_BEHIND_TOKEN_TIMEOUT
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    try:
+        writer.init_app(app)
+        turn = writer.enqueue(user_id, '问题', [0.5] * 384, '回答')
+        assert turn.wait(5) and turn.error is not None
+        assert failures == [1, 1] and writer.stats()['failed'] == 1
+        writer.shutdown()
+        with open(spill_path, encoding='utf-8') as spill_file:
+            assert [line.count(turn.token) for line in spill_file] == [1]
+
+        # 刚签发的凭据可能还在其他worker的队列中，超时后才判定为没有保存
+        location = f'/api/conversations/pending/{turn.token}'
+        assert client.get(location, headers=headers).status_code == 202
+        app_module.WRITE_BEHIND_TOKEN_TIMEOUT = 0
+        assert client.get(location, headers=headers).status_code == 404
+
+        # 重启后认领溢出文件并重新写入
+        replay_writer = WriteBehindWriter(linger=0, spill_path=spill_path)
+        replay_writer.init_app(app)
+        replay_writer.shutdown()
+        assert replay_writer.stats()['replayed'] == 1 and replay_writer.stats()['written'] == 1
+        assert os.listdir(os.path.dirname(spill_path)) == []
+        resolved = client.get(location, headers=headers)
+        assert resolved.status_code == 200 and resolved.get_json()['content'] == '回答'
+        with app.app_context():
+            ai_row = Conversation.query.filter_by(client_token=turn.token).one()
+            assert ai_row.reply_to.content == '问题' and ai_row.reply_to.embedding is not None
+    finally:
+        writer._add_all = original_add_all
+        writer.shutdown()
+        app_module.WRITE_BEHIND_TOKEN_TIMEOUT = original_timeout
+        delete_user(user_id)
+
+
+if __name__ == '__main__':
+    test_batched_writes()
+    test_read_your_writes()
+    test_failed_write_spilled_and_replayed()
@@ -2,7 +2,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { removeToken } from '../services/authService'; // Assuming authService exists
-import { getConversations, postMessage } from '../services/chatService';
+import { getConversations, postMessage, streamMessage } from '../services/chatService';
 import ReactMarkdown from 'react-markdown';
 import './ChatPage.css'; // 我们将为样式创建一个单独的CSS文件
 
@@ -12,7 +12,14 @@ const ChatPage = () => {
   const [inputMessage, setInputMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  // 正在流式接收的AI回复（未在接收时为null）
+  const [streamingText, setStreamingText] = useState(null);
+  // 继续加载更早记录的游标（没有更早的记录时为null）
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
+  // 加载更早的记录时保持当前滚动位置，不跳到底部
+  const skipScrollRef = useRef(false);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -23,6 +30,7 @@ const ChatPage = () => {
       try {
         const response = await getConversations();
         setMessages(response.conversations || []);
+        setOlderCursor(response.next_cursor ?? null);
       } catch (err) {
         setError('加载对话历史失败');
       }
@@ -31,8 +39,27 @@ const ChatPage = () => {
   }, []);
 
   useEffect(() => {
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
-  }, [messages]);
+  }, [messages, streamingText]);
+
+  const handleLoadOlder = async () => {
+    if (olderCursor === null || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await getConversations({ before: olderCursor });
+      skipScrollRef.current = true;
+      setMessages(prev => [...(response.conversations || []), ...prev]);
+      setOlderCursor(response.next_cursor ?? null);
+    } catch (err) {
+      setError('加载更早的对话失败');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
 
   const handleLogout = () => {
     removeToken();
@@ -54,12 +81,28 @@ const ChatPage = () => {
     setLoading(true);
     setError('');
 
+    let received = '';
     try {
-      const aiResponse = await postMessage(inputMessage);
+      // 逐段显示AI回复，收到done事件后替换为服务端保存的完整记录
+      const aiResponse = await streamMessage(userMessage.content, (delta) => {
+        received += delta;
+        setStreamingText(received);
+      });
       setMessages(prev => [...prev, aiResponse]);
     } catch (err) {
-      setError(err.error || '发送消息失败，请重试');
+      // 浏览器或代理不支持流式响应、且尚未收到任何内容时，回退到普通接口
+      if (!received && (err instanceof TypeError || err.streamUnsupported)) {
+        try {
+          const aiResponse = await postMessage(userMessage.content);
+          setMessages(prev => [...prev, aiResponse]);
+        } catch (fallbackErr) {
+          setError(fallbackErr.error || '发送消息失败，请重试');
+        }
+      } else {
+        setError(err.error || '发送消息失败，请重试');
+      }
     } finally {
+      setStreamingText(null);
       setLoading(false);
     }
   };
@@ -71,6 +114,11 @@ const ChatPage = () => {
         <button onClick={handleLogout} className="logout-button">退出登录</button>
       </div>
       <div className="message-list">
+        {olderCursor !== null && (
+          <button onClick={handleLoadOlder} className="load-older-button" disabled={loadingOlder}>
+            {loadingOlder ? '加载中...' : '加载更早的消息'}
+          </button>
+        )}
         {messages.map((msg, index) => (
           <div key={index} className={`message-bubble ${msg.role}`}>
             <div className="message-content">
@@ -81,7 +129,14 @@ const ChatPage = () => {
             </div>
           </div>
         ))}
-        {loading && (
+        {streamingText !== null && (
+          <div className="message-bubble ai">
+            <div className="message-content">
+              <ReactMarkdown>{streamingText}</ReactMarkdown>
+            </div>
+          </div>
+        )}
+        {loading && streamingText === null && (
           <div className="message-bubble ai">
             <div className="message-content loading-indicator">
               AI正在思考中...
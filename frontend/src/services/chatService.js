@@ -26,10 +26,11 @@ api.interceptors.request.use(
   }
 );
 
-// 获取对话历史
-export const getConversations = async () => {
+// 获取对话历史（游标分页）
+// 不传参数时返回最近一页；传入 { before: next_cursor } 可继续加载更早的记录
+export const getConversations = async (params = {}) => {
   try {
-    const response = await api.get('/conversations');
+    const response = await api.get('/conversations', { params });
     return response.data;
   } catch (error) {
     throw error.response?.data || { error: '获取对话历史失败' };
@@ -46,4 +47,67 @@ export const postMessage = async (content) => {
   } catch (error) {
     throw error.response?.data || { error: '发送消息失败' };
   }
-};
\ No newline at end of file
+};
+
+// 流式发送消息：通过SSE逐段接收AI回复
+// onToken(增量内容) 会被多次调用，返回值为服务端保存后的完整AI回复记录
+export const streamMessage = async (content, onToken) => {
+  const token = localStorage.getItem('access_token');
+  const response = await fetch(`${API_BASE_URL}/conversations/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ content }),
+  });
+
+  if (!response.ok) {
+    const data = await response.json().catch(() => null);
+    throw data || { error: '发送消息失败' };
+  }
+  if (!response.body) {
+    // 浏览器不支持读取流式响应体
+    throw { error: '发送消息失败', streamUnsupported: true };
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder('utf-8');
+  let buffer = '';
+  let result = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // 每条SSE消息以空行结束
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === 'token') {
+        onToken && onToken(payload.content);
+      } else if (event === 'done') {
+        result = payload;
+      } else if (event === 'error') {
+        throw payload;
+      }
+    }
+  }
+
+  if (!result) {
+    throw { error: '发送消息失败' };
+  }
+  return result;
+};